@@ -0,0 +1,214 @@
+"""This file implement the advisor of moves searching by expectimax"""
+from collections import OrderedDict
+from random import Random
+from time import perf_counter
+from core import *
+
+# value of a free cell of the field and the penalty for the end of the game in the evaluation
+FREE_CELL_VALUE = 2
+GAME_OVER_PENALTY = 1000
+NEIGHBOUR_STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, -1), (1, -1), (-1, 1))
+
+
+class SearchTimeout(Exception):
+    """Time of search is over"""
+    pass
+
+
+class Advisor:
+    """Find the best move by expectimax over the random next balls
+
+    Moves are max nodes, they are ordered by the length of the line the
+    moved ball makes and only the best beam_width of them are searched.
+    After a move without lines the next balls are put on the field, the
+    chance node averages samples of random cells for them. Moves and balls
+    are put on one copy of the field by push_move and push_spawn and taken
+    back by pop_move. Positions are
+    stored in a bounded LRU transposition table by the Zobrist hash of the
+    board. The search goes deeper by one move until the time budget is over
+    or the whole tree fits in the depth, the move of the last finished depth
+    is returned.
+    """
+
+    def __init__(self, time_budget=0.1, beam_width=4, root_width=8, samples=2, table_size=50000, seed=0):
+        """Initialize the advisor"""
+        self.time_budget = time_budget
+        self.beam_width = beam_width
+        self.root_width = root_width
+        self.samples = samples
+        self.table_size = table_size
+        self.seed = seed
+        self.table = OrderedDict()
+        self.zobrist_keys = {}
+        self.keys = None
+        self.deadline = 0
+        self.depth = 0
+        self.horizon_reached = False
+
+    def get_zobrist_keys(self, field):
+        """Get random 64-bit keys of every color in every cell of the field of the size"""
+        size = (field.width, field.height, field.number_of_color)
+        if size not in self.zobrist_keys:
+            random = Random(self.seed)
+            self.zobrist_keys[size] = [[0] + [random.getrandbits(64) for color in range(field.number_of_color)]
+                                       for index in range(field.width * field.height)]
+        return self.zobrist_keys[size]
+
+    def get_hash(self, field):
+        """Get the Zobrist hash of the board of the field"""
+        result = 0
+        for index, color in enumerate(field.dump_cells()):
+            result ^= self.keys[index][color]
+        return result
+
+    def evaluate(self, field):
+        """Get the value of the position: the score and free cells"""
+        return field.score + FREE_CELL_VALUE * len(field.free_cells)
+
+    def order_moves(self, field, limit):
+        """Get at most limit legal moves ordered by the length of the line the moved ball makes
+
+        Only colors of balls around a free cell can make a line longer than
+        one ball there, so lengths are counted for these pairs of a cell and
+        a color, and the balls of the color which reach the cell are taken
+        from the longest lines. Other legal moves fill the rest of the list.
+        """
+        balls = {}
+        for y in range(field.height):
+            for x in range(field.width):
+                color = field.get_color_of_ball(x, y)
+                if color is not None:
+                    balls.setdefault(color, []).append((x, y))
+        candidates = []
+        for end_x, end_y in field.free_cells:
+            colors = set()
+            for dx, dy in NEIGHBOUR_STEPS:
+                x, y = end_x + dx, end_y + dy
+                if 0 <= x < field.width and 0 <= y < field.height:
+                    colors.add(field.get_color_of_ball(x, y))
+            colors.discard(None)
+            for color in colors:
+                candidates.append((field.line_length(end_x, end_y, color), (end_x, end_y), color))
+        candidates.sort(key=lambda candidate: -candidate[0])
+        moves = []
+        for length, end, color in candidates:
+            for start in balls[color]:
+                if not field.can_reach(start[0], start[1], end[0], end[1]):
+                    continue
+                offset_x, offset_y = abs(end[0] - start[0]), abs(end[1] - start[1])
+                if max(offset_x, offset_y) < field.balls_in_line and \
+                        (not offset_x or not offset_y or offset_x == offset_y) and \
+                        field.line_length(end[0], end[1], color, start) < length:
+                    continue
+                moves.append((start, end))
+                if len(moves) == limit:
+                    return moves
+        for move in field.iter_legal_moves():
+            if len(moves) == limit:
+                break
+            if move not in moves:
+                moves.append(move)
+        return moves
+
+    def advise(self, field):
+        """Get the best move ((start x, start y), (end x, end y)) and its value
+
+        The move is None when there are no moves. The depth of the search is
+        left in the attribute depth.
+        """
+        self.deadline = perf_counter() + self.time_budget
+        self.keys = self.get_zobrist_keys(field)
+        root = field.copy()
+        moves = self.order_moves(root, self.root_width)
+        self.depth = 0
+        if not moves:
+            return None, self.evaluate(root)
+        root_hash = self.get_hash(root)
+        best_move, best_value = moves[0], None
+        depth = 1
+        self.horizon_reached = True
+        while self.horizon_reached:
+            self.horizon_reached = False
+            try:
+                best_move, best_value = max(((self._move_value(root, root_hash, move, depth), move)
+                                             for move in moves), key=lambda item: item[0])[::-1]
+            except SearchTimeout:
+                break
+            self.depth = depth
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+            depth += 1
+        return best_move, best_value
+
+    def _check_time(self, depth):
+        """Stop the search deeper than one move when the time is over"""
+        if depth > 1 and perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+    def _store(self, key, value):
+        """Store the value of the position and whether its search reached the horizon"""
+        self.table[key] = value
+        if len(self.table) > self.table_size:
+            self.table.popitem(last=False)
+
+    def _max_value(self, field, position_hash, depth, search_depth):
+        """Get the value of the position where the player moves"""
+        if depth == 0:
+            self.horizon_reached = True
+            return self.evaluate(field)
+        self._check_time(search_depth)
+        key = (position_hash, tuple(ball.color for ball in field.next_balls), field.score, depth)
+        if key in self.table:
+            self.table.move_to_end(key)
+            value, horizon_reached = self.table[key]
+            self.horizon_reached |= horizon_reached
+            return value
+        outer_horizon_reached = self.horizon_reached
+        self.horizon_reached = False
+        moves = self.order_moves(field, self.beam_width)
+        if moves:
+            value = max(self._move_value(field, position_hash, move, depth, search_depth) for move in moves)
+        else:
+            value = self.evaluate(field)
+        self._store(key, (value, self.horizon_reached))
+        self.horizon_reached |= outer_horizon_reached
+        return value
+
+    def _move_value(self, field, position_hash, move, depth, search_depth=None):
+        """Get the value of the move"""
+        if search_depth is None:
+            search_depth = depth
+        (start_x, start_y), (end_x, end_y) = move
+        color = field.get_color_of_ball(start_x, start_y)
+        lines = field.push_move(start_x, start_y, end_x, end_y)
+        try:
+            if lines is not None:
+                return self._max_value(field, self.get_hash(field), depth - 1, search_depth)
+            position_hash ^= self.keys[start_y * field.width + start_x][color] ^ \
+                self.keys[end_y * field.width + end_x][color]
+            return self._chance_value(field, position_hash, depth, search_depth)
+        finally:
+            field.pop_move()
+
+    def _chance_value(self, field, position_hash, depth, search_depth):
+        """Get the mean value of samples of the next balls put on random free cells"""
+        random = Random(position_hash ^ depth)
+        free_cells = sorted(field.free_cells, key=lambda cell: (cell[1], cell[0]))
+        if len(free_cells) <= field.number_of_next_ball:
+            return self.evaluate(field) - GAME_OVER_PENALTY
+        total = 0
+        for _ in range(self.samples):
+            cells = random.sample(free_cells, len(field.next_balls))
+            sample_hash = position_hash
+            for ball, (x, y) in zip(field.next_balls, cells):
+                sample_hash ^= self.keys[y * field.width + x][ball.color]
+            next_balls = [Ball.shared(random.randrange(field.number_of_color) + 1)
+                          for _ in range(field.number_of_next_ball)]
+            lines = field.push_spawn(cells, next_balls)
+            try:
+                if lines is not None:
+                    sample_hash = self.get_hash(field)
+                total += self._max_value(field, sample_hash, depth - 1, search_depth)
+            finally:
+                field.pop_move()
+        return total / self.samples
@@ -0,0 +1,335 @@
+"""This file implement the bitboard engine of the game"""
+from core import *
+
+
+def popcount(mask):
+    """Count set bits of the mask"""
+    return bin(mask).count("1")
+
+
+def iterate_bits(mask):
+    """Iterate indexes of set bits of the mask"""
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+
+class BitboardField(Field):
+    """Game Field storing every color as a bit mask
+
+    Cell (x, y) is the bit number y * stride + x. The stride is one bit
+    wider than the field, so the padding column stops horizontal and
+    diagonal shifts from wrapping to the next row.
+    """
+
+    def _init_field(self):
+        """Initialize field"""
+        self.stride = self.width + 1
+        self.shifts = (1, self.stride, self.stride + 1, self.stride - 1)
+        row_mask = (1 << self.width) - 1
+        self.board_mask = 0
+        for rows in range(self.height):
+            self.board_mask |= row_mask << (rows * self.stride)
+        self.clear_field()
+
+    def _bit(self, x, y):
+        """Get the bit of the cell by coordinates"""
+        return 1 << (y * self.stride + x)
+
+    def _coordinates(self, index):
+        """Get coordinates of the cell by index of the bit"""
+        y, x = divmod(index, self.stride)
+        return x, y
+
+    def _neighbours(self, mask):
+        """Get mask of cells adjacent to the cells of the mask"""
+        return ((mask << 1) | (mask >> 1) | (mask << self.stride) | (mask >> self.stride)) & self.board_mask
+
+    @property
+    def empty_mask(self):
+        """Mask of the free cells"""
+        return self.board_mask & ~self.occupied
+
+    @property
+    def field(self):
+        """The field as a list of rows (read only copy)"""
+        return [[self.get_ball(columns, rows) for columns in range(self.width)] for rows in range(self.height)]
+
+    @property
+    def free_cells(self):
+        """List of the free cells"""
+        return [self._coordinates(index) for index in iterate_bits(self.empty_mask)]
+
+    def clear_field(self):
+        """Clear the game field"""
+        self.occupied = 0
+        self.colors = {}
+
+    def _copy_cells(self, field):
+        """Copy masks of colors of the field"""
+        self.colors = dict(field.colors)
+
+    def dump_cells(self):
+        """Get colors of all cells row by row as bytes (0 for a free cell)"""
+        cells = bytearray(self.width * self.height)
+        for color, mask in self.colors.items():
+            for index in iterate_bits(mask):
+                x, y = self._coordinates(index)
+                cells[y * self.width + x] = color
+        return bytes(cells)
+
+    def dump_free_order(self):
+        """Free cells always go row by row"""
+        return b""
+
+    def load_cells(self, cells, free_order=b""):
+        """Put balls on the field by colors of cells got from dump_cells"""
+        self.clear_field()
+        for index, color in enumerate(cells):
+            if color:
+                bit = self._bit(index % self.width, index // self.width)
+                self.colors[color] = self.colors.get(color, 0) | bit
+                self.occupied |= bit
+
+    def get_ball(self, x, y):
+        """Get a ball by coordinates"""
+        color = self.get_color_of_ball(x, y)
+        if color is not None:
+            return Ball.shared(color)
+
+    def get_color_of_ball(self, x, y):
+        """Get the color of the ball be coordinates"""
+        bit = self._bit(x, y)
+        if self.occupied & bit:
+            for color, mask in self.colors.items():
+                if mask & bit:
+                    return color
+
+    def set_ball(self, x, y, ball):
+        """Set the ball by coordinates"""
+        bit = self._bit(x, y)
+        if self.occupied & bit:
+            raise ValueError(f"Cell {(x, y)} is not free")
+        self.colors[ball.color] = self.colors.get(ball.color, 0) | bit
+        self.occupied |= bit
+
+    def delete_ball(self, x, y):
+        """Delete a ball by coordinates"""
+        bit = self._bit(x, y)
+        for color, mask in self.colors.items():
+            if mask & bit:
+                self.colors[color] = mask & ~bit
+        self.occupied &= ~bit
+
+    def _free_slot(self, x, y):
+        """Free cells have no order on bitboards"""
+        return None
+
+    def _take_back_ball(self, x, y, slot):
+        """Delete the ball put by set_ball"""
+        self.delete_ball(x, y)
+
+    def set_next_balls(self):
+        """install the next balls on field"""
+        free = self.empty_mask
+        amount_free = popcount(free)
+        if amount_free <= self.number_of_next_ball:
+            raise FieldFullException()
+        self.set_balls.clear()
+        for ball in self.next_balls:
+            bits = iterate_bits(free)
+            for _ in range(self.draw_random(amount_free)):
+                next(bits)
+            coordinates = self._coordinates(next(bits))
+            self.set_ball(coordinates[0], coordinates[1], ball)
+            self.set_balls.append(coordinates)
+            self.notify("spawn", coordinates[0], coordinates[1], ball.color)
+            free &= ~self._bit(coordinates[0], coordinates[1])
+            amount_free -= 1
+        self.make_next_balls()
+
+    def try_move(self, start_x, start_y, end_x, end_y):
+        """Try move ball in needed coordinate"""
+        start = self._bit(start_x, start_y)
+        target = self._bit(end_x, end_y)
+        if self.occupied & target or not self.occupied & start:
+            return False
+        empty = self.empty_mask
+        reached = start
+        while True:
+            front = self._neighbours(reached) & empty & ~reached
+            if front & target:
+                return True
+            if not front:
+                return False
+            reached |= front
+
+    def can_reach(self, start_x, start_y, end_x, end_y):
+        """Check whether the ball can reach the free cell"""
+        return self.try_move(start_x, start_y, end_x, end_y)
+
+    def _reachable_mask(self, start):
+        """Get mask of the free cells reachable from the cell"""
+        empty = self.empty_mask
+        reached = 0
+        front = self._neighbours(start) & empty
+        while front:
+            reached |= front
+            front = self._neighbours(front) & empty & ~reached
+        return reached
+
+    def reachable_cells(self, x, y):
+        """Get all free cells the ball can reach"""
+        start = self._bit(x, y)
+        if not self.occupied & start:
+            return []
+        return [self._coordinates(index) for index in iterate_bits(self._reachable_mask(start))]
+
+    def _empty_components(self):
+        """Split the free cells into masks of connected components"""
+        empty = self.empty_mask
+        components = []
+        remaining = empty
+        while remaining:
+            reached = remaining & -remaining
+            front = reached
+            while front:
+                front = self._neighbours(front) & empty & ~reached
+                reached |= front
+            components.append(reached)
+            remaining &= ~reached
+        return components
+
+    def iter_legal_moves(self, only_lines=False):
+        """Generate all legal moves from components adjacent to every ball"""
+        components = self._empty_components()
+        for start in iterate_bits(self.occupied):
+            start_x, start_y = self._coordinates(start)
+            around = self._neighbours(1 << start)
+            for component in components:
+                if not component & around:
+                    continue
+                for end in iterate_bits(component):
+                    end_x, end_y = self._coordinates(end)
+                    if not only_lines or self.makes_line(start_x, start_y, end_x, end_y):
+                        yield (start_x, start_y), (end_x, end_y)
+
+    def find_path(self, start_x, start_y, end_x, end_y):
+        """Find the shortest path of the ball as a list of cells from start to end"""
+        start = self._bit(start_x, start_y)
+        target = self._bit(end_x, end_y)
+        if self.occupied & target or not self.occupied & start:
+            return
+        empty = self.empty_mask
+        reached = start
+        fronts = [start]
+        while not fronts[-1] & target:
+            front = self._neighbours(fronts[-1]) & empty & ~reached
+            if not front:
+                return
+            reached |= front
+            fronts.append(front)
+        path = [(end_x, end_y)]
+        current = target
+        for front in reversed(fronts[:-1]):
+            previous = self._neighbours(current) & front
+            current = previous & -previous
+            path.append(self._coordinates(current.bit_length() - 1))
+        path.reverse()
+        return path
+
+    def _line_starts(self, mask, shift):
+        """Get mask of the first cells of all runs of balls_in_line bits along the shift"""
+        starts = mask
+        length = 1
+        while starts and length < self.balls_in_line:
+            step = min(length, self.balls_in_line - length)
+            starts &= starts >> (shift * step)
+            length += step
+        return starts
+
+    def find_full_lines(self, x, y):
+        """Find all full lines starting by coordinates of ball"""
+        color = self.get_color_of_ball(x, y)
+        if color is None:
+            return
+        mask = self.colors[color]
+        index = y * self.stride + x
+        for shift in self.shifts:
+            if not self._line_starts(mask, shift):
+                continue
+            ball_for_delete = []
+            current = index
+            while current >= 0 and mask >> current & 1:
+                ball_for_delete.append(self._coordinates(current))
+                current -= shift
+            current = index + shift
+            while mask >> current & 1:
+                ball_for_delete.append(self._coordinates(current))
+                current += shift
+            if len(ball_for_delete) >= self.balls_in_line:
+                return ball_for_delete
+
+    def find_lines_through(self, cells):
+        """Find the cells of full lines through the cells (None without lines)"""
+        covered = 0
+        for x, y in cells:
+            color = self.get_color_of_ball(x, y)
+            if color is None:
+                continue
+            mask = self.colors[color]
+            index = y * self.stride + x
+            for shift in self.shifts:
+                line = 1 << index
+                current = index - shift
+                while current >= 0 and mask >> current & 1:
+                    line |= 1 << current
+                    current -= shift
+                current = index + shift
+                while mask >> current & 1:
+                    line |= 1 << current
+                    current += shift
+                if popcount(line) >= self.balls_in_line:
+                    covered |= line
+        if covered:
+            return [self._coordinates(index) for index in iterate_bits(covered)]
+
+    def colors_array(self):
+        """Get the field as a numpy array of colors (0 for a free cell)"""
+        colors = numpy.zeros((self.height, self.stride), dtype=numpy.int8)
+        flat = colors.reshape(-1)
+        for color, mask in self.colors.items():
+            flat[list(iterate_bits(mask))] = color
+        return colors[:, :self.width]
+
+    def scan_all_lines(self):
+        """Find the cells of all full lines of the field in all directions"""
+        covered = 0
+        for mask in self.colors.values():
+            for shift in self.shifts:
+                starts = self._line_starts(mask, shift)
+                for step in range(self.balls_in_line if starts else 0):
+                    covered |= starts << (step * shift)
+        if covered:
+            return [self._coordinates(index) for index in iterate_bits(covered)]
+
+    def line_length(self, x, y, color, ignore=None):
+        """Get the longest line the ball of the color would make in the free cell"""
+        mask = self.colors.get(color, 0)
+        if ignore is not None:
+            mask &= ~self._bit(ignore[0], ignore[1])
+        index = y * self.stride + x
+        longest = 0
+        for shift in self.shifts:
+            length = 1
+            current = index - shift
+            while current >= 0 and mask >> current & 1:
+                length += 1
+                current -= shift
+            current = index + shift
+            while mask >> current & 1:
+                length += 1
+                current += shift
+            longest = max(longest, length)
+        return longest
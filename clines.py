@@ -1,5 +1,8 @@
 """This file implement console version of program"""
 import sys
+import json
+import argparse
+from time import perf_counter
 from colorama import Fore, Back, Style, init
 import logging
 
@@ -9,62 +12,179 @@ logging.basicConfig(filename="console_lines.log", level=logging.INFO)
 try:
     from core import *
     from driver import *
+    from advisor import Advisor
 except Exception as e:
     LOGGER.error(e)
     sys.exit(f"Game modules not found: {e}")
 
 COLOR = {1: Fore.RED, 2: Fore.GREEN, 3: Fore.YELLOW, 4: Fore.BLUE, 5: Fore.MAGENTA, 6: Fore.CYAN, 7: Fore.WHITE}
-ALL_ACTIONS = ["help", "make_step", "reset", "end"]
+ALL_ACTIONS = ["help", "make_step", "undo", "redo", "hint", "reset", "end"]
 
 
 def print_field(game_field):
-    """Print game_field in console"""
-    counter = 0
-    print("\n     0 1 2 3 4 5 6 7 8")
-    print("    ------------------")
-    for rows in range(game_field.game.height):
-        string = f" {counter} | "
-        for columns in range(game_field.game.width):
-            if game_field.game.field[rows][columns] is None:
-                string += Fore.BLACK + Style.BRIGHT + "X " + Style.RESET_ALL
-            else:
-                ball_color = game_field.game.get_color_of_ball(columns, rows)
-                string += COLOR.get(ball_color) + Style.BRIGHT + "O " + Style.RESET_ALL
-        if counter == 1:
-            string += Style.BRIGHT + f"         Scores: {game_field.game.score}" + Style.RESET_ALL
-        counter += 1
-        print(string)
+    """Print game_field in console (nothing in the batch mode)"""
+    if game_field.renderer is not None:
+        game_field.renderer.render(game_field.game)
+
+
+class ConsoleRenderer:
+    """Draw the field in the console redrawing only changed cells
+
+    The board is kept at the top of the screen and the last drawn frame is
+    remembered. Next frames move the cursor to changed cells only, and the
+    whole frame goes to the console in one write. Commands and messages are
+    printed below the board and are cleared on the next frame.
+    """
+
+    def __init__(self, stream=None):
+        """Initialize the renderer (it writes to sys.stdout by default)"""
+        self.stream = stream
+        self.size = None
+        self.cells = None
+        self.score = None
+
+    def invalidate(self):
+        """Draw the whole board on the next frame"""
+        self.size = None
+
+    def get_cell_text(self, color):
+        """Get the text of the cell with the ball of the color (0 for a free cell)"""
+        if color:
+            return COLOR.get(color) + Style.BRIGHT + "O" + Style.RESET_ALL
+        return Fore.BLACK + Style.BRIGHT + "X" + Style.RESET_ALL
+
+    def render(self, field):
+        """Draw the field"""
+        cells = field.dump_cells()
+        label_width = len(str(max(field.width, field.height) - 1))
+        cell_width = label_width + 1
+        left = label_width + 4
+        buffer = []
+        if self.size != (field.width, field.height):
+            buffer.append("\x1b[2J\x1b[H")
+            buffer.append(" " * left + "".join(f"{x:<{cell_width}}" for x in range(field.width)) + "\n")
+            buffer.append(" " * (left - 1) + "-" * (field.width * cell_width) + "\n")
+            for y in range(field.height):
+                row = cells[y * field.width:(y + 1) * field.width]
+                buffer.append(f" {y:>{label_width}} | " +
+                              "".join(self.get_cell_text(color) + " " * label_width for color in row) + "\n")
+            self.score = None
+        else:
+            for index, color in enumerate(cells):
+                if color != self.cells[index]:
+                    y, x = divmod(index, field.width)
+                    buffer.append(f"\x1b[{y + 3};{left + x * cell_width + 1}H" + self.get_cell_text(color))
+        if field.score != self.score:
+            buffer.append(f"\x1b[{field.height + 4};1H\x1b[2K" + Style.BRIGHT + f"Scores: {field.score}" + Style.RESET_ALL)
+        buffer.append(f"\x1b[{field.height + 5};1H\x1b[J")
+        stream = self.stream or sys.stdout
+        stream.write("".join(buffer))
+        stream.flush()
+        self.size = (field.width, field.height)
+        self.cells = cells
+        self.score = field.score
 
 
 class ConsoleMode:
     """Class console version"""
 
-    def __init__(self):
-        """Initialize class"""
-        init()
-        self._init_field()
+    def __init__(self, engine="list", size=9, player=None, seed=None, batch=False):
+        """Initialize class
+
+        In the batch mode nothing is printed or asked and the end of the game
+        raises GameFinished instead of the exit. There are no hints and no
+        history of turns there, so undo and redo are incorrect commands.
+        """
+        if not batch:
+            init()
+        self.engine = engine
+        self.size = size
+        self.seed = seed
+        self.batch = batch
+        self.game_over = False
+        self.renderer = None if batch else ConsoleRenderer()
+        self._advisor = None
+        self.history = None if batch else History()
+        self._init_field(player)
         self.arguments = None
 
-    def _init_field(self):
+    def _init_field(self, player_name=None):
         """Initialize field for play"""
-        player_name = input("\nInput your name: ")
+        if player_name is None and not self.batch:
+            player_name = input("\nInput your name: ")
         if player_name == "" or player_name is None:
             player_name = "Player"
-        self.game = Field(player=player_name)
+        self.game = create_field(self.size, player_name, self.engine, self.seed)
         self.game.set_next_balls()
-        LOGGER.info(f"Game field was initialized. Size: 9. Player name: {player_name}")
-        self.print_help()
+        if self.history is not None:
+            self.history.attach(self.game)
+        LOGGER.info(f"Game field was initialized. Size: {self.size}. Player name: {player_name}")
         print_field(self)
+        self.print_help()
+
+    def print_message(self, text):
+        """Print the text below the board (nothing in the batch mode)
+
+        The text can scroll the console, so the next frame draws the whole
+        board again instead of changed cells at their old places.
+        """
+        if self.batch:
+            return
+        print(text)
+        self.renderer.invalidate()
 
     def print_help(self):
         """Print help"""
-        print("\n=================================================\n"
-              "This is console version of game \"Lines\"\n "
-              " Possible commands:\n"
-              "  # make_step [start x] [start y] [end x] [end y]\n"
-              "  # reset\n"
-              "  # end\n"
-              "=================================================")
+        self.print_message("\n=================================================\n"
+                           "This is console version of game \"Lines\"\n "
+                           " Possible commands:\n"
+                           "  # make_step [start x] [start y] [end x] [end y]\n"
+                           "  # undo\n"
+                           "  # redo\n"
+                           "  # hint\n"
+                           "  # reset\n"
+                           "  # end\n"
+                           "=================================================")
+
+    @property
+    def advisor(self):
+        """Advisor of moves (it is created on first use)"""
+        if self._advisor is None:
+            self._advisor = Advisor()
+        return self._advisor
+
+    def print_hint(self):
+        """Print the best move (nothing in the batch mode)"""
+        if self.batch:
+            return
+        move, value = self.advisor.advise(self.game)
+        LOGGER.info(f"Hint: {move}, value {value}, depth {self.advisor.depth}.")
+        if move is None:
+            self.print_message("There are no moves")
+        else:
+            self.print_message(f"Hint: make_step {move[0][0]} {move[0][1]} {move[1][0]} {move[1][1]} "
+                               f"(value {value:.1f})")
+
+    def undo(self):
+        """Take back the last turn"""
+        if self.history is None:
+            raise IncorrectCommand
+        self._show_turn(self.history.undo(), "Nothing to undo")
+
+    def redo(self):
+        """Make again the taken back turn"""
+        if self.history is None:
+            raise IncorrectCommand
+        self._show_turn(self.history.redo(), "Nothing to redo")
+
+    def _show_turn(self, field, message):
+        """Go on with the field of the history (print the message without it)"""
+        if field is None:
+            self.print_message(message)
+            return
+        self.game = field
+        LOGGER.info(f"Game went to turn {self.history.position}. Score: {field.score}.")
+        print_field(self)
 
     def reset_game(self):
         """Reset the game"""
@@ -74,8 +194,11 @@ class ConsoleMode:
 
     def finish_game(self):
         """Finish the game"""
+        if self.batch:
+            LOGGER.info(f"Game over with {self.game.score} points")
+            raise GameFinished()
         print("{}, you scored : {} points".format(self.game.player, self.game.score))
-        add_record(self.game.player, self.game.score)
+        add_record(self.game.player, self.game.score, self.game.width)
         LOGGER.info(f"Game over with {self.game.score} points")
         sys.exit("Game Over!")
 
@@ -84,35 +207,36 @@ class ConsoleMode:
         array = []
         if self.arguments is None or len(self.arguments) < 4:
             raise IncorrectCommand
-        for argument in self.arguments:
-            if int(argument) < 0 or int(argument) > 8:
+        for number, argument in enumerate(self.arguments):
+            limit = self.game.width if number % 2 == 0 else self.game.height
+            if int(argument) < 0 or int(argument) >= limit:
                 raise IncorrectStep
             array.append(int(argument))
         else:
             if self.game.try_move(array[0], array[1], array[2], array[3]):
                 self.game.make_step(array[0], array[1], array[2], array[3])
-                ball_for_delete = self.game.find_full_lines(array[2], array[3])
+                ball_for_delete = self.game.scan_all_lines()
                 if ball_for_delete is None:
                     try:
                         self.game.set_next_balls()
                         LOGGER.info(f"Following {self.game.number_of_next_ball} balls are installed.")
                     except FieldFullException:
+                        self.game_over = True
                         self.finish_game()
                         LOGGER.info("Field full. Game over.")
-                else:
+                    ball_for_delete = self.game.scan_all_lines()
+                if ball_for_delete is not None:
                     self.game.delete_full_lines(ball_for_delete)
-                    for coordinates in self.game.set_balls:
-                        array = self.game.find_full_lines(coordinates[0], coordinates[1])
-                        if array is not None:
-                            self.game.delete_full_lines(array)
-                            LOGGER.info(
-                                f"Found full lines: {ball_for_delete} and deleted. Score: {self.game.score}.")
+                    LOGGER.info(f"Found full lines: {ball_for_delete} and deleted. Score: {self.game.score}.")
             else:
                 raise IncorrectStep()
         self.arguments = None
         print_field(self)
 
     actions = {"help": print_help,
+               "hint": print_hint,
+               "undo": undo,
+               "redo": redo,
                "reset": reset_game,
                "end": finish_game,
                "make_step": make_step}
@@ -128,6 +252,11 @@ class IncorrectStep(Exception):
     pass
 
 
+class GameFinished(Exception):
+    """The game of the batch mode is finished"""
+    pass
+
+
 def read_argument(game_field):
     """Read argument"""
     while True:
@@ -140,9 +269,45 @@ def read_argument(game_field):
                 finish_arguments = get_finish_arguments(array_arguments)
                 command_handler(finish_arguments, game_field)
             except IncorrectCommand:
-                print("Incorrect command")
+                game_field.print_message("Incorrect command")
             except IncorrectStep:
-                print("Incorrect step")
+                game_field.print_message("Incorrect step")
+
+
+def run_batch(game_field, commands):
+    """Run commands (lines of a script) and get the summary of the game
+
+    Empty lines and lines starting with "#" are skipped. Commands stop at
+    the end of the game or at the command "end".
+    """
+    summary = {"player": game_field.game.player, "engine": game_field.engine, "size": game_field.size,
+               "seed": game_field.seed, "commands": 0, "steps": 0, "incorrect_commands": 0,
+               "incorrect_steps": 0, "result": "script finished"}
+    started = perf_counter()
+    for line in commands:
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        summary["commands"] += 1
+        try:
+            finish_arguments = get_finish_arguments(line.split(" "))
+            command = finish_arguments[0]
+            command_handler(finish_arguments, game_field)
+        except IncorrectCommand:
+            summary["incorrect_commands"] += 1
+        except (IncorrectStep, ValueError):
+            summary["incorrect_steps"] += 1
+        except GameFinished:
+            summary["steps"] += command == "make_step"
+            summary["result"] = "game over" if game_field.game_over else "ended"
+            break
+        else:
+            summary["steps"] += command == "make_step"
+    seconds = perf_counter() - started
+    summary["score"] = game_field.game.score
+    summary["seconds"] = round(seconds, 6)
+    summary["commands_per_second"] = round(summary["commands"] / seconds, 1) if seconds else None
+    return summary
 
 
 def command_handler(finish_arguments, game_field):
@@ -173,5 +338,24 @@ def get_finish_arguments(array_arguments):
 
 
 if __name__ == '__main__':
-    game = ConsoleMode()
-    read_argument(game)
+    parser = argparse.ArgumentParser(description="Console version of game \"Lines\"")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="list", help="engine of the game field")
+    parser.add_argument("--size", type=int, choices=FIELD_SIZES, default=9, metavar="5..15",
+                        help="size of the field")
+    parser.add_argument("--seed", type=int, help="seed of the random balls")
+    parser.add_argument("--player", help="name of the player")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run commands of the file (\"-\" for stdin) and print the summary as JSON")
+    arguments = parser.parse_args()
+    if arguments.batch is None:
+        game = ConsoleMode(arguments.engine, arguments.size, arguments.player, arguments.seed)
+        read_argument(game)
+    else:
+        LOGGER.setLevel(logging.WARNING)
+        game = ConsoleMode(arguments.engine, arguments.size, arguments.player, arguments.seed, batch=True)
+        if arguments.batch == "-":
+            result = run_batch(game, sys.stdin)
+        else:
+            with open(arguments.batch) as script:
+                result = run_batch(game, script)
+        print(json.dumps(result))
@@ -1,36 +1,238 @@
 """This file implement the logical of the program"""
-from random import randint
+from array import array
+from collections import deque
+from functools import lru_cache
+from random import Random, randint, randrange
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+LINE_DIRECTIONS = ((1, 0), (0, 1), (1, 1), (-1, 1))
+SPAWN_STREAM_SIZE = 64
+# label of a cell with a ball in the labels of components
+NO_LABEL = 0xFFFF
+
+
+@lru_cache(maxsize=None)
+def adjacent_cells(width, height):
+    """Get indexes of the cells adjacent to every cell of the field (shared by all fields of a size)"""
+    adjacent = []
+    for rows in range(height):
+        for columns in range(width):
+            adjacent.append(tuple((rows + dy) * width + columns + dx for dx, dy in STEPS
+                                  if 0 <= columns + dx < width and 0 <= rows + dy < height))
+    return tuple(adjacent)
+
+
+@lru_cache(maxsize=None)
+def cell_coordinates(width, height):
+    """Get coordinates of every cell by its index (shared by all fields of a size)"""
+    return tuple((index % width, index // width) for index in range(width * height))
+
+
+def full_lines_mask(colors, balls_in_line):
+    """Get the mask of cells of all full lines of the array of colors (numpy is required)
+
+    The last two axes of the array are rows and columns, 0 is a free cell.
+    Every window of balls_in_line cells in every direction is checked at once
+    by comparing shifted slices of the array.
+    """
+    height, width = colors.shape[-2:]
+    result = numpy.zeros(colors.shape, dtype=bool)
+    span = balls_in_line - 1
+    for dx, dy in LINE_DIRECTIONS:
+        left = max(0, -span * dx)
+        right = width - max(0, span * dx)
+        bottom = height - span * dy
+        if left >= right or bottom <= 0:
+            continue
+        first = colors[..., 0:bottom, left:right]
+        starts = first != 0
+        for step in range(1, balls_in_line):
+            starts &= colors[..., step * dy:bottom + step * dy, left + step * dx:right + step * dx] == first
+        for step in range(balls_in_line):
+            result[..., step * dy:bottom + step * dy, left + step * dx:right + step * dx] |= starts
+    return result
+
+
+@lru_cache(maxsize=None)
+def line_neighbours(width, height):
+    """Get for every direction of lines the index of the next cell of every cell (-1 out of the field)
+
+    Directions go in pairs: 2 * number is the direction of LINE_DIRECTIONS[number],
+    2 * number + 1 is the opposite one.
+    """
+    neighbours = []
+    for dx, dy in LINE_DIRECTIONS:
+        for sign in (1, -1):
+            neighbours.append(tuple((rows + sign * dy) * width + columns + sign * dx
+                                    if 0 <= columns + sign * dx < width and 0 <= rows + sign * dy < height else -1
+                                    for rows in range(height) for columns in range(width)))
+    return tuple(neighbours)
 
 
 class Ball:
-    """Class implementing a ball object"""
+    """Class implementing a ball object
+
+    A ball is just its color, the selection is kept by the game board.
+    Fields put shared balls (see shared) on cells, so they must not be changed.
+    """
+    __slots__ = ("color",)
 
     def __init__(self, color=0):
         """Initialize a ball object"""
         self.color = color
-        self.selected = False
 
     def __eq__(self, other):
         """Define the equality of balls"""
         return self.color == other.color
 
+    def __setstate__(self, state):
+        """Restore the ball from pickle (old saves keep the ball in a dict with the selection flag)"""
+        if isinstance(state, tuple):
+            state = state[1]
+        self.color = state["color"]
+
+    @classmethod
+    def shared(cls, color):
+        """Get the shared ball of the color"""
+        ball = SHARED_BALLS.get(color)
+        if ball is None:
+            ball = SHARED_BALLS[color] = cls(color)
+        return ball
+
     def set_color(self, color):
-        """Set the color (number) of the ball"""
+        """Set the color (number) of the ball, a shared ball can not be changed"""
+        self._check_not_shared()
         self.color = color
 
     def set_random_color(self, number_of_colors):
-        """Determine the color of the ball"""
+        """Determine the color of the ball, a shared ball can not be changed"""
+        self._check_not_shared()
         self.color = randint(1, number_of_colors)
 
+    def _check_not_shared(self):
+        """Raise SharedBallError for a shared ball, changing it changes balls of all fields"""
+        if SHARED_BALLS.get(self.color) is self:
+            raise SharedBallError(f"Shared ball of color {self.color} can not be changed")
+
+
+SHARED_BALLS = {}
+
+
+class FreeCells:
+    """Index of the free cells of the field
+
+    Indexes of cells are kept in an array, the slot of every cell in this
+    array is kept in a position-indexed array, so add, remove, membership
+    and random choice take constant time. Cells are given as coordinates
+    from the table shared by all fields of the size.
+    """
+
+    def __init__(self, width, height):
+        """Initialize an empty index"""
+        self.width = width
+        self.height = height
+        self.coordinates = cell_coordinates(width, height)
+        self.cells = array("H")
+        self.slots = array("h", [-1]) * (width * height)
+
+    def __len__(self):
+        """Amount of the free cells"""
+        return len(self.cells)
+
+    def __iter__(self):
+        """Iterate the free cells"""
+        return map(self.coordinates.__getitem__, self.cells)
+
+    def __getitem__(self, index):
+        """Get a free cell by its slot"""
+        return self.coordinates[self.cells[index]]
+
+    def __contains__(self, coordinates):
+        """Check whether the cell is free"""
+        x, y = coordinates
+        return 0 <= x < self.width and 0 <= y < self.height and self.slots[y * self.width + x] != -1
+
+    def __getstate__(self):
+        """Get the state for pickle without the shared table of coordinates"""
+        state = self.__dict__.copy()
+        del state["coordinates"]
+        return state
+
+    def __setstate__(self, state):
+        """Restore the index from pickle"""
+        self.__dict__.update(state)
+        self.coordinates = cell_coordinates(self.width, self.height)
+
+    def fill(self):
+        """Mark all cells of the field as free"""
+        self.cells = array("H", range(self.width * self.height))
+        self.slots = array("h", range(self.width * self.height))
+
+    def clear(self):
+        """Mark all cells of the field as occupied"""
+        self.cells = array("H")
+        self.slots = array("h", [-1]) * (self.width * self.height)
+
+    def copy(self):
+        """Get a copy of the index"""
+        free_cells = FreeCells(self.width, self.height)
+        free_cells.cells = array("H", self.cells)
+        free_cells.slots = array("h", self.slots)
+        return free_cells
+
+    def add(self, coordinates):
+        """Mark the cell as free"""
+        index = coordinates[1] * self.width + coordinates[0]
+        if self.slots[index] == -1:
+            self.slots[index] = len(self.cells)
+            self.cells.append(index)
+
+    def remove(self, coordinates):
+        """Mark the cell as occupied"""
+        index = coordinates[1] * self.width + coordinates[0]
+        slot = self.slots[index]
+        if slot == -1:
+            raise ValueError(f"Cell {coordinates} is not free")
+        last = self.cells.pop()
+        if slot != len(self.cells):
+            self.cells[slot] = last
+            self.slots[last] = slot
+        self.slots[index] = -1
+
+    def insert(self, coordinates, slot):
+        """Mark the cell as free in the slot it had, it takes back remove which freed the slot"""
+        index = coordinates[1] * self.width + coordinates[0]
+        if slot != len(self.cells):
+            moved = self.cells[slot]
+            self.slots[moved] = len(self.cells)
+            self.cells.append(moved)
+            self.cells[slot] = index
+        else:
+            self.cells.append(index)
+        self.slots[index] = slot
+
+    def choice(self, draw=randrange):
+        """Get a random free cell, draw(n) gives a random number from 0 to n - 1"""
+        return self.coordinates[self.cells[draw(len(self.cells))]]
+
 
 class Field:
     """Game Field"""
 
-    def __init__(self, amount_cells=9, player="Player"):
+    def __init__(self, amount_cells=9, player="Player", seed=None):
         """Initialize game field"""
         self.height = amount_cells
         self.width = amount_cells
         self.player = player
+        self.observers = []
+        self.random = Random(seed)
+        self.spawn_stream = array("I")
+        self.spawn_position = 0
         self._set_number_of_ball_per_line()
         self._set_number_of_next_ball()
         self._set_number_of_color()
@@ -39,16 +241,216 @@ class Field:
         self.make_next_balls()
         self.set_balls = []
         self.score = 0
+        self.undo_stack = []
 
     def _init_field(self):
         """Initialize field"""
-        self.field = []
-        self.free_cells = []
-        for rows in range(self.height):
-            self.field.append([])
-            for columns in range(self.width):
-                self.field[rows].append(None)
-                self.free_cells.append((columns, rows))
+        self.field = [[None] * self.width for rows in range(self.height)]
+        self.free_cells = FreeCells(self.width, self.height)
+        self.free_cells.fill()
+        self.adjacent = adjacent_cells(self.width, self.height)
+        self.line_neighbours = line_neighbours(self.width, self.height)
+        self._build_components()
+        self._build_runs()
+
+    def _build_components(self):
+        """Label connected components of the free cells in one pass
+
+        labels holds the label of the component of every free cell (NO_LABEL
+        for a ball) and sizes holds the amount of cells of every label, so
+        components take some bytes per cell. Labels of disappeared
+        components are reused.
+        """
+        size = self.width * self.height
+        self.labels = array("H", [NO_LABEL]) * size
+        self.sizes = array("H", [0]) * (size // 2 + 2)
+        self.spare_labels = array("H", range(len(self.sizes) - 1, -1, -1))
+        for start in range(size):
+            if self.labels[start] != NO_LABEL or self.field[start // self.width][start % self.width] is not None:
+                continue
+            label = self.spare_labels.pop()
+            self.labels[start] = label
+            amount = 1
+            queue = deque([start])
+            while queue:
+                for neighbour in self.adjacent[queue.popleft()]:
+                    if self.labels[neighbour] == NO_LABEL \
+                            and self.field[neighbour // self.width][neighbour % self.width] is None:
+                        self.labels[neighbour] = label
+                        amount += 1
+                        queue.append(neighbour)
+            self.sizes[label] = amount
+
+    def _occupy_component_cell(self, index):
+        """Remove the cell from its component and split the component if it falls apart
+
+        Searches start from the free neighbours of the cell and run in lockstep,
+        merging when they meet. A group of searches which runs out of cells
+        is a separate piece and gets a new label, so the work is bounded by
+        the size of the pieces cut off, not by the size of the component.
+        """
+        label = self.labels[index]
+        self.sizes[label] -= 1
+        self.labels[index] = NO_LABEL
+        starts = [neighbour for neighbour in self.adjacent[index] if self.labels[neighbour] == label]
+        if not self.sizes[label]:
+            self.spare_labels.append(label)
+        if len(starts) < 2:
+            return
+        owner = {start: number for number, start in enumerate(starts)}
+        parents = list(range(len(starts)))
+        queues = [deque([start]) for start in starts]
+        open_groups = len(starts)
+
+        def find(number):
+            while parents[number] != number:
+                number = parents[number]
+            return number
+
+        while open_groups > 1:
+            for number, queue in enumerate(queues):
+                if not queue:
+                    continue
+                for neighbour in self.adjacent[queue.popleft()]:
+                    if self.labels[neighbour] != label:
+                        continue
+                    other = owner.get(neighbour)
+                    if other is None:
+                        owner[neighbour] = number
+                        queue.append(neighbour)
+                        continue
+                    root, other_root = find(number), find(other)
+                    if root != other_root:
+                        parents[other_root] = root
+                        open_groups -= 1
+                if open_groups <= 1:
+                    break
+                if queue:
+                    continue
+                root = find(number)
+                members = [member for member in range(len(starts)) if find(member) == root]
+                if any(queues[member] for member in members):
+                    continue
+                new_label = self.spare_labels.pop()
+                piece = [cell for cell, member in owner.items() if find(member) == root]
+                for cell in piece:
+                    self.labels[cell] = new_label
+                self.sizes[label] -= len(piece)
+                self.sizes[new_label] = len(piece)
+                open_groups -= 1
+                if open_groups <= 1:
+                    break
+
+    def _free_component_cell(self, index):
+        """Add the cell to the components and merge the components it joins
+
+        Cells of the smaller components are labeled again by a search from
+        the cell, so the work is bounded by their size.
+        """
+        labels = {self.labels[neighbour] for neighbour in self.adjacent[index]} - {NO_LABEL}
+        if not labels:
+            label = self.spare_labels.pop()
+        else:
+            label = max(labels, key=self.sizes.__getitem__)
+            for other in labels - {label}:
+                queue = deque(neighbour for neighbour in self.adjacent[index] if self.labels[neighbour] == other)
+                for cell in queue:
+                    self.labels[cell] = label
+                while queue:
+                    for neighbour in self.adjacent[queue.popleft()]:
+                        if self.labels[neighbour] == other:
+                            self.labels[neighbour] = label
+                            queue.append(neighbour)
+                self.sizes[label] += self.sizes[other]
+                self.sizes[other] = 0
+                self.spare_labels.append(other)
+        self.labels[index] = label
+        self.sizes[label] += 1
+
+    def _component_cells(self):
+        """Get indexes of the cells of every component by labels in one pass"""
+        cells = {}
+        for index, label in enumerate(self.labels):
+            if label != NO_LABEL:
+                cells.setdefault(label, []).append(index)
+        return cells
+
+    def _color_at(self, index):
+        """Get the color of the ball by index of the cell (0 for a free cell)"""
+        ball = self.field[index // self.width][index % self.width]
+        return 0 if ball is None else ball.color
+
+    def _build_runs(self):
+        """Count same color runs of every cell in every direction in one pass
+
+        runs[direction][index] is the length of the run of balls of the color
+        of the cell which starts at the cell and goes in the direction.
+        Forward directions point to bigger indexes, so they are filled from
+        the end of the field and the opposite ones from the start.
+        """
+        size = self.width * self.height
+        self.runs = [bytearray(size) for direction in range(2 * len(LINE_DIRECTIONS))]
+        for direction, neighbours in enumerate(self.line_neighbours):
+            runs = self.runs[direction]
+            order = range(size - 1, -1, -1) if direction % 2 == 0 else range(size)
+            for index in order:
+                color = self._color_at(index)
+                if not color:
+                    continue
+                neighbour = neighbours[index]
+                if neighbour != -1 and self._color_at(neighbour) == color:
+                    runs[index] = runs[neighbour] + 1
+                else:
+                    runs[index] = 1
+
+    def _update_runs(self, index, color, sign):
+        """Update runs of the cells in line with the cell, which gets (sign 1) or loses (sign -1) a ball"""
+        for forward in range(0, len(self.runs), 2):
+            backward = forward + 1
+            if sign > 0:
+                ahead = self.line_neighbours[forward][index]
+                behind = self.line_neighbours[backward][index]
+                run_ahead = self.runs[forward][ahead] if ahead != -1 and self._color_at(ahead) == color else 0
+                run_behind = self.runs[backward][behind] if behind != -1 and self._color_at(behind) == color else 0
+                self.runs[forward][index] = run_ahead + 1
+                self.runs[backward][index] = run_behind + 1
+            else:
+                run_ahead = self.runs[forward][index] - 1
+                run_behind = self.runs[backward][index] - 1
+                self.runs[forward][index] = 0
+                self.runs[backward][index] = 0
+            cell = index
+            for _ in range(run_behind):
+                cell = self.line_neighbours[backward][cell]
+                self.runs[forward][cell] += sign * (run_ahead + 1)
+            cell = index
+            for _ in range(run_ahead):
+                cell = self.line_neighbours[forward][cell]
+                self.runs[backward][cell] += sign * (run_behind + 1)
+
+    def line_length(self, x, y, color, ignore=None):
+        """Get the longest line the ball of the color would make in the free cell
+
+        Cell ignore is considered free, it is the cell a moving ball leaves.
+        """
+        index = y * self.width + x
+        longest = 0
+        for forward, (dx, dy) in zip(range(0, len(self.runs), 2), LINE_DIRECTIONS):
+            length = 1
+            for direction, sign in ((forward, 1), (forward + 1, -1)):
+                neighbour = self.line_neighbours[direction][index]
+                if neighbour == -1 or self._color_at(neighbour) != color:
+                    continue
+                run = self.runs[direction][neighbour]
+                if ignore is not None:
+                    step_x, step_y = sign * dx, sign * dy
+                    offset_x, offset_y = ignore[0] - x, ignore[1] - y
+                    distance = offset_x * step_x if step_x else offset_y * step_y
+                    if 0 < distance <= run and (offset_x, offset_y) == (distance * step_x, distance * step_y):
+                        run = distance - 1
+                length += run
+            longest = max(longest, length)
+        return longest
 
     def _set_number_of_color(self):
         """Set number of color"""
@@ -62,26 +464,119 @@ class Field:
         """Set the number of a ball put on the field"""
         self.number_of_next_ball = self.height // 4 + 1
 
+    def draw_random(self, bound):
+        """Get a random number from 0 to bound - 1 from the pre-generated spawn stream
+
+        The stream holds 32-bit random numbers made by one call of the generator
+        of the field for SPAWN_STREAM_SIZE draws, a number is scaled to the
+        bound by multiplication and shift.
+        """
+        if self.spawn_position >= len(self.spawn_stream):
+            bits = self.random.getrandbits(32 * SPAWN_STREAM_SIZE)
+            self.spawn_stream = array("I", bits.to_bytes(4 * SPAWN_STREAM_SIZE, "little"))
+            self.spawn_position = 0
+        number = self.spawn_stream[self.spawn_position]
+        self.spawn_position += 1
+        return (number * bound) >> 32
+
+    def get_random_state(self):
+        """Get the state of the random generator and of the spawn stream"""
+        return self.random.getstate(), self.spawn_stream.tobytes(), self.spawn_position
+
+    def set_random_state(self, state):
+        """Restore the state got by get_random_state"""
+        random_state, stream, self.spawn_position = state
+        self.random.setstate(random_state)
+        self.spawn_stream = array("I", stream)
+
     def make_next_balls(self):
         """Set the following balls"""
         self.next_balls.clear()
         for index in range(self.number_of_next_ball):
-            ball = Ball()
-            ball.set_random_color(self.number_of_color)
-            self.next_balls.append(ball)
+            self.next_balls.append(Ball.shared(self.draw_random(self.number_of_color) + 1))
+        self.notify("next", [ball.color for ball in self.next_balls])
 
     def clear_field(self):
         """Clear the game field"""
-        self.free_cells.clear()
         for rows in range(self.height):
-            for columns in range(self.width):
-                self.field[rows][columns] = None
-                self.free_cells.append((rows, columns))
+            self.field[rows] = [None] * self.width
+        self.free_cells.fill()
+        self._build_components()
+        self._build_runs()
+
+    def dump_cells(self):
+        """Get colors of all cells row by row as bytes (0 for a free cell)"""
+        return bytes(self._color_at(index) for index in range(self.width * self.height))
+
+    def dump_free_order(self):
+        """Get the order of free cells in the index as bytes (spawns depend on it)"""
+        return self.free_cells.cells.tobytes()
+
+    def load_cells(self, cells, free_order=b""):
+        """Put balls on the field by colors of cells got from dump_cells and rebuild indexes in one pass
+
+        free_order is got from dump_free_order, without it free cells go row by row.
+        """
+        self.field = [[Ball.shared(color) if color else None for color in cells[rows * self.width:(rows + 1) * self.width]]
+                      for rows in range(self.height)]
+        self.free_cells.clear()
+        order = range(self.width * self.height)
+        if free_order:
+            order = array("H")
+            order.frombytes(free_order)
+        for index in order:
+            if not cells[index]:
+                self.free_cells.add((index % self.width, index // self.width))
+        self._build_components()
+        self._build_runs()
+
+    def copy(self):
+        """Get an independent copy of the field without observers
+
+        Indexes are copied instead of being built again, and the copy gets
+        its own generator in the same state, so it is cheap enough for search.
+        """
+        field = self.__class__.__new__(self.__class__)
+        field.__dict__.update(self.__dict__)
+        field.observers = []
+        field.random = Random()
+        field.random.setstate(self.random.getstate())
+        field.spawn_stream = array("I", self.spawn_stream)
+        field.next_balls = list(self.next_balls)
+        field.set_balls = list(self.set_balls)
+        field.undo_stack = []
+        field._copy_cells(self)
+        return field
+
+    def _copy_cells(self, field):
+        """Copy balls and indexes of cells of the field"""
+        self.field = [rows[:] for rows in field.field]
+        self.free_cells = field.free_cells.copy()
+        self.labels = array("H", field.labels)
+        self.sizes = array("H", field.sizes)
+        self.spare_labels = array("H", field.spare_labels)
+        self.runs = [bytearray(runs) for runs in field.runs]
+
+    def __getstate__(self):
+        """Get the state for pickle without observers"""
+        state = self.__dict__.copy()
+        state["observers"] = []
+        return state
+
+    def notify(self, event, *arguments):
+        """Tell observers about a change of the field
+
+        Events: "step" (start x, start y, end x, end y), "spawn" (x, y, color),
+        "remove" (x, y), "score" (score), "next" (colors), "reset" ().
+        """
+        for observer in self.observers:
+            observer.field_changed(event, *arguments)
 
     def refresh_field(self):
         """Return the field to its initial state"""
         self.clear_field()
         self.score = 0
+        self.notify("reset")
         self.make_next_balls()
         self.set_next_balls()
 
@@ -96,13 +591,30 @@ class Field:
 
     def set_ball(self, x, y, ball):
         """Set the ball by coordinates"""
-        self.field[y][x] = ball
         self.free_cells.remove((x, y))
+        self.field[y][x] = ball
+        self._occupy_component_cell(y * self.width + x)
+        self._update_runs(y * self.width + x, ball.color, 1)
 
     def delete_ball(self, x, y):
         """Delete a ball by coordinates"""
+        if self.field[y][x] is not None:
+            self._update_runs(y * self.width + x, self.field[y][x].color, -1)
+            self.field[y][x] = None
+            self.free_cells.add((x, y))
+            self._free_component_cell(y * self.width + x)
+
+    def _free_slot(self, x, y):
+        """Get the slot of the free cell in the index of free cells"""
+        return self.free_cells.slots[y * self.width + x]
+
+    def _take_back_ball(self, x, y, slot):
+        """Delete the ball put by set_ball and return the cell to its slot of free cells"""
+        index = y * self.width + x
+        self._update_runs(index, self.field[y][x].color, -1)
         self.field[y][x] = None
-        self.free_cells.append((x, y))
+        self.free_cells.insert((x, y), slot)
+        self._free_component_cell(index)
 
     def set_next_balls(self):
         """install the next balls on field"""
@@ -110,105 +622,145 @@ class Field:
             raise FieldFullException()
         self.set_balls.clear()
         for ball in self.next_balls:
-            coordinates = self.free_cells[randint(0, len(self.free_cells)) - 1]
+            coordinates = self.free_cells.choice(self.draw_random)
             self.set_ball(coordinates[0], coordinates[1], ball)
             self.set_balls.append((coordinates[0], coordinates[1]))
+            self.notify("spawn", coordinates[0], coordinates[1], ball.color)
         self.make_next_balls()
 
     def try_move(self, start_x, start_y, end_x, end_y):
         """Try move ball in needed coordinate"""
+        return self.can_reach(start_x, start_y, end_x, end_y)
+
+    def can_reach(self, start_x, start_y, end_x, end_y):
+        """Check whether the ball can reach the free cell by comparing labels of components"""
         if self.get_ball(end_x, end_y) is not None or self.get_ball(start_x, start_y) is None:
             return False
-        queue = []
-        visited_cells = []
-        queue.append((start_x, start_y))
-        while len(queue) != 0:
-            coordinates = queue.pop(0)
-            if coordinates[0] < 0 or coordinates[0] >= self.height \
-                    or coordinates[1] < 0 or coordinates[1] >= self.width:
-                continue
-            if (coordinates != (start_x, start_y) and self.get_ball(coordinates[0], coordinates[1]) is not None) \
-                    or (coordinates[0], coordinates[1]) in visited_cells:
+        label = self.labels[end_y * self.width + end_x]
+        return any(self.labels[neighbour] == label for neighbour in self.adjacent[start_y * self.width + start_x])
+
+    def reachable_cells(self, x, y):
+        """Get all free cells the ball can reach"""
+        if self.get_ball(x, y) is None:
+            return []
+        labels = {self.labels[neighbour] for neighbour in self.adjacent[y * self.width + x]} - {NO_LABEL}
+        return [(index % self.width, index // self.width) for index, label in enumerate(self.labels) if label in labels]
+
+    def find_path(self, start_x, start_y, end_x, end_y):
+        """Find the shortest path of the ball as a list of cells from start to end"""
+        if not self.can_reach(start_x, start_y, end_x, end_y):
+            return
+        start = start_y * self.width + start_x
+        end = end_y * self.width + end_x
+        came_from = bytearray(self.width * self.height)  # number of the step (from 1) which led to the cell
+        came_from[start] = len(STEPS) + 1
+        queue = deque([start])
+        while queue:
+            y, x = divmod(queue.popleft(), self.width)
+            for step, (dx, dy) in enumerate(STEPS, 1):
+                next_x = x + dx
+                next_y = y + dy
+                if next_x < 0 or next_x >= self.width or next_y < 0 or next_y >= self.height:
+                    continue
+                index = next_y * self.width + next_x
+                if came_from[index] or self.field[next_y][next_x] is not None:
+                    continue
+                came_from[index] = step
+                if index == end:
+                    return self._restore_path(came_from, start, end)
+                queue.append(index)
+
+    def _restore_path(self, came_from, start, end):
+        """Restore the path found by find_path"""
+        path = []
+        index = end
+        while index != start:
+            y, x = divmod(index, self.width)
+            path.append((x, y))
+            dx, dy = STEPS[came_from[index] - 1]
+            index = (y - dy) * self.width + x - dx
+        path.append((index % self.width, index // self.width))
+        path.reverse()
+        return path
+
+    def legal_moves(self, only_lines=False):
+        """Get all legal moves as a list of pairs (start, end)"""
+        return list(self.iter_legal_moves(only_lines))
+
+    def iter_legal_moves(self, only_lines=False):
+        """Generate all legal moves from components adjacent to every ball"""
+        components = self._component_cells()
+        for start in range(self.width * self.height):
+            start_x, start_y = start % self.width, start // self.width
+            if self.field[start_y][start_x] is None:
                 continue
-            if coordinates[0] == end_x and coordinates[1] == end_y:
-                return True
-            visited_cells.append((coordinates[0], coordinates[1]))
-            for dy in range(-1, 2):
-                for dx in range(-1, 2):
-                    if dx != 0 and dy != 0:
-                        continue
-                    else:
-                        queue.append((coordinates[0] + dx, coordinates[1] + dy))
-        return False
+            labels = {self.labels[neighbour] for neighbour in self.adjacent[start]} - {NO_LABEL}
+            for label in labels:
+                for end in components[label]:
+                    end_x, end_y = end % self.width, end // self.width
+                    if not only_lines or self.makes_line(start_x, start_y, end_x, end_y):
+                        yield (start_x, start_y), (end_x, end_y)
+
+    def makes_line(self, start_x, start_y, end_x, end_y):
+        """Check whether moving the ball completes a line (reachability is not checked)"""
+        color = self.get_color_of_ball(start_x, start_y)
+        return self.line_length(end_x, end_y, color, (start_x, start_y)) >= self.balls_in_line
 
     def make_step(self, start_x, start_y, end_x, end_y):
         """Make step"""
-        ball = Ball(self.get_ball(start_x, start_y).color)
+        ball = self.get_ball(start_x, start_y)
         self.set_ball(end_x, end_y, ball)
         self.delete_ball(start_x, start_y)
+        self.notify("step", start_x, start_y, end_x, end_y)
 
     def find_full_lines(self, x, y):
         """Find all full lines starting by coordinates of ball"""
         if self.get_ball(x, y) is None:
             return
-        current_color = self.get_color_of_ball(x, y)
-        ball_for_delete = []
-        minus_dx = x
-        plus_dx = x + 1
-        while minus_dx >= 0 and self.get_color_of_ball(minus_dx, y) == current_color:
-            ball_for_delete.append((minus_dx, y))
-            minus_dx -= 1
-        while plus_dx < self.width and self.get_color_of_ball(plus_dx, y) == current_color:
-            ball_for_delete.append((plus_dx, y))
-            plus_dx += 1
-        if len(ball_for_delete) >= self.balls_in_line:
-            return ball_for_delete
-        else:
-            ball_for_delete.clear()
-        minus_dy = y
-        plus_dy = y + 1
-        while minus_dy >= 0 and self.get_color_of_ball(x, minus_dy) == current_color:
-            ball_for_delete.append((x, minus_dy))
-            minus_dy -= 1
-        while plus_dy < self.height and self.get_color_of_ball(x, plus_dy) == current_color:
-            ball_for_delete.append((x, plus_dy))
-            plus_dy += 1
-        if len(ball_for_delete) >= self.balls_in_line:
-            return ball_for_delete
-        else:
-            ball_for_delete.clear()
-        minus_dx = x
-        minus_dy = y
-        plus_dx = x + 1
-        plus_dy = y + 1
-        while minus_dx >= 0 and minus_dy >= 0 and self.get_color_of_ball(minus_dx, minus_dy) == current_color:
-            ball_for_delete.append((minus_dx, minus_dy))
-            minus_dx -= 1
-            minus_dy -= 1
-        while plus_dx < self.width and plus_dy < self.height and self.get_color_of_ball(plus_dx, plus_dy) == current_color:
-            ball_for_delete.append((plus_dx, plus_dy))
-            plus_dx += 1
-            plus_dy += 1
-        if len(ball_for_delete) >= self.balls_in_line:
+        index = y * self.width + x
+        for forward in range(0, len(self.runs), 2):
+            backward = forward + 1
+            if self.runs[forward][index] + self.runs[backward][index] - 1 < self.balls_in_line:
+                continue
+            ball_for_delete = []
+            cell = index
+            for _ in range(self.runs[backward][index]):
+                ball_for_delete.append((cell % self.width, cell // self.width))
+                cell = self.line_neighbours[backward][cell]
+            cell = index
+            for _ in range(self.runs[forward][index] - 1):
+                cell = self.line_neighbours[forward][cell]
+                ball_for_delete.append((cell % self.width, cell // self.width))
             return ball_for_delete
-        else:
-            ball_for_delete.clear()
-        minus_dx = x
-        plus_dy = y
-        while minus_dx >= 0 and plus_dy < self.height and self.get_color_of_ball(minus_dx, plus_dy) == current_color:
-            ball_for_delete.append((minus_dx, plus_dy))
-            minus_dx -= 1
-            plus_dy += 1
-        plus_dx = x + 1
-        minus_dy = y - 1
-        while plus_dx < self.width and minus_dy >= 0 and self.get_color_of_ball(plus_dx, minus_dy) == current_color:
-            ball_for_delete.append((plus_dx, minus_dy))
-            plus_dx += 1
-            minus_dy -= 1
-        if len(ball_for_delete) >= self.balls_in_line:
+
+    def colors_array(self):
+        """Get the field as a numpy array of colors (0 for a free cell)"""
+        return numpy.array([self._color_at(index) for index in range(self.width * self.height)],
+                           dtype=numpy.int8).reshape(self.height, self.width)
+
+    def scan_all_lines(self):
+        """Find the cells of all full lines of the field in all directions
+
+        Crossing and overlapping lines are merged, so the result can be passed
+        to delete_full_lines at once. Without numpy the runs of balls are used.
+        """
+        if numpy is None:
+            return self._scan_runs()
+        rows, columns = numpy.nonzero(full_lines_mask(self.colors_array(), self.balls_in_line))
+        if len(rows):
+            return list(zip(columns.tolist(), rows.tolist()))
+
+    def _scan_runs(self):
+        """Find the cells of all full lines of the field by the runs of balls"""
+        ball_for_delete = []
+        for index in range(self.width * self.height):
+            for forward in range(0, len(self.runs), 2):
+                if self.runs[forward][index] and \
+                        self.runs[forward][index] + self.runs[forward + 1][index] - 1 >= self.balls_in_line:
+                    ball_for_delete.append((index % self.width, index // self.width))
+                    break
+        if ball_for_delete:
             return ball_for_delete
-        else:
-            return
 
     def delete_full_lines(self, array_of_balls_coordinates):
         """Delete full lines"""
@@ -216,6 +768,86 @@ class Field:
             self.scoring(len(array_of_balls_coordinates))
             for coordinate in array_of_balls_coordinates:
                 self.delete_ball(coordinate[0], coordinate[1])
+                self.notify("remove", coordinate[0], coordinate[1])
+            self.notify("score", self.score)
+
+    def find_lines_through(self, cells):
+        """Find the cells of full lines through the cells (None without lines)"""
+        ball_for_delete = set()
+        for x, y in cells:
+            index = y * self.width + x
+            if self.field[y][x] is None:
+                continue
+            for forward in range(0, len(self.runs), 2):
+                backward = forward + 1
+                length = self.runs[forward][index] + self.runs[backward][index] - 1
+                if length < self.balls_in_line:
+                    continue
+                cell = index
+                for _ in range(self.runs[backward][index] - 1):
+                    cell = self.line_neighbours[backward][cell]
+                for _ in range(length):
+                    ball_for_delete.add((cell % self.width, cell // self.width))
+                    cell = self.line_neighbours[forward][cell]
+        if ball_for_delete:
+            return sorted(ball_for_delete, key=lambda cell: (cell[1], cell[0]))
+
+    def push_move(self, start_x, start_y, end_x, end_y):
+        """Make the step and delete full lines it makes, pop_move takes all of it back
+
+        Observers are not told about these changes, they are made and taken
+        back by search. Only changed cells are remembered, so pop_move
+        restores the field with the order of free cells in time of the
+        amount of changed cells. Get the cells of deleted lines (None
+        without lines).
+        """
+        changes = []
+        self.undo_stack.append((changes, self.score, self.next_balls))
+        ball = self.get_ball(start_x, start_y)
+        self._push_set_ball(changes, end_x, end_y, ball)
+        self._push_delete_ball(changes, start_x, start_y)
+        return self._push_lines(changes, [(end_x, end_y)])
+
+    def push_spawn(self, cells, next_balls):
+        """Put the next balls on the free cells, delete full lines they make and set the next balls
+
+        It is the random part of the turn made by search, pop_move takes it
+        back. Get the cells of deleted lines (None without lines).
+        """
+        changes = []
+        self.undo_stack.append((changes, self.score, self.next_balls))
+        for (x, y), ball in zip(cells, self.next_balls):
+            self._push_set_ball(changes, x, y, ball)
+        self.next_balls = list(next_balls)
+        return self._push_lines(changes, cells)
+
+    def pop_move(self):
+        """Take back the last change made by push_move or push_spawn"""
+        changes, self.score, self.next_balls = self.undo_stack.pop()
+        for x, y, ball, slot in reversed(changes):
+            if ball is None:
+                self._take_back_ball(x, y, slot)
+            else:
+                self.set_ball(x, y, ball)
+
+    def _push_set_ball(self, changes, x, y, ball):
+        """Set the ball on the free cell and remember the change"""
+        changes.append((x, y, None, self._free_slot(x, y)))
+        self.set_ball(x, y, ball)
+
+    def _push_delete_ball(self, changes, x, y):
+        """Delete the ball and remember the change"""
+        changes.append((x, y, self.get_ball(x, y), None))
+        self.delete_ball(x, y)
+
+    def _push_lines(self, changes, cells):
+        """Delete and score full lines through the cells and remember the changes"""
+        lines = self.find_lines_through(cells)
+        if lines is not None:
+            self.scoring(len(lines))
+            for x, y in lines:
+                self._push_delete_ball(changes, x, y)
+        return lines
 
     def scoring(self, length_of_remote_line):
         """Scoring by length of remote line"""
@@ -223,6 +855,11 @@ class Field:
         self.score += 10 * length_of_remote_line * multiplier
 
 
+class SharedBallError(Exception):
+    """A shared ball can not be changed"""
+    pass
+
+
 class FieldFullException(Exception):
     """Field full and no places to set next balls"""
     pass
@@ -1,62 +1,496 @@
 """This file implements the actions with game (save, load, scoreboard)"""
+import io
+import os
 import pickle
 import json
+import sqlite3
+import struct
+from array import array
 from operator import itemgetter
 from collections import OrderedDict
 from core import *
+from bitboard import BitboardField
+
+ENGINES = {"list": Field, "bitboard": BitboardField}
+ENGINE_NAMES = tuple(ENGINES)
+# supported sizes of the field
+FIELD_SIZES = range(5, 16)
+
+SAVE_MAGIC = b"LINE"
+SAVE_VERSION = 1
+# magic, version, engine, width, height, balls in line, next balls, colors, score, length of player name
+SAVE_HEADER = struct.Struct("<4sBBBBBBBIH")
+# version of the state, state of Mersenne Twister with its position, flag and value of the next gauss
+RANDOM_STATE = struct.Struct("<B625I?d")
+# position in the spawn stream, amount of numbers in the stream, length of the order of free cells
+STREAM_HEADER = struct.Struct("<HHH")
+# kind of the record, four small arguments, a big argument
+JOURNAL_RECORD = struct.Struct("<BBBBBI")
+JOURNAL_BEGIN, JOURNAL_STEP, JOURNAL_SPAWN, JOURNAL_REMOVE, JOURNAL_SCORE, JOURNAL_NEXT, JOURNAL_RESET = range(7)
+# generation of the snapshot, the journal is valid only for the snapshot of its generation
+SNAPSHOT_HEADER = struct.Struct("<I")
+AUTOSAVE_SNAPSHOT = "autosave.lines"
+AUTOSAVE_JOURNAL = "autosave.journal"
+RECORDS_DATABASE = "records.db"
+LEGACY_RECORDS = "records.json"
+RECORDS_IN_TABLE = 8
+LEGACY_CLASSES = {("core", "Field"), ("core", "Ball"), ("core", "FreeCells"), ("bitboard", "BitboardField"),
+                  ("random", "Random"), ("array", "array"), ("array", "_array_reconstructor"),
+                  ("copyreg", "_reconstructor"), ("builtins", "object"), ("builtins", "set"),
+                  ("builtins", "bytearray")}
+
+
+def create_field(amount_cells=9, player="Player", engine="list", seed=None):
+    """Create a game field with the selected engine"""
+    if engine not in ENGINES:
+        raise UnknownEngineError(engine)
+    return ENGINES[engine](amount_cells, player, seed)
+
+
+def get_engine_name(field):
+    """Get the name of the engine of the field"""
+    for name, engine in ENGINES.items():
+        if type(field) is engine:
+            return name
+    raise UnknownEngineError(type(field).__name__)
+
+
+def pack_field(field):
+    """Pack the field in the binary save format
+
+    Header with the size, rules, score and player, colors of the next balls,
+    the state of the random generator with the spawn stream and the order of
+    free cells, then one byte per cell.
+    """
+    player = field.player.encode("utf-8")
+    free_order = field.dump_free_order()
+    random_state, stream, position = field.get_random_state()
+    version, state, gauss = random_state
+    stream = stream[4 * position:]
+    return b"".join([
+        SAVE_HEADER.pack(SAVE_MAGIC, SAVE_VERSION, ENGINE_NAMES.index(get_engine_name(field)),
+                         field.width, field.height, field.balls_in_line, field.number_of_next_ball,
+                         field.number_of_color, field.score, len(player)),
+        player,
+        bytes([len(field.next_balls)]),
+        bytes(ball.color for ball in field.next_balls),
+        RANDOM_STATE.pack(version, *state, gauss is not None, gauss or 0.0),
+        STREAM_HEADER.pack(0, len(stream) // 4, len(free_order)),
+        stream,
+        free_order,
+        field.dump_cells()])
+
+
+def unpack_field(data):
+    """Unpack the field from the binary save format"""
+    view = memoryview(data)
+    try:
+        magic, version, engine, width, height, balls_in_line, number_of_next_ball, number_of_color, score, \
+            length = SAVE_HEADER.unpack_from(view)
+        if magic != SAVE_MAGIC:
+            raise LoadError("Not a save of the game")
+        if version != SAVE_VERSION:
+            raise LoadError(f"Unsupported version of the save: {version}")
+        offset = SAVE_HEADER.size
+        player = bytes(view[offset:offset + length]).decode("utf-8")
+        offset += length
+        next_colors = view[offset + 1:offset + 1 + view[offset]]
+        offset += 1 + view[offset]
+        random_version, *state, has_gauss, gauss = RANDOM_STATE.unpack_from(view, offset)
+        offset += RANDOM_STATE.size
+        position, amount, order_length = STREAM_HEADER.unpack_from(view, offset)
+        offset += STREAM_HEADER.size
+        stream = bytes(view[offset:offset + 4 * amount])
+        offset += 4 * amount
+        free_order = view[offset:offset + order_length]
+        offset += order_length
+        cells = view[offset:]
+        if width not in FIELD_SIZES or height != width:
+            raise LoadError(f"Unsupported size of the field: {width}x{height}")
+        field = ENGINES[ENGINE_NAMES[engine]](width, player)
+        if field.height != height or len(cells) != width * height \
+                or (field.balls_in_line, field.number_of_next_ball, field.number_of_color) \
+                != (balls_in_line, number_of_next_ball, number_of_color):
+            raise LoadError("Size or rules of the field are broken")
+        if max(cells) > number_of_color or not all(0 < color <= number_of_color for color in next_colors):
+            raise LoadError("Colors of balls are broken")
+        if free_order:
+            order = array("H")
+            order.frombytes(free_order)
+            free = {index for index, color in enumerate(cells) if not color}
+            if len(order) != len(free) or set(order) != free:
+                raise LoadError("Order of free cells is broken")
+        field.load_cells(cells, free_order)
+        field.score = score
+        field.next_balls = [Ball.shared(color) for color in next_colors]
+        field.set_random_state(((random_version, tuple(state), gauss if has_gauss else None), stream, position))
+        return field
+    except (struct.error, IndexError, UnicodeDecodeError, ValueError) as exception:
+        raise LoadError(exception)
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    """Unpickler of old saves which creates only objects of the game"""
+
+    def find_class(self, module, name):
+        """Allow only classes of the game"""
+        if (module, name) not in LEGACY_CLASSES:
+            raise LoadError(f"Forbidden object in the save: {module}.{name}")
+        return super().find_class(module, name)
+
+
+def import_legacy_field(data):
+    """Import the field from an old pickle save and rebuild it with the current engine"""
+    try:
+        old_field = LegacyUnpickler(io.BytesIO(data)).load()
+    except (pickle.UnpicklingError, EOFError, AttributeError, TypeError, ValueError) as exception:
+        raise LoadError(exception)
+    if not isinstance(old_field, Field):
+        raise LoadError("Not a save of the game")
+    field = type(old_field)(old_field.width, old_field.player)
+    field.load_cells(bytes(old_field.get_color_of_ball(columns, rows) or 0
+                           for rows in range(old_field.height) for columns in range(old_field.width)))
+    field.score = old_field.score
+    field.next_balls = [Ball.shared(ball.color) for ball in old_field.next_balls]
+    if hasattr(old_field, "random"):
+        field.set_random_state(old_field.get_random_state())
+    return field
 
 
 def save_in_file(field, filename):
     """Save game in file"""
+    write_save(pack_field(field), filename)
+
+
+def write_save(data, filename):
+    """Write the field packed by pack_field in file"""
     with open(filename, "wb") as file:
-        pickle.dump(field, file)
+        file.write(data)
 
 
 def load_from_file(filename):
-    """Load game from file"""
+    """Load game from file (old pickle saves are imported)"""
     with open(filename, 'rb') as file:
-        field = pickle.load(file)
-        if not isinstance(field, Field):
-            raise LoadError()
+        data = file.read()
+    if data.startswith(SAVE_MAGIC):
+        return unpack_field(data)
+    return import_legacy_field(data)
+
+
+def pack_event(event, arguments):
+    """Pack the change of the field (see Field.notify) to records of the journal"""
+    if event == "next":
+        return b"".join(JOURNAL_RECORD.pack(JOURNAL_NEXT, index, color, 0, 0, 0)
+                        for index, color in enumerate(arguments[0]))
+    if event == "score":
+        return JOURNAL_RECORD.pack(JOURNAL_SCORE, 0, 0, 0, 0, arguments[0])
+    kind = {"step": JOURNAL_STEP, "spawn": JOURNAL_SPAWN, "remove": JOURNAL_REMOVE, "reset": JOURNAL_RESET}[event]
+    return JOURNAL_RECORD.pack(kind, *(arguments + (0,) * (4 - len(arguments))), 0)
+
+
+def apply_record(field, kind, first, second, third, fourth, value):
+    """Apply the record of the journal to the field
+
+    Records are applied with the same operations in the same order as in the
+    game, and the spawn stream is advanced by one number per spawned and per
+    next ball, so the field goes on as the recorded one.
+    """
+    if kind == JOURNAL_STEP:
+        field.make_step(first, second, third, fourth)
+    elif kind == JOURNAL_SPAWN:
+        field.set_ball(first, second, Ball.shared(third))
+        field.draw_random(1)
+    elif kind == JOURNAL_REMOVE:
+        field.delete_ball(first, second)
+    elif kind == JOURNAL_SCORE:
+        field.score = value
+    elif kind == JOURNAL_NEXT:
+        if first == 0:
+            field.next_balls = []
+        field.next_balls.append(Ball.shared(second))
+        field.draw_random(1)
+    elif kind == JOURNAL_RESET:
+        field.clear_field()
+        field.score = 0
+    else:
+        raise LoadError(f"Unknown record of the journal: {kind}")
+
+
+class Journal:
+    """Append-only journal of the game for crash-safe autosave
+
+    The snapshot file holds the field in the save format, the journal file
+    holds fixed-size records of the changes made after the snapshot. After
+    compact_every records the field is written to a new snapshot and the
+    journal starts again. Generations go on from the files left by the last
+    run, so a journal of an old run never matches a new snapshot.
+    """
+
+    def __init__(self, snapshot_filename=AUTOSAVE_SNAPSHOT, journal_filename=AUTOSAVE_JOURNAL, compact_every=500):
+        """Initialize the journal"""
+        self.snapshot_filename = snapshot_filename
+        self.journal_filename = journal_filename
+        self.compact_every = compact_every
+        self.field = None
+        self.file = None
+        self.generation = self._last_generation()
+        self.amount_records = 0
+
+    def _last_generation(self):
+        """Get the biggest generation of the snapshot and of the journal left on the disk"""
+        generation = 0
+        for filename, header, start in ((self.snapshot_filename, SNAPSHOT_HEADER, 0),
+                                        (self.journal_filename, JOURNAL_RECORD, 5)):
+            try:
+                with open(filename, "rb") as file:
+                    generation = max(generation, header.unpack(file.read(header.size))[start])
+            except (OSError, struct.error):
+                pass
+        return generation
+
+    def attach(self, field):
+        """Start writing changes of the field"""
+        self.detach()
+        self.field = field
+        field.observers.append(self)
+        self.compact()
+
+    def detach(self):
+        """Stop writing changes of the field"""
+        if self.field is not None:
+            self.field.observers.remove(self)
+            self.field = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def compact(self):
+        """Write the field to a new snapshot and start the journal again"""
+        self.generation += 1
+        temporary_filename = self.snapshot_filename + ".tmp"
+        with open(temporary_filename, "wb") as file:
+            file.write(SNAPSHOT_HEADER.pack(self.generation))
+            file.write(pack_field(self.field))
+        os.replace(temporary_filename, self.snapshot_filename)
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.journal_filename, "wb", buffering=0)
+        self.amount_records = 0
+        self.file.write(JOURNAL_RECORD.pack(JOURNAL_BEGIN, 0, 0, 0, 0, self.generation))
+
+    def field_changed(self, event, *arguments):
+        """Append the record of the change of the field"""
+        if self.amount_records >= self.compact_every:
+            self.compact()
+            return
+        records = pack_event(event, arguments)
+        self.file.write(records)
+        self.amount_records += len(records) // JOURNAL_RECORD.size
+
+
+class History:
+    """Undo and redo of turns of the game
+
+    A turn starts with a step or with a new game. Changes of every turn are
+    kept as records of the journal and the whole field is packed only every
+    keyframe_every turns, so a turn costs some dozens of bytes. The field of
+    a turn is unpacked from the nearest keyframe before it and records of
+    the following turns are applied to it. Records advance the generator as
+    the game does, so balls spawned after undo and redo are the same. Undo
+    does not go back over the start of a new game.
+    """
+
+    def __init__(self, keyframe_every=20):
+        """Initialize the history"""
+        self.keyframe_every = keyframe_every
+        self.field = None
+        self.keyframes = {}
+        self.turns = []
+        self.position = 0
+        self.first = 0
+
+    def attach(self, field):
+        """Start the history of the field from its current state"""
+        self.detach()
+        self.field = field
+        field.observers.append(self)
+        self.keyframes = {0: pack_field(field)}
+        self.turns = []
+        self.position = 0
+        self.first = 0
+
+    def detach(self):
+        """Stop watching the field"""
+        if self.field is not None:
+            self.field.observers.remove(self)
+            self.field = None
+
+    def can_undo(self):
+        """Check whether there is a turn to take back"""
+        return self.position > self.first
+
+    def can_redo(self):
+        """Check whether there is a taken back turn"""
+        return self.position < len(self.turns)
+
+    def undo(self):
+        """Get the new field before the last turn (None without turns), the history goes on with it"""
+        if self.can_undo():
+            return self._go_to(self.position - 1)
+
+    def redo(self):
+        """Get the new field after the taken back turn (None without it), the history goes on with it"""
+        if self.can_redo():
+            return self._go_to(self.position + 1)
+
+    def seek(self, turn):
+        """Get a new field after the turn"""
+        keyframe = max(number for number in self.keyframes if number <= turn)
+        field = unpack_field(self.keyframes[keyframe])
+        for records in self.turns[keyframe:turn]:
+            for record in JOURNAL_RECORD.iter_unpack(records):
+                apply_record(field, *record)
         return field
 
+    def _go_to(self, turn):
+        """Watch the field of the turn instead of the current one"""
+        field = self.seek(turn)
+        self.field.observers.remove(self)
+        self.field = field
+        field.observers.append(self)
+        self.position = turn
+        return field
+
+    def _begin_turn(self, new_game):
+        """Drop taken back turns and start the record of a new turn
+
+        The field is already changed by the turn here, so keyframes are made
+        from the records. Turns of the finished game are dropped on the first
+        step of the next game.
+        """
+        del self.turns[self.position:]
+        for number in [number for number in self.keyframes if number > self.position]:
+            del self.keyframes[number]
+        if self.first and self.first == self.position and not new_game:
+            self.keyframes = {0: pack_field(self.seek(self.position))}
+            self.turns = []
+            self.position = self.first = 0
+        elif self.position - max(self.keyframes) >= self.keyframe_every:
+            self.keyframes[self.position] = pack_field(self.seek(self.position))
+        self.turns.append(bytearray())
+        self.position += 1
+        if new_game:
+            self.first = self.position
+
+    def field_changed(self, event, *arguments):
+        """Add the record of the change of the field to the turn"""
+        if event == "step" or event == "reset" or self.position != len(self.turns) or not self.turns:
+            self._begin_turn(event == "reset")
+        self.turns[-1] += pack_event(event, arguments)
+
+
+def has_autosave(snapshot_filename=AUTOSAVE_SNAPSHOT):
+    """Check whether there is an autosave"""
+    return os.path.exists(snapshot_filename)
+
+
+def remove_autosave(snapshot_filename=AUTOSAVE_SNAPSHOT, journal_filename=AUTOSAVE_JOURNAL):
+    """Remove files of the autosave"""
+    for filename in (snapshot_filename, journal_filename):
+        if os.path.exists(filename):
+            os.remove(filename)
+
 
-def add_record(player_name, score):
-    """Add a new entry to the record table"""
+def recover_game(snapshot_filename=AUTOSAVE_SNAPSHOT, journal_filename=AUTOSAVE_JOURNAL):
+    """Rebuild the field from the snapshot and the tail of the journal (a torn last record is skipped)"""
     try:
-        file = open('records.json', 'r', encoding='utf-8')
-        records = json.load(file)
-        file.close()
-        if records.get(player_name) is None or records.get(player_name) < score:
-            records.update({player_name: score})
-            sorted_records = OrderedDict(sorted(records.items(), key=lambda y: y[1], reverse=True))
-            records.clear()
-            records.update(sorted_records)
-            file = open('records.json', 'w', encoding='utf-8')
-            json.dump(records, file, indent=4)
-            file.close()
-        if len(records) > 8:
-            sorted_records = OrderedDict(sorted(records.items(), key=lambda y: y[1], reverse=True))
-            sorted_records.popitem()
-            records.clear()
-            records.update(sorted_records)
+        with open(snapshot_filename, "rb") as file:
+            data = file.read()
+        generation, = SNAPSHOT_HEADER.unpack_from(data)
+    except (OSError, struct.error) as exception:
+        raise LoadError(exception)
+    field = unpack_field(memoryview(data)[SNAPSHOT_HEADER.size:])
+    try:
+        with open(journal_filename, "rb") as file:
+            journal = file.read()
     except FileNotFoundError:
-        file = open('records.json', 'w', encoding='utf-8')
-        records = {}
-        records.update({player_name: score})
-        json.dump(records, file, indent=4)
-        file.close()
-    except Exception as exception:
+        return field
+    journal = journal[:len(journal) // JOURNAL_RECORD.size * JOURNAL_RECORD.size]
+    records = JOURNAL_RECORD.iter_unpack(journal)
+    if next(records, (None,) * 6)[::5] != (JOURNAL_BEGIN, generation):
+        return field
+    try:
+        for record in records:
+            apply_record(field, *record)
+    except (ValueError, IndexError, AttributeError) as exception:
+        raise LoadError(exception)
+    return field
+
+
+def open_records(database=RECORDS_DATABASE):
+    """Open the database of records, create it and import the old records.json next to it on the first run"""
+    is_new = not os.path.exists(database)
+    legacy_records = os.path.join(os.path.dirname(database), LEGACY_RECORDS)
+    connection = sqlite3.connect(database, timeout=10)
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS records "
+                           "(size INTEGER NOT NULL, player TEXT NOT NULL, score INTEGER NOT NULL, "
+                           "PRIMARY KEY (size, player))")
+        connection.execute("CREATE INDEX IF NOT EXISTS records_by_score ON records (size, score DESC)")
+        if is_new and os.path.exists(legacy_records):
+            with open(legacy_records, 'r', encoding='utf-8') as file:
+                records = json.load(file)
+            connection.executemany("INSERT OR IGNORE INTO records VALUES (9, ?, ?)", records.items())
+    return connection
+
+
+def add_record(player_name, score, size=9, database=RECORDS_DATABASE):
+    """Add a new entry to the record table (only the best score of the player on the size is kept)"""
+    try:
+        connection = open_records(database)
+        try:
+            with connection:
+                connection.execute("INSERT INTO records VALUES (?, ?, ?) ON CONFLICT (size, player) "
+                                   "DO UPDATE SET score = max(score, excluded.score)", (size, player_name, score))
+        finally:
+            connection.close()
+    except (sqlite3.Error, OSError, ValueError) as exception:
         raise AddRecordError(exception)
 
 
-def get_records():
-    """Get record from file"""
+def get_records(limit=RECORDS_IN_TABLE, size=None, database=RECORDS_DATABASE):
+    """Get the best records of the size (the best score of every player on any size by default)"""
     try:
-        with open('records.json', 'r', encoding='utf-8') as file:
-            records = json.load(file)
-            return records
-    except Exception as exception:
+        connection = open_records(database)
+        try:
+            if size is None:
+                rows = connection.execute("SELECT player, max(score) AS best FROM records GROUP BY player "
+                                          "ORDER BY best DESC LIMIT ?", (limit,))
+            else:
+                rows = connection.execute("SELECT player, score FROM records WHERE size = ? "
+                                          "ORDER BY score DESC LIMIT ?", (size, limit))
+            return OrderedDict(rows.fetchall())
+        finally:
+            connection.close()
+    except (sqlite3.Error, OSError, ValueError) as exception:
+        raise GetRecordsError(exception)
+
+
+def get_player_best(player_name, size=None, database=RECORDS_DATABASE):
+    """Get the best score of the player (None if there is no record)"""
+    try:
+        connection = open_records(database)
+        try:
+            if size is None:
+                rows = connection.execute("SELECT max(score) FROM records WHERE player = ?", (player_name,))
+            else:
+                rows = connection.execute("SELECT score FROM records WHERE size = ? AND player = ?",
+                                          (size, player_name))
+            row = rows.fetchone()
+            return None if row is None else row[0]
+        finally:
+            connection.close()
+    except (sqlite3.Error, OSError, ValueError) as exception:
         raise GetRecordsError(exception)
 
 
@@ -69,6 +503,12 @@ class GetRecordsError(Exception):
     """Can not get records error"""
     pass
 
+
 class LoadError(Exception):
     """Load game from file exception"""
-    pass
\ No newline at end of file
+    pass
+
+
+class UnknownEngineError(Exception):
+    """There is no engine with such name"""
+    pass
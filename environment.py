@@ -0,0 +1,161 @@
+"""This file implement the batched environment of the game over numpy arrays (numpy is required)"""
+import numpy
+from core import *
+
+# constants of the SplitMix64 generator
+SPLITMIX_GAMMA = numpy.uint64(0x9E3779B97F4A7C15)
+SPLITMIX_FIRST = numpy.uint64(0xBF58476D1CE4E5B9)
+SPLITMIX_SECOND = numpy.uint64(0x94D049BB133111EB)
+
+
+def mix_bits(numbers):
+    """Mix bits of the array of uint64 numbers (the output function of SplitMix64)"""
+    numbers = (numbers ^ (numbers >> numpy.uint64(30))) * SPLITMIX_FIRST
+    numbers = (numbers ^ (numbers >> numpy.uint64(27))) * SPLITMIX_SECOND
+    return numbers ^ (numbers >> numpy.uint64(31))
+
+
+class BatchEnvironment:
+    """Many games on fields of one size played at once
+
+    Boards are one (N, H, W) int8 array of colors (0 for a free cell), and
+    scores, next balls and random generators are lanes with an item per
+    game. Moves, spawns and removing of lines are done for all games by
+    whole array operations. Rules are the rules of Field: the amount of
+    colors, balls in line and next balls depend on the size, and removed
+    balls are scored the same way. Every game has its own SplitMix64
+    generator seeded by the seed and the number of the game, so a game does
+    not depend on the other games of the batch.
+    """
+
+    def __init__(self, amount_games, amount_cells=9, seed=0):
+        """Initialize games and start them"""
+        self.amount_games = amount_games
+        self.width = self.height = amount_cells
+        self.number_of_color = self.height // 2 + 3
+        self.balls_in_line = self.height // 3 + 2
+        self.number_of_next_ball = self.height // 4 + 1
+        self.boards = numpy.zeros((amount_games, self.height, self.width), dtype=numpy.int8)
+        self.cells = self.boards.reshape(amount_games, self.width * self.height)
+        self.scores = numpy.zeros(amount_games, dtype=numpy.int64)
+        self.next_balls = numpy.zeros((amount_games, self.number_of_next_ball), dtype=numpy.int8)
+        self.finished = numpy.zeros(amount_games, dtype=bool)
+        self.row_bits = (1 << numpy.arange(self.width)).astype(numpy.uint16)
+        games = numpy.arange(amount_games, dtype=numpy.uint64)
+        self.random_states = mix_bits(games + mix_bits(numpy.array([seed], dtype=numpy.uint64)))
+        self.reset()
+
+    def observe(self):
+        """Get read only views of boards and scores (they change with the games)"""
+        boards = self.boards.view()
+        boards.flags.writeable = False
+        scores = self.scores.view()
+        scores.flags.writeable = False
+        return boards, scores
+
+    def reset(self, games=None):
+        """Start again the games of the mask (all games by default)"""
+        if games is None:
+            games = numpy.ones(self.amount_games, dtype=bool)
+        self.boards[games] = 0
+        self.scores[games] = 0
+        self.finished[games] = False
+        self._make_next_balls(games)
+        self._set_next_balls(games)
+
+    def _draw(self, bound, games):
+        """Get a random number from 0 to bound - 1 for every game of the mask
+
+        The high 32 bits of the number are scaled to the bound by
+        multiplication and shift as Field.draw_random does.
+        """
+        self.random_states[games] += SPLITMIX_GAMMA
+        numbers = mix_bits(self.random_states[games]) >> numpy.uint64(32)
+        return ((numbers * numpy.asarray(bound, dtype=numpy.uint64)) >> numpy.uint64(32)).astype(numpy.intp)
+
+    def _make_next_balls(self, games):
+        """Set the following balls of the games of the mask"""
+        for ball in range(self.number_of_next_ball):
+            self.next_balls[games, ball] = self._draw(self.number_of_color, games) + 1
+
+    def _set_next_balls(self, games):
+        """Install the next balls of the games of the mask, full games are finished"""
+        free = self.cells == 0
+        amount_free = free.sum(axis=1)
+        full = games & (amount_free <= self.number_of_next_ball)
+        self.finished |= full
+        games = games & ~full
+        numbers = numpy.nonzero(games)[0]
+        if not len(numbers):
+            return
+        free = free[numbers]
+        amount_free = amount_free[numbers]
+        lanes = numpy.arange(len(numbers))
+        for ball in range(self.number_of_next_ball):
+            choice = self._draw(amount_free, games)
+            cells = (free.cumsum(axis=1, dtype=numpy.int16) <= choice[:, None]).sum(axis=1)
+            self.cells[numbers, cells] = self.next_balls[numbers, ball]
+            free[lanes, cells] = False
+            amount_free -= 1
+        self._make_next_balls(games)
+
+    def _delete_full_lines(self, games):
+        """Delete full lines of the games of the mask and score them, get the mask of games with lines"""
+        numbers = numpy.nonzero(games)[0]
+        boards = self.boards[numbers]
+        lines = full_lines_mask(boards, self.balls_in_line)
+        amounts = lines.sum(axis=(1, 2))
+        self.scores[numbers] += 10 * amounts * (amounts % self.balls_in_line + 1)
+        boards[lines] = 0
+        self.boards[numbers] = boards
+        cleared = numpy.zeros(self.amount_games, dtype=bool)
+        cleared[numbers] = amounts > 0
+        return cleared
+
+    def reachable_mask(self, starts):
+        """Get (N, H, W) masks of free cells reachable from the start cells (indexes y * width + x)
+
+        Every row of a board is a bit mask of free cells, so an area grows
+        by shifts of the rows. All games grow their areas together and a game
+        leaves the search when its area stops growing.
+        """
+        bits = self.row_bits
+        free = ((self.boards == 0) * bits).sum(axis=2, dtype=numpy.uint16)
+        reached = numpy.zeros_like(free)
+        games = numpy.arange(self.amount_games)
+        rows, columns = numpy.divmod(numpy.asarray(starts), self.width)
+        front = numpy.zeros_like(free)
+        front[games, rows] = bits[columns]
+        while len(games):
+            grown = front | (front << 1) | (front >> 1)
+            grown[:, 1:] |= front[:, :-1]
+            grown[:, :-1] |= front[:, 1:]
+            area = reached[games]
+            front = grown & free[games] & ~area
+            growing = front.any(axis=1)
+            reached[games] = area | front
+            games = games[growing]
+            front = front[growing]
+        return (reached[:, :, None] & bits) != 0
+
+    def step(self, starts, ends):
+        """Make a move in every game and get the gained scores and the mask of made moves
+
+        starts and ends are arrays of indexes (y * width + x) of cells, one
+        item per game. A move is skipped in a finished game, from a free cell
+        or to a cell the ball can not reach. After a move without lines the
+        next balls are installed as in the game.
+        """
+        starts = numpy.asarray(starts, dtype=numpy.intp)
+        ends = numpy.asarray(ends, dtype=numpy.intp)
+        games = numpy.arange(self.amount_games)
+        colors = self.cells[games, starts]
+        reached = self.reachable_mask(starts).reshape(self.amount_games, -1)[games, ends]
+        moved = ~self.finished & (colors != 0) & reached
+        self.cells[games[moved], ends[moved]] = colors[moved]
+        self.cells[games[moved], starts[moved]] = 0
+        scores = self.scores.copy()
+        spawned = moved & ~self._delete_full_lines(moved)
+        self._set_next_balls(spawned)
+        self._delete_full_lines(spawned)
+        return self.scores - scores, moved
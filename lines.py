@@ -1,6 +1,12 @@
 """This file implement graphical version of program"""
 import sys
+import argparse
 import logging
+import threading
+from collections import deque
+from time import perf_counter
+
+STARTED = perf_counter()  # the start of imports of the game and of PyQt5 for --startup-profile
 
 LOGGER = logging.getLogger("lines")
 logging.basicConfig(filename="lines.log", level=logging.INFO)
@@ -8,6 +14,9 @@ logging.basicConfig(filename="lines.log", level=logging.INFO)
 try:
     from core import *
     from driver import *
+    from replay import ReplayWriter
+    from timing import PerformanceStats
+    from advisor import Advisor
 except ImportError as e:
     LOGGER.error(e)
     sys.exit(f"Game modules not found: {e}")
@@ -54,7 +63,6 @@ class StartDialog(QtWidgets.QDialog):
         layout.addWidget(self.size_spin_box)
         layout.addWidget(self.button_ok)
         self.setLayout(layout)
-        self.show()
 
     def _create_label(self, text):
         """Creating text label"""
@@ -71,19 +79,111 @@ class StartDialog(QtWidgets.QDialog):
         self.parameters["size"] = self.size_spin_box.value()
 
 
+class IoTask(QtCore.QRunnable):
+    """Input/output task run in the pool of the queue"""
+
+    def __init__(self, queue, name, function, arguments):
+        """Initialize the task"""
+        super().__init__()
+        self.queue = queue
+        self.name = name
+        self.function = function
+        self.arguments = arguments
+
+    def run(self):
+        """Run the function and report the result by signals of the queue"""
+        try:
+            result = self.function(*self.arguments)
+        except Exception as exception:
+            self.queue.failed.emit(self.name, exception)
+        else:
+            self.queue.finished.emit(self.name, result)
+
+
+class IoQueue(QtCore.QObject):
+    """Queue of input/output tasks run one by one in a background thread
+
+    Results come back to the GUI thread by signals. A save waiting in the
+    queue is replaced by a newer save of the same file, so rapid saves are
+    written once.
+    """
+    finished = QtCore.pyqtSignal(str, object)
+    failed = QtCore.pyqtSignal(str, object)
+
+    def __init__(self, parent=None):
+        """Initialize the queue"""
+        super().__init__(parent)
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.lock = threading.Lock()
+        self.pending_saves = {}
+
+    def submit(self, name, function, *arguments):
+        """Run the function in the background thread"""
+        self.pool.start(IoTask(self, name, function, arguments))
+
+    def save(self, field, filename):
+        """Save the field in the background thread (the field is packed right now)"""
+        data = pack_field(field)
+        with self.lock:
+            is_queued = filename in self.pending_saves
+            self.pending_saves[filename] = data
+        if not is_queued:
+            self.submit("save", self._write_save, filename)
+
+    def _write_save(self, filename):
+        """Write the latest data saved in the file"""
+        with self.lock:
+            data = self.pending_saves.pop(filename)
+        write_save(data, filename)
+        return filename
+
+    def wait(self):
+        """Wait for all tasks"""
+        self.pool.waitForDone()
+
+
 class Window(QtWidgets.QWidget):
     """Main Window"""
 
-    def __init__(self):
+    def __init__(self, engine="list", replay_filename=None, show_hud=False):
         super().__init__()
         LOGGER.info("Main window was initialized.")
-        self.start_dialog = StartDialog()
-        self.start_dialog.button_ok.clicked.connect(self._new_game)
-        self.record_table = RecordTable()
-        self.record_table.ok_button.clicked.connect(self.record_table.hide)
-        self.record_table.hide()
+        self.engine = engine
+        self.replay_writer = ReplayWriter(replay_filename) if replay_filename else None
+        self._start_dialog = None
+        self._record_table = None
         self.game_board = GameBoard(self)
+        self.game_board.game_over.connect(self._add_record)
+        self.io_queue = IoQueue(self)
+        self.io_queue.finished.connect(self._io_finished)
+        self.io_queue.failed.connect(self._io_failed)
+        self.advisor = Advisor()
+        self.hint_queue = IoQueue(self)
+        self.hint_queue.finished.connect(self._hint_finished)
+        self.hint_queue.failed.connect(self._io_failed)
+        self.journal = Journal()
+        self.history = History()
         self._init_window()
+        self._init_hud(show_hud)
+        if not self._restore_autosave():
+            self.start_dialog.show()
+
+    @property
+    def start_dialog(self):
+        """Start dialog (it is created on first use)"""
+        if self._start_dialog is None:
+            self._start_dialog = StartDialog()
+            self._start_dialog.button_ok.clicked.connect(self._new_game)
+        return self._start_dialog
+
+    @property
+    def record_table(self):
+        """Record table (it is created on first use)"""
+        if self._record_table is None:
+            self._record_table = RecordTable()
+            self._record_table.ok_button.clicked.connect(self._record_table.hide)
+        return self._record_table
 
     def _init_window(self):
         """Initialize application window"""
@@ -99,6 +199,7 @@ class Window(QtWidgets.QWidget):
         quit_button.setToolTip("Quit the game")
         quit_button.setFocusPolicy(QtCore.Qt.NoFocus)
         quit_button.clicked.connect(QtCore.QCoreApplication.instance().quit)
+        QtCore.QCoreApplication.instance().aboutToQuit.connect(self._finish_recording)
         restart_button = QtWidgets.QPushButton("Restart", self)
         restart_button.setToolTip("Restart the game with start parameters")
         restart_button.setFocusPolicy(QtCore.Qt.NoFocus)
@@ -115,6 +216,18 @@ class Window(QtWidgets.QWidget):
         record_button.setToolTip("Show table of records")
         record_button.setFocusPolicy(QtCore.Qt.NoFocus)
         record_button.clicked.connect(self._show_record)
+        undo_button = QtWidgets.QPushButton("Undo", self)
+        undo_button.setToolTip("Take back the last turn (Ctrl+Z)")
+        undo_button.setFocusPolicy(QtCore.Qt.NoFocus)
+        undo_button.clicked.connect(self._undo)
+        redo_button = QtWidgets.QPushButton("Redo", self)
+        redo_button.setToolTip("Make again the taken back turn (Ctrl+Y)")
+        redo_button.setFocusPolicy(QtCore.Qt.NoFocus)
+        redo_button.clicked.connect(self._redo)
+        hint_button = QtWidgets.QPushButton("Hint", self)
+        hint_button.setToolTip("Show the best move")
+        hint_button.setFocusPolicy(QtCore.Qt.NoFocus)
+        hint_button.clicked.connect(self._request_hint)
         layout.addWidget(self._create_label("SCORE"), 4, 51, 1, 15)
         layout.addWidget(score_lcd, 6, 51, 7, 15)
         layout.addWidget(save_button, 30, 51, 3, 15)
@@ -122,9 +235,48 @@ class Window(QtWidgets.QWidget):
         layout.addWidget(restart_button, 44, 51, 3, 15)
         layout.addWidget(quit_button, 47, 51, 3, 15)
         layout.addWidget(record_button, 24, 51, 3, 15)
+        layout.addWidget(hint_button, 20, 51, 3, 15)
+        layout.addWidget(undo_button, 14, 51, 3, 15)
+        layout.addWidget(redo_button, 17, 51, 3, 15)
         layout.addWidget(self.game_board, 0, 0, 50, 50)
         self.setLayout(layout)
 
+    def _init_hud(self, show_hud):
+        """Initialize the performance HUD over the game board (F3 shows and hides it)"""
+        self.hud = QtWidgets.QLabel(self.game_board)
+        self.hud.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.hud.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: white; padding: 4px;")
+        self.hud.move(4, 4)
+        self.hud_timer = QtCore.QTimer(self)
+        self.hud_timer.setInterval(HUD_INTERVAL)
+        self.hud_timer.timeout.connect(self._refresh_hud)
+        self._show_hud(show_hud)
+
+    def _show_hud(self, visible):
+        """Show or hide the performance HUD"""
+        self.hud.setVisible(visible)
+        if visible:
+            self._refresh_hud()
+            self.hud_timer.start()
+        else:
+            self.hud_timer.stop()
+
+    def _refresh_hud(self):
+        """Show the latest timings on the HUD"""
+        self.hud.setText("\n".join(self.game_board.stats.summary()) or "No timings yet")
+        self.hud.adjustSize()
+
+    def keyPressEvent(self, event):
+        """Key Press Event"""
+        if event.key() == QtCore.Qt.Key_F3:
+            self._show_hud(not self.hud.isVisible())
+        elif event.matches(QtGui.QKeySequence.Undo):
+            self._undo()
+        elif event.matches(QtGui.QKeySequence.Redo):
+            self._redo()
+        else:
+            super().keyPressEvent(event)
+
     def _create_label(self, text):
         """Create text label"""
         label = QtWidgets.QLabel(text, self)
@@ -140,20 +292,65 @@ class Window(QtWidgets.QWidget):
     def _new_game(self):
         """Create new game"""
         self.hide()
-        self.start_dialog.show()
         self.parameters = self.start_dialog.parameters
         self.start_dialog.hide()
         size = self.parameters["size"]
         player_name = self.parameters["name"]
         if player_name is not None or player_name != "":
-            self.game_board.game_field = Field(size, player_name)
+            self.game_board.game_field = create_field(size, player_name, self.engine)
         else:
-            self.game_board.game_field = Field(size)
+            self.game_board.game_field = create_field(size, engine=self.engine)
         self.game_board.new_game()
+        self.history.attach(self.game_board.game_field)
+        self._start_autosave()
         self.update()
         self.show()
         LOGGER.info(f"Start new game. Field size: {size}. Player name: {self.game_board.game_field.player}.")
 
+    def _start_autosave(self):
+        """Write changes of the game to the autosave and to the replay"""
+        try:
+            self.journal.attach(self.game_board.game_field)
+        except OSError as exception:
+            LOGGER.warning(f"Autosave is off: {exception}")
+        if self.replay_writer is not None:
+            try:
+                self.replay_writer.follow(self.game_board.game_field)
+            except OSError as exception:
+                LOGGER.warning(f"Replay is off: {exception}")
+                self.replay_writer = None
+
+    def _finish_recording(self):
+        """Finish writing of files: saves, records, the autosave, the replay and timings"""
+        self.io_queue.wait()
+        self.hint_queue.wait()
+        histogram = self.game_board.stats.histogram()
+        if histogram:
+            LOGGER.info("Timings of the interface:\n" + "\n".join(histogram))
+        self.journal.detach()
+        if self.replay_writer is not None:
+            self.replay_writer.close()
+
+    def _restore_autosave(self):
+        """Offer to continue the game of the last run (True if the game goes on)"""
+        if not has_autosave():
+            return False
+        answer = QtWidgets.QMessageBox.question(self, "Autosave", "Continue the unfinished game?",
+                                                QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
+        if answer != QtWidgets.QMessageBox.Yes:
+            return False
+        try:
+            self.game_board.game_field = recover_game()
+        except LoadError as exception:
+            LOGGER.warning(f"Can not recover the game: {exception}")
+            return False
+        self.history.attach(self.game_board.game_field)
+        self._start_autosave()
+        self.game_board.score_changed.emit(self.game_board.game_field.score)
+        self.show()
+        LOGGER.info("Game was recovered from autosave.")
+        return True
+
     def _restart_game(self):
         """Restart game with equals parameters"""
         self.game_board.new_game()
@@ -163,34 +360,89 @@ class Window(QtWidgets.QWidget):
     def _save_game(self):
         """Save game"""
         filename, _ = QtWidgets.QFileDialog(self).getSaveFileName(self, "Save game", "save_name", "Data (*.lines)")
-        try:
-            save_in_file(self.game_board.game_field, filename)
-        except Exception as exception:
-            LOGGER.warning("Save error.")
-            LOGGER.warning(exception)
-            QtWidgets.QMessageBox.warning(self, "Error", " Save Error! ", QtWidgets.QMessageBox.Ok)
+        if filename:
+            self.io_queue.save(self.game_board.game_field, filename)
 
     def _load_game(self):
         """Load game"""
         filename, _ = QtWidgets.QFileDialog(self).getOpenFileName(self, "Load game", filter="Data (*.lines)")
-        try:
-            field = load_from_file(filename)
-            self.game_board.game_field = field
+        if filename:
+            self.io_queue.submit("load", load_from_file, filename)
+
+    def _undo(self):
+        """Take back the last turn"""
+        if self.game_board.game_field is not None and not self.game_board.frame_timer.isActive():
+            self._show_turn(self.history.undo())
+
+    def _redo(self):
+        """Make again the taken back turn"""
+        if self.game_board.game_field is not None and not self.game_board.frame_timer.isActive():
+            self._show_turn(self.history.redo())
+
+    def _show_turn(self, field):
+        """Go on with the field of the history"""
+        if field is None:
+            return
+        self.game_board.game_field = field
+        self.game_board.coordinates = None
+        self._start_autosave()
+        self.game_board.score_changed.emit(field.score)
+        LOGGER.info(f"Game went to turn {self.history.position}. Score: {field.score}.")
+
+    def _request_hint(self):
+        """Search the best move in the background thread"""
+        if self.game_board.game_field is not None:
+            self.hint_queue.submit("hint", self._find_hint, self.game_board.game_field.copy(),
+                                   self.game_board.changes)
+
+    def _find_hint(self, field, changes):
+        """Find the best move on the copy of the field (it runs in the background thread)"""
+        return changes, self.advisor.advise(field)
+
+    def _hint_finished(self, name, result):
+        """Show the best move if the field was not changed during the search"""
+        changes, (move, value) = result
+        if move is not None and changes == self.game_board.changes:
+            self.game_board.show_hint(move)
+            LOGGER.info(f"Hint: {move}, value {value}, depth {self.advisor.depth}.")
+
+    def _add_record(self, player, score, size):
+        """Add the record of the finished game"""
+        self.io_queue.submit("record", add_record, player, score, size)
+
+    def _io_finished(self, name, result):
+        """Take the result of the background task"""
+        if name == "load":
+            self.game_board.game_field = result
+            self.game_board.coordinates = None
+            self.history.attach(self.game_board.game_field)
+            self._start_autosave()
             self.game_board.score_changed.emit(self.game_board.game_field.score)
             self.update()
             LOGGER.info("Game was loaded from file")
-        except LoadError as exception:
+        elif name == "save":
+            LOGGER.info(f"Game was saved in {result}")
+        elif name == "record":
+            LOGGER.info("Record was added.")
+
+    def _io_failed(self, name, exception):
+        """Report the error of the background task"""
+        if name == "load":
             LOGGER.warning("Load error")
             LOGGER.warning(exception)
             QtWidgets.QMessageBox.warning(self, "Error", " Load error! ", QtWidgets.QMessageBox.Ok)
-        except Exception as exception:
-            LOGGER.warning("Load error")
+        elif name == "save":
+            LOGGER.warning("Save error.")
             LOGGER.warning(exception)
-            QtWidgets.QMessageBox.warning(self, "Error", " Load error! ", QtWidgets.QMessageBox.Ok)
+            QtWidgets.QMessageBox.warning(self, "Error", " Save Error! ", QtWidgets.QMessageBox.Ok)
+        elif name == "record":
+            LOGGER.info(f"Can not add record {exception}")
+        elif name == "hint":
+            LOGGER.warning(f"Can not find the hint {exception}")
 
     def _show_record(self):
         try:
-            self.record_table.fill_record_table()
+            self.record_table.fill_record_table(self.game_board.game_field.width)
         except GetRecordsError as exception:
             LOGGER.warning(f"Can not show record table {exception}")
             QtWidgets.QMessageBox.warning(self, "Error", f" Can not show Record Table ", QtWidgets.QMessageBox.Ok)
@@ -198,19 +450,88 @@ class Window(QtWidgets.QWidget):
             self.record_table.show()
 
 
+BALL_COLORS = [0x14D100, 0xFFFF00, 0xFFAE00, 0xFF1800, 0xD0006E,
+               0x3016B0, 0x01939A, 0xCD0074, 0x00AC6B, 0xAEF100]
+BALL_LIGHT_COLORS = [0x4AE83A, 0xFBFE72, 0xFFC340, 0xFF5240, 0xE73A95,
+                     0x624AD8, 0x34C6CD, 0xE6399B, 0x35D699, 0xC4F83E]
+BLANK_CELL_COLOR = 0xDFDFDF
+HINT_CELL_COLOR = 0xA8E6A1
+# milliseconds between frames of animations, per cell of the path of a ball and for fading lines
+FRAME_INTERVAL = 16
+MOVE_STEP_DURATION = 45
+FADE_DURATION = 300
+# milliseconds between refreshes of the performance HUD
+HUD_INTERVAL = 500
+
+
 class GameBoard(QtWidgets.QWidget):
-    """Game Board in application"""
+    """Game Board in application
+
+    The board watches its field and repaints only the cells changed by the
+    game. Balls are drawn from pixmaps rendered once per color, selection
+    and size of the cell. A moved ball travels along the shortest path found
+    by the field and full lines fade out; the field changes when the
+    animation ends and clicks made meanwhile are queued.
+    """
     score_changed = QtCore.pyqtSignal(int)
+    game_over = QtCore.pyqtSignal(str, int, int)
 
-    def __init__(self, perent, *params):
-        """Initialize a Game Board object"""
+    def __init__(self, perent, field=None):
+        """Initialize a Game Board object (without a field until the game starts)"""
         super().__init__(perent)
         self.setFocusPolicy(QtCore.Qt.StrongFocus)
         self.setFixedSize(500, 500)
-        self.game_field = Field(*params)
+        self.ball_pixmaps = {}
+        self.frame_timer = QtCore.QTimer(self)
+        self.frame_timer.setInterval(FRAME_INTERVAL)
+        self.frame_timer.timeout.connect(self._next_frame)
+        self.animation_clock = QtCore.QElapsedTimer()
+        self.moving_path = None
+        self.moving_ball = None
+        self.moving_index = 0
+        self.fading_cells = None
+        self.fading_opacity = 1.0
+        self.queued_clicks = deque()
+        self.stats = PerformanceStats()
+        self.click_started = None
+        self.changes = 0
+        self.hint_cell = None
+        self._game_field = None
+        self.game_field = field
         self.coordinates = None  # Used in Mouse Event
         LOGGER.info(f"Game Board Widget was initialized")
 
+    @property
+    def game_field(self):
+        """The field shown on the board"""
+        return self._game_field
+
+    @game_field.setter
+    def game_field(self, field):
+        """Show the field on the board and watch its changes"""
+        if self._game_field is not None and self in self._game_field.observers:
+            self._game_field.observers.remove(self)
+        self.stop_animation()
+        self.changes += 1
+        self.hint_cell = None
+        self._game_field = field
+        if field is not None:
+            field.observers.append(self)
+        self.update()
+
+    def field_changed(self, event, *arguments):
+        """Repaint cells changed on the field"""
+        self.changes += 1
+        self.show_hint(None)
+        if event == "step":
+            self.update_cell(arguments[0], arguments[1])
+            self.update_cell(arguments[2], arguments[3])
+        elif event == "spawn" or event == "remove":
+            self.update_cell(arguments[0], arguments[1])
+        elif event == "reset":
+            self.stop_animation()
+            self.update()
+
     def get_square_width(self):
         """Get the width of the cage of the playing field"""
         return self.width() // self.game_field.width
@@ -219,104 +540,262 @@ class GameBoard(QtWidgets.QWidget):
         """Get the height of the cage of the playing field"""
         return self.height() // self.game_field.height
 
+    def get_board_top(self):
+        """Get the top of the playing field on the widget"""
+        return self.contentsRect().bottom() - self.game_field.height * self.get_square_height()
+
+    def get_cell_rect(self, x, y):
+        """Get the rectangle of the cell by coordinates"""
+        return QtCore.QRect(self.contentsRect().left() + x * self.get_square_width(),
+                            self.get_board_top() + y * self.get_square_height(),
+                            self.get_square_width(), self.get_square_height())
+
+    def update_cell(self, x, y):
+        """Schedule repainting of the cell"""
+        self.update(self.get_cell_rect(x, y))
+
+    def select(self, coordinates):
+        """Select the ball by coordinates (None to drop the selection)"""
+        if self.coordinates is not None:
+            self.update_cell(*self.coordinates)
+        self.coordinates = coordinates
+        if coordinates is not None:
+            self.update_cell(*coordinates)
+
+    def show_hint(self, move):
+        """Select the ball of the move and mark its end cell (None to drop the mark)"""
+        if self.hint_cell is not None:
+            self.update_cell(*self.hint_cell)
+            self.hint_cell = None
+        if move is not None:
+            self.select(move[0])
+            self.hint_cell = move[1]
+            self.update_cell(*self.hint_cell)
+
     def new_game(self):
         """Start new game"""
         self.game_field.refresh_field()
         self.score_changed.emit(self.game_field.score)
 
-    def draw_blank_cell(self, painter, x, y):
+    def draw_blank_cell(self, painter, x, y, color=BLANK_CELL_COLOR):
         """Draw a blank cell"""
         painter.fillRect(x + 1, y + 1, self.get_square_width() - 2,
-                         self.get_square_height() - 2, QtGui.QColor(0xDFDFDF))
-
-    def draw_ball(self, painter, x, y, ball):
+                         self.get_square_height() - 2, QtGui.QColor(color))
+
+    def get_ball_pixmap(self, color, selected):
+        """Get the picture of the ball of the color in the cell"""
+        key = (color, selected, self.get_square_width(), self.get_square_height())
+        pixmap = self.ball_pixmaps.get(key)
+        if pixmap is None:
+            pixmap = QtGui.QPixmap(key[2], key[3])
+            pixmap.fill(QtCore.Qt.transparent)
+            if not selected:
+                color_1 = QtGui.QColor(BALL_COLORS[color - 1])
+                color_2 = QtGui.QColor(BALL_LIGHT_COLORS[color - 1])
+            else:
+                color_1 = QtGui.QColor(BALL_LIGHT_COLORS[color - 1])
+                color_2 = QtGui.QColor(BALL_COLORS[color - 1])
+            painter = QtGui.QPainter(pixmap)
+            pen = QtGui.QPen()
+            pen.setColor(color_1)
+            pen.setWidth(3)
+            painter.setPen(pen)
+            painter.setBrush(color_2)
+            painter.drawEllipse(4, 4, key[2] - 8, key[3] - 8)
+            painter.end()
+            self.ball_pixmaps[key] = pixmap
+        return pixmap
+
+    def draw_ball(self, painter, x, y, ball, selected=False):
         """Draw a color ball"""
-        color_table = [0x14D100, 0xFFFF00, 0xFFAE00, 0xFF1800, 0xD0006E,
-                       0x3016B0, 0x01939A, 0xCD0074, 0x00AC6B, 0xAEF100]
-        color_table_2 = [0x4AE83A, 0xFBFE72, 0xFFC340, 0xFF5240, 0xE73A95,
-                         0x624AD8, 0x34C6CD, 0xE6399B, 0x35D699, 0xC4F83E]
-        if not ball.selected:
-            color_1 = QtGui.QColor(color_table[ball.color - 1])
-            color_2 = QtGui.QColor(color_table_2[ball.color - 1])
-        else:
-            color_1 = QtGui.QColor(color_table_2[ball.color - 1])
-            color_2 = QtGui.QColor(color_table[ball.color - 1])
-        pen = QtGui.QPen()
-        pen.setColor(color_1)
-        pen.setWidth(3)
-        painter.setPen(pen)
-        painter.setBrush(color_2)
-        painter.drawEllipse(x + 4, y + 4, self.get_square_width() - 8, self.get_square_height() - 8)
+        painter.drawPixmap(x, y, self.get_ball_pixmap(ball.color, selected))
 
     def paintEvent(self, event):
-        """Paint Event"""
+        """Paint cells in the region to repaint"""
+        if self.game_field is None:
+            return
+        started = self.stats.start()
         painter = QtGui.QPainter(self)
-        rect = self.contentsRect()
-        board_top = rect.bottom() - self.game_field.height * self.get_square_height()
-        for x in range(self.game_field.height):
-            for y in range(self.game_field.width):
-                self.draw_blank_cell(painter, rect.left() + y * self.get_square_width(),
-                                     board_top + x * self.get_square_height())
-                ball = self.game_field.field[x][y]
-                if ball is not None:
-                    self.draw_ball(painter, rect.left() + y * self.get_square_width(),
-                                   board_top + x * self.get_square_height(), ball)
+        for area in event.region().rects():
+            self._paint_cells(painter, area)
+        painter.end()
+        self.stats.stop("paint", started)
+        if self.click_started is not None:
+            self.stats.stop("click to repaint", self.click_started)
+            self.click_started = None
+
+    def _paint_cells(self, painter, area):
+        """Paint cells in the area"""
+        left = self.contentsRect().left()
+        board_top = self.get_board_top()
+        square_width = self.get_square_width()
+        square_height = self.get_square_height()
+        first_column = max(0, (area.left() - left) // square_width)
+        last_column = min(self.game_field.width - 1, (area.right() - left) // square_width)
+        first_row = max(0, (area.top() - board_top) // square_height)
+        last_row = min(self.game_field.height - 1, (area.bottom() - board_top) // square_height)
+        for y in range(first_row, last_row + 1):
+            for x in range(first_column, last_column + 1):
+                self.draw_blank_cell(painter, left + x * square_width, board_top + y * square_height,
+                                     HINT_CELL_COLOR if self.hint_cell == (x, y) else BLANK_CELL_COLOR)
+                ball = self.game_field.get_ball(x, y)
+                if self.moving_path is not None:
+                    if (x, y) == self.moving_path[0]:
+                        ball = None
+                    if (x, y) == self.moving_path[self.moving_index]:
+                        ball = self.moving_ball
+                if ball is None:
+                    continue
+                if self.fading_cells is not None and (x, y) in self.fading_cells:
+                    painter.setOpacity(self.fading_opacity)
+                self.draw_ball(painter, left + x * square_width,
+                               board_top + y * square_height, ball, self.coordinates == (x, y))
+                painter.setOpacity(1.0)
 
     def mousePressEvent(self, event):
-        """Mouse Press Event"""
-        try:
-            y = event.y() // self.get_square_width()
-            x = event.x() // self.get_square_height()
-            if x < 0 or x >= self.game_field.height or y < 0 or y >= self.game_field.width:
-                return
-
-            if self.game_field.get_ball(x, y) is None:
-                if self.coordinates is not None:
-                    if self.game_field.try_move(self.coordinates[0], self.coordinates[1], x, y):
-                        self.game_field.make_step(self.coordinates[0], self.coordinates[1], x, y)
-                        LOGGER.info(f"Player make step from {self.coordinates} in {(x, y)}.")
-                        find_lines = self.game_field.find_full_lines(x, y)
-                        if find_lines is None:
-                            self.game_field.set_next_balls()
-                            LOGGER.info(f"Following {self.game_field.number_of_next_ball} balls are installed.")
-                            for coordinates in self.game_field.set_balls:
-                                array = self.game_field.find_full_lines(coordinates[0], coordinates[1])
-                                if array is not None:
-                                    self.game_field.delete_full_lines(array)
-                                    self.score_changed.emit(self.game_field.score)
-                                    LOGGER.info(
-                                        f"Found full lines: {find_lines} and deleted. Score: {self.game_field.score}.")
-                        else:
-                            self.game_field.delete_full_lines(find_lines)
-                            self.score_changed.emit(self.game_field.score)
-                            LOGGER.info(f"Found full lines: {find_lines} and deleted. Score: {self.game_field.score}.")
-                        self.coordinates = None
-            else:
-                if self.coordinates is None:
-                    self.game_field.get_ball(x, y).selected = True
-                    self.coordinates = (x, y)
-                else:
-                    if self.coordinates == (x, y):
-                        self.game_field.get_ball(x, y).selected = False
-                        self.coordinates = None
-                    else:
-                        self.game_field.get_ball(x, y).selected = True
-                        self.game_field.get_ball(self.coordinates[0], self.coordinates[1]).selected = False
-                        self.coordinates = (x, y)
-            self.update()
-        except FieldFullException:
-            LOGGER.info(f"Field full, game over. {self.game_field.score} points.")
+        """Mouse Press Event (clicks during an animation wait for its end)"""
+        if self.game_field is None:
+            return
+        y = event.y() // self.get_square_width()
+        x = event.x() // self.get_square_height()
+        if x < 0 or x >= self.game_field.width or y < 0 or y >= self.game_field.height:
+            return
+        self.click_started = self.stats.start()
+        if self.frame_timer.isActive():
+            self.queued_clicks.append((x, y))
+        else:
+            self.click(x, y)
+
+    def click(self, x, y):
+        """Select the ball or move the selected ball to the free cell"""
+        self.show_hint(None)
+        if self.game_field.get_ball(x, y) is None:
+            if self.coordinates is not None:
+                path = self.stats.measure("find_path", self.game_field.find_path,
+                                          self.coordinates[0], self.coordinates[1], x, y)
+                if path is not None:
+                    self.start_move(path)
+        elif self.coordinates == (x, y):
+            self.select(None)
+        else:
+            self.select((x, y))
+
+    def start_move(self, path):
+        """Start the travel of the selected ball along the path"""
+        self.coordinates = None
+        self.moving_path = path
+        self.moving_ball = self.game_field.get_ball(*path[0])
+        self.moving_index = 0
+        self.update_cell(*path[0])
+        self._start_animation()
+
+    def start_fade(self, cells):
+        """Start the fade-out of balls of the full lines"""
+        self.fading_cells = cells
+        self.fading_opacity = 1.0
+        self._start_animation()
+
+    def _start_animation(self):
+        """Start the clock and the timer of frames"""
+        self.animation_clock.start()
+        if not self.frame_timer.isActive():
+            self.frame_timer.start()
+
+    def stop_animation(self):
+        """Drop the animation and queued clicks without changing the field"""
+        self.frame_timer.stop()
+        self.moving_path = None
+        self.moving_ball = None
+        self.fading_cells = None
+        self.queued_clicks.clear()
+
+    def _next_frame(self):
+        """Advance the animation and repaint the cells it touches"""
+        elapsed = self.animation_clock.elapsed()
+        if self.moving_path is not None:
+            index = min(elapsed // MOVE_STEP_DURATION, len(self.moving_path) - 1)
+            if index != self.moving_index:
+                self.update_cell(*self.moving_path[self.moving_index])
+                self.update_cell(*self.moving_path[index])
+                self.moving_index = index
+            if index == len(self.moving_path) - 1:
+                path = self.moving_path
+                self.moving_path = None
+                self.moving_ball = None
+                self._finish_move(path[0], path[-1])
+        elif self.fading_cells is not None:
+            self.fading_opacity = max(0.0, 1 - elapsed / FADE_DURATION)
+            for cell in self.fading_cells:
+                self.update_cell(*cell)
+            if self.fading_opacity == 0:
+                cells = self.fading_cells
+                self.fading_cells = None
+                self.game_field.delete_full_lines(cells)
+                self.score_changed.emit(self.game_field.score)
+                LOGGER.info(f"Found full lines: {cells} and deleted. Score: {self.game_field.score}.")
+        if self.moving_path is None and self.fading_cells is None:
+            self.frame_timer.stop()
+            while self.queued_clicks and not self.frame_timer.isActive():
+                self.click(*self.queued_clicks.popleft())
+
+    def _finish_move(self, start, end):
+        """Make the step on the field and go on with the turn"""
+        self.game_field.make_step(start[0], start[1], end[0], end[1])
+        LOGGER.info(f"Player make step from {start} in {end}.")
+        find_lines = self.stats.measure("scan_all_lines", self.game_field.scan_all_lines)
+        if find_lines is None:
             try:
-                add_record(self.game_field.player, self.game_field.score)
-                LOGGER.info(f'Record {self.game_field.player} : {self.game_field.score} was added.')
-            except AddRecordError as exception:
-                LOGGER.info(f"Can not add record {exception}")
-            QtWidgets.QMessageBox.information(self, "Game Over",
-                                              f"{self.game_field.player}, you scored: {self.game_field.score} points. "
-                                              f"Game will be restart",
-                                              QtWidgets.QMessageBox.Ok)
-            self.coordinates = None
-            self.new_game()
+                self.game_field.set_next_balls()
+            except FieldFullException:
+                self._finish_game()
+                return
+            LOGGER.info(f"Following {self.game_field.number_of_next_ball} balls are installed.")
+            find_lines = self.stats.measure("scan_all_lines", self.game_field.scan_all_lines)
+        if find_lines is not None:
+            self.start_fade(find_lines)
+
+    def _finish_game(self):
+        """Show the result and start the new game"""
+        self.stop_animation()
+        LOGGER.info(f"Field full, game over. {self.game_field.score} points.")
+        self.game_over.emit(self.game_field.player, self.game_field.score, self.game_field.width)
+        QtWidgets.QMessageBox.information(self, "Game Over",
+                                          f"{self.game_field.player}, you scored: {self.game_field.score} points. "
+                                          f"Game will be restart",
+                                          QtWidgets.QMessageBox.Ok)
+        self.select(None)
+        self.new_game()
+
+
+class StartupProfile(QtCore.QObject):
+    """Durations of the start of the application up to the first paint"""
+
+    def __init__(self, started):
+        """Initialize the profile from the moment of the start"""
+        super().__init__()
+        self.moments = [("start", started)]
+        self.painted = False
+
+    def mark(self, name):
+        """Mark the end of the stage of the start"""
+        self.moments.append((name, perf_counter()))
+
+    def eventFilter(self, watched, event):
+        """Wait for the first paint of any window"""
+        if not self.painted and event.type() == QtCore.QEvent.Paint:
+            self.painted = True
+            QtCore.QTimer.singleShot(0, self.report)
+        return False
+
+    def report(self):
+        """Mark the end of the first paint and report all stages"""
+        self.mark("first paint")
+        QtCore.QCoreApplication.instance().removeEventFilter(self)
+        lines = [f"{name}: {(moment - previous) * 1000:.1f} ms"
+                 for (_, previous), (name, moment) in zip(self.moments, self.moments[1:])]
+        lines.append(f"total: {(self.moments[-1][1] - self.moments[0][1]) * 1000:.1f} ms")
+        LOGGER.info("Startup profile:\n" + "\n".join(lines))
+        print("\n".join(lines))
 
 
 class RecordTable(QtWidgets.QWidget):
@@ -335,7 +814,7 @@ class RecordTable(QtWidgets.QWidget):
         self.title_label = QtWidgets.QLabel("Records Table", self)
         self.title_label.setAlignment(QtCore.Qt.AlignCenter | QtCore.Qt.AlignBottom)
         self.record_table = QtWidgets.QTableWidget(self)
-        self.record_table.setRowCount(8)
+        self.record_table.setRowCount(RECORDS_IN_TABLE)
         self.record_table.setColumnCount(2)
         item = QtWidgets.QTableWidgetItem("Player Name")
         self.record_table.setHorizontalHeaderItem(0, item)
@@ -348,11 +827,12 @@ class RecordTable(QtWidgets.QWidget):
         layout.addWidget(self.record_table)
         layout.addWidget(self.ok_button)
         self.setLayout(layout)
-        self.show()
 
-    def fill_record_table(self):
-        """Fill record table"""
-        records = get_records()
+    def fill_record_table(self, size):
+        """Fill record table with the best records of the size of the field"""
+        records = get_records(RECORDS_IN_TABLE, size)
+        self.title_label.setText(f"Records Table {size}x{size}")
+        self.record_table.clearContents()
         counter = 0
         for record in records.items():
             text_item = QtWidgets.QTableWidgetItem(record[0])
@@ -365,6 +845,19 @@ class RecordTable(QtWidgets.QWidget):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Game \"Lines\"")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="list", help="engine of the game field")
+    parser.add_argument("--replay", metavar="FILE", help="write the replay of the game to the file")
+    parser.add_argument("--hud", action="store_true", help="show timings of the interface (F3 toggles it)")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="report durations of the start of the application up to the first paint")
+    arguments = parser.parse_args()
+    profile = StartupProfile(STARTED) if arguments.startup_profile else None
     app = QtWidgets.QApplication([])
-    lines = Window()
+    if profile is not None:
+        profile.mark("imports and application")
+        app.installEventFilter(profile)
+    lines = Window(arguments.engine, arguments.replay, arguments.hud)
+    if profile is not None:
+        profile.mark("main window")
     sys.exit(app.exec_())
@@ -0,0 +1,196 @@
+"""This file implements replays of games with keyframes and fast seek"""
+import argparse
+import struct
+from bisect import bisect_right
+from driver import *
+
+REPLAY_MAGIC = b"LNRP"
+REPLAY_VERSION = 1
+# magic, version, moves between keyframes
+REPLAY_HEADER = struct.Struct("<4sBH")
+# kind of the record of a keyframe, the record holds the flag "the keyframe takes place of a step"
+# and the length of the packed field after it
+REPLAY_KEYFRAME = 100
+# move number and offset of the keyframe record
+INDEX_ENTRY = struct.Struct("<II")
+# amount of entries, offset of the index, magic of the index
+INDEX_FOOTER = struct.Struct("<II4s")
+INDEX_MAGIC = b"LNRX"
+
+
+class ReplayWriter:
+    """Write the replay of the game on the field
+
+    Changes of the field are written as records of the journal. Every
+    keyframe_every moves the whole field right after the move is written as
+    a keyframe in place of the record of the move. On close the index of
+    keyframes is appended, so a reader finds them without reading records.
+    """
+
+    def __init__(self, filename, keyframe_every=50):
+        """Initialize the writer"""
+        self.filename = filename
+        self.keyframe_every = keyframe_every
+        self.field = None
+        self.file = None
+        self.amount_moves = 0
+        self.index = []
+
+    def attach(self, field):
+        """Start the replay of the field from its current state"""
+        self.close()
+        self.file = open(self.filename, "wb")
+        self.file.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.keyframe_every))
+        self.field = field
+        self.amount_moves = 0
+        self.index = []
+        field.observers.append(self)
+        self._write_keyframe(False)
+
+    def follow(self, field):
+        """Go on with the field which takes place of the watched one (after undo, redo or load)
+
+        The field is written as a keyframe which is not a move, so the
+        replay keeps everything written before and seek to its move shows it.
+        """
+        if self.file is None:
+            self.attach(field)
+            return
+        if self.field is not None:
+            self.field.observers.remove(self)
+        self.field = field
+        field.observers.append(self)
+        self._write_keyframe(False)
+
+    def close(self):
+        """Finish the replay with the index of keyframes"""
+        if self.field is not None:
+            self.field.observers.remove(self)
+            self.field = None
+        if self.file is not None:
+            index_offset = self.file.tell()
+            for entry in self.index:
+                self.file.write(INDEX_ENTRY.pack(*entry))
+            self.file.write(INDEX_FOOTER.pack(len(self.index), index_offset, INDEX_MAGIC))
+            self.file.close()
+            self.file = None
+
+    def _write_keyframe(self, after_step):
+        """Write the whole field"""
+        data = pack_field(self.field)
+        self.index.append((self.amount_moves, self.file.tell()))
+        self.file.write(JOURNAL_RECORD.pack(REPLAY_KEYFRAME, after_step, 0, 0, 0, len(data)))
+        self.file.write(data)
+
+    def field_changed(self, event, *arguments):
+        """Write the record of the change of the field"""
+        if event == "step":
+            self.amount_moves += 1
+            if self.amount_moves % self.keyframe_every == 0:
+                self._write_keyframe(True)
+                return
+        self.file.write(pack_event(event, arguments))
+
+
+class ReplayReader:
+    """Read the replay and seek to any move"""
+
+    def __init__(self, filename):
+        """Read the replay file and its index of keyframes"""
+        try:
+            with open(filename, "rb") as file:
+                self.data = memoryview(file.read())
+            magic, version, self.keyframe_every = REPLAY_HEADER.unpack_from(self.data)
+        except (OSError, struct.error) as exception:
+            raise LoadError(exception)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise LoadError("Not a replay of the game")
+        self.end = len(self.data)
+        self.index = self._read_index()
+        if self.index is None:
+            self.index = self._scan_index()
+        if not self.index:
+            raise LoadError("There are no keyframes in the replay")
+        self.amount_moves = self._count_moves()
+
+    def _read_index(self):
+        """Read the index of keyframes from the end of the file"""
+        if self.end < REPLAY_HEADER.size + INDEX_FOOTER.size:
+            return
+        amount, offset, magic = INDEX_FOOTER.unpack_from(self.data, self.end - INDEX_FOOTER.size)
+        if magic != INDEX_MAGIC or offset + amount * INDEX_ENTRY.size + INDEX_FOOTER.size != self.end:
+            return
+        self.end = offset
+        return [INDEX_ENTRY.unpack_from(self.data, offset + number * INDEX_ENTRY.size) for number in range(amount)]
+
+    def _scan_index(self):
+        """Find keyframes by reading all records (the replay was not closed)"""
+        index = []
+        amount_moves = 0
+        for offset, kind, record in self._records(REPLAY_HEADER.size):
+            if kind == JOURNAL_STEP or kind == REPLAY_KEYFRAME and record[1]:
+                amount_moves += 1
+            if kind == REPLAY_KEYFRAME:
+                index.append((amount_moves, offset))
+        return index
+
+    def _records(self, offset):
+        """Iterate offsets, kinds and records starting from the offset"""
+        while offset + JOURNAL_RECORD.size <= self.end:
+            record = JOURNAL_RECORD.unpack_from(self.data, offset)
+            yield offset, record[0], record
+            offset += JOURNAL_RECORD.size
+            if record[0] == REPLAY_KEYFRAME:
+                offset += record[5]
+
+    def _count_moves(self):
+        """Count moves after the last keyframe"""
+        amount_moves, offset = self.index[-1]
+        for _, kind, record in self._records(offset + JOURNAL_RECORD.size + self._keyframe_length(offset)):
+            if kind == JOURNAL_STEP or kind == REPLAY_KEYFRAME and record[1]:
+                amount_moves += 1
+        return amount_moves
+
+    def _keyframe_length(self, offset):
+        """Get the length of the packed field of the keyframe"""
+        return JOURNAL_RECORD.unpack_from(self.data, offset)[5]
+
+    def seek(self, move):
+        """Get the field after the move (0 is the start of the replay)
+
+        The field is unpacked from the nearest keyframe before the move and
+        less than keyframe_every moves are applied to it.
+        """
+        if move < 0 or move > self.amount_moves:
+            raise IndexError(f"There is no move {move} in the replay")
+        amount_moves, offset = self.index[bisect_right(self.index, (move, self.end)) - 1]
+        start = offset + JOURNAL_RECORD.size
+        field = unpack_field(self.data[start:start + self._keyframe_length(offset)])
+        for _, kind, record in self._records(start + self._keyframe_length(offset)):
+            if kind == JOURNAL_STEP or kind == REPLAY_KEYFRAME:
+                if amount_moves == move:
+                    break
+                amount_moves += 1
+            if kind != REPLAY_KEYFRAME:
+                apply_record(field, *record)
+        return field
+
+
+def format_field(field):
+    """Get the field as text"""
+    rows = []
+    for y in range(field.height):
+        rows.append(" ".join(str(field.get_color_of_ball(x, y) or ".") for x in range(field.width)))
+    return "\n".join(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Show the field of the replay of game \"Lines\" after a move")
+    parser.add_argument("filename", help="file of the replay")
+    parser.add_argument("--move", type=int, help="number of the move (the last one by default)")
+    arguments = parser.parse_args()
+    reader = ReplayReader(arguments.filename)
+    move = reader.amount_moves if arguments.move is None else arguments.move
+    replay_field = reader.seek(move)
+    print(f"Move {move} of {reader.amount_moves}. Score: {replay_field.score}")
+    print(format_field(replay_field))
@@ -1,6 +1,22 @@
-"""This file test the logic of program (file: core)"""
+"""This file test the logic of program (files: core, bitboard, driver, replay, timing, clines, environment,
+tournament, advisor)"""
+import contextlib
+import io
+import os
+import pickle
+import tempfile
 import unittest
+from array import array
+from random import Random
 from core import *
+from bitboard import BitboardField
+from driver import *
+from replay import ReplayReader, ReplayWriter
+from timing import PerformanceStats
+from clines import ConsoleMode, ConsoleRenderer, run_batch
+from time import perf_counter
+from tournament import *
+from advisor import Advisor
 
 
 class TestBall(unittest.TestCase):
@@ -10,10 +26,25 @@ class TestBall(unittest.TestCase):
         """Test '__init__' method"""
         test_ball = Ball()
         self.assertEqual(test_ball.color, 0)
-        self.assertEqual(test_ball.selected, False)
         test_ball_2 = Ball(4)
         self.assertEqual(test_ball_2.color, 4)
-        self.assertEqual(test_ball_2.selected, False)
+        self.assertEqual(hasattr(test_ball_2, "__dict__"), False)
+
+    def test_shared(self):
+        """Test 'shared' method"""
+        self.assertEqual(Ball.shared(3) is Ball.shared(3), True)
+        self.assertEqual(Ball.shared(3), Ball(3))
+        self.assertEqual(Ball.shared(4) == Ball.shared(3), False)
+        self.assertRaises(SharedBallError, Ball.shared(3).set_color, 4)
+        self.assertRaises(SharedBallError, Ball.shared(3).set_random_color, 5)
+        self.assertEqual(Ball.shared(3).color, 3)
+
+    def test_pickle(self):
+        """Test pickling of balls including the old format with the selection flag"""
+        self.assertEqual(pickle.loads(pickle.dumps(Ball(6))), Ball(6))
+        test_ball = Ball.__new__(Ball)
+        test_ball.__setstate__({"color": 2, "selected": True})
+        self.assertEqual(test_ball.color, 2)
 
     def test_eq_balls(self):
         """Test '__eq__' method"""
@@ -41,6 +72,45 @@ class TestBall(unittest.TestCase):
             self.assertEqual(test_ball.color in [1, 2, 3, 4, 5], True)
 
 
+class TestFreeCells(unittest.TestCase):
+    """Test the object FreeCells"""
+
+    def test_fill_and_clear(self):
+        """Test 'fill' and 'clear' methods"""
+        test_cells = FreeCells(3, 2)
+        self.assertEqual(len(test_cells), 0)
+        test_cells.fill()
+        self.assertEqual(sorted(test_cells), [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (2, 1)])
+        test_cells.clear()
+        self.assertEqual(len(test_cells), 0)
+        self.assertEqual((1, 1) in test_cells, False)
+
+    def test_add_and_remove(self):
+        """Test 'add' and 'remove' methods"""
+        test_cells = FreeCells(3, 3)
+        test_cells.fill()
+        test_cells.remove((0, 0))
+        test_cells.remove((2, 2))
+        test_cells.remove((1, 1))
+        self.assertEqual(len(test_cells), 6)
+        self.assertEqual((0, 0) in test_cells, False)
+        self.assertEqual((2, 1) in test_cells, True)
+        self.assertRaises(ValueError, test_cells.remove, (0, 0))
+        test_cells.add((0, 0))
+        test_cells.add((0, 0))
+        self.assertEqual(len(test_cells), 7)
+        for slot, coordinates in enumerate(test_cells):
+            self.assertEqual(test_cells.slots[coordinates[1] * 3 + coordinates[0]], slot)
+
+    def test_choice(self):
+        """Test 'choice' method"""
+        test_cells = FreeCells(2, 2)
+        test_cells.fill()
+        test_cells.remove((1, 0))
+        chosen = set(test_cells.choice() for _ in range(200))
+        self.assertEqual(chosen, {(0, 0), (0, 1), (1, 1)})
+
+
 class TestField(unittest.TestCase):
     """Test the object Field"""
 
@@ -205,6 +275,30 @@ class TestField(unittest.TestCase):
         test_field.scoring(5)
         self.assertEqual(test_field.score, 150)
 
+    def test_seed(self):
+        """Test that fields with equal seeds spawn equal balls"""
+        test_field = Field(9, seed=42)
+        test_field_2 = Field(9, seed=42)
+        for _ in range(20):
+            test_field.set_next_balls()
+            test_field_2.set_next_balls()
+            self.assertEqual(test_field.set_balls, test_field_2.set_balls)
+            self.assertEqual(test_field.next_balls, test_field_2.next_balls)
+        self.assertEqual(test_field.field, test_field_2.field)
+        for ball in test_field.next_balls:
+            self.assertEqual(1 <= ball.color <= test_field.number_of_color, True)
+
+    def test_random_state(self):
+        """Test 'get_random_state' and 'set_random_state' methods"""
+        test_field = Field(9, seed=3)
+        for _ in range(300):
+            test_field.draw_random(10)
+        state = test_field.get_random_state()
+        numbers = [test_field.draw_random(1000) for _ in range(300)]
+        test_field.set_random_state(state)
+        self.assertEqual([test_field.draw_random(1000) for _ in range(300)], numbers)
+        self.assertEqual(all(0 <= number < 1000 for number in numbers), True)
+
     def test_try_move(self):
         """Test 'try_move' method"""
         test_field = Field(5)
@@ -221,6 +315,1115 @@ class TestField(unittest.TestCase):
         test_field.delete_ball(0, 1)
         self.assertEqual(test_field.try_move(3, 4, 0, 0), True)
 
+    def test_find_path(self):
+        """Test 'find_path' method"""
+        test_field = Field(5)
+        self.assertEqual(test_field.find_path(0, 0, 1, 0), None)
+        test_field.set_ball(0, 0, Ball(1))
+        self.assertEqual(test_field.find_path(0, 0, 1, 0), [(0, 0), (1, 0)])
+        for y in range(4):
+            test_field.set_ball(2, y, Ball(2))
+        path = test_field.find_path(0, 0, 4, 0)
+        self.assertEqual(len(path), 13)
+        self.assertEqual(path[0], (0, 0))
+        self.assertEqual(path[-1], (4, 0))
+        for first, second in zip(path, path[1:]):
+            self.assertEqual(abs(first[0] - second[0]) + abs(first[1] - second[1]), 1)
+            self.assertEqual(test_field.get_ball(second[0], second[1]), None)
+        test_field.set_ball(2, 4, Ball(2))
+        self.assertEqual(test_field.find_path(0, 0, 4, 0), None)
+
+    def test_components(self):
+        """Test that components of free cells are kept up to date"""
+        random = Random(7)
+        test_field = Field(6)
+        for _ in range(500):
+            x, y = random.randint(0, 5), random.randint(0, 5)
+            if test_field.get_ball(x, y) is None:
+                test_field.set_ball(x, y, Ball(1))
+            else:
+                test_field.delete_ball(x, y)
+            components = test_field._component_cells()
+            rebuilt_field = test_field.copy()
+            rebuilt_field._build_components()
+            self.assertEqual(sorted(components.values()), sorted(rebuilt_field._component_cells().values()))
+            for label, cells in components.items():
+                self.assertEqual(test_field.sizes[label], len(cells))
+            self.assertEqual(sorted(set(test_field.spare_labels) | set(components)),
+                             list(range(len(test_field.sizes))))
+
+    def test_component_labels(self):
+        """Test that labels of components are not lost when a component splits"""
+        test_field = Field(5)
+        for x, y in ((0, 0), (0, 1), (3, 1), (0, 2), (2, 2), (0, 3)):
+            test_field.set_ball(x, y, Ball(1))
+        test_field.set_ball(1, 3, Ball(1))
+        self.assertEqual(sorted(set(test_field.spare_labels) | set(test_field._component_cells())),
+                         list(range(len(test_field.sizes))))
+        for game in range(100):
+            random = Random(game)
+            test_field = Field(5)
+            for _ in range(200):
+                x, y = random.randint(0, 4), random.randint(0, 4)
+                if test_field.get_ball(x, y) is None:
+                    test_field.set_ball(x, y, Ball(1))
+                else:
+                    test_field.delete_ball(x, y)
+                components = test_field._component_cells()
+                self.assertEqual(sorted(set(test_field.spare_labels) | set(components)),
+                                 list(range(len(test_field.sizes))))
+
+    def test_large_field(self):
+        """Test components of a field with more cells than a byte holds"""
+        test_field = Field(20)
+        self.assertEqual(test_field.sizes[test_field.labels[0]], 400)
+        for y in range(20):
+            test_field.set_ball(10, y, Ball(1))
+        self.assertEqual(test_field.can_reach(0, 0, 19, 19), False)
+        self.assertEqual(test_field.sizes[test_field.labels[0]], 200)
+        self.assertEqual(len(test_field.reachable_cells(10, 0)), 380)
+        test_field.delete_ball(10, 5)
+        self.assertEqual(test_field.sizes[test_field.labels[0]], 381)
+
+    def test_can_reach(self):
+        """Test 'can_reach' and 'reachable_cells' methods"""
+        test_field = Field(5)
+        for y in range(5):
+            test_field.set_ball(2, y, Ball(1))
+        self.assertEqual(test_field.can_reach(2, 0, 0, 4), True)
+        self.assertEqual(test_field.can_reach(2, 0, 2, 1), False)
+        test_field.set_ball(0, 0, Ball(3))
+        self.assertEqual(test_field.can_reach(0, 0, 1, 4), True)
+        self.assertEqual(test_field.can_reach(0, 0, 3, 0), False)
+        self.assertEqual(len(test_field.reachable_cells(0, 0)), 9)
+        self.assertEqual(len(test_field.reachable_cells(2, 2)), 19)
+        self.assertEqual(test_field.reachable_cells(4, 4), [])
+        test_field.delete_ball(2, 2)
+        self.assertEqual(test_field.can_reach(0, 0, 3, 0), True)
+
+    def test_legal_moves(self):
+        """Test 'legal_moves' and 'iter_legal_moves' methods"""
+        test_field = Field(5)
+        self.assertEqual(test_field.legal_moves(), [])
+        for y in range(5):
+            test_field.set_ball(2, y, Ball(1))
+        test_field.set_ball(0, 0, Ball(1))
+        moves = test_field.legal_moves()
+        self.assertEqual(len(moves), 5 * 19 + 9)
+        for start, end in moves:
+            self.assertEqual(test_field.try_move(start[0], start[1], end[0], end[1]), True)
+        self.assertEqual(((0, 0), (3, 0)) in moves, False)
+        self.assertEqual(set(test_field.iter_legal_moves()), set(moves))
+        test_field.clear_field()
+        test_field.set_ball(0, 0, Ball(2))
+        test_field.set_ball(1, 0, Ball(2))
+        test_field.set_ball(4, 4, Ball(2))
+        test_field.set_ball(0, 4, Ball(3))
+        self.assertEqual(test_field.legal_moves(True), [((4, 4), (2, 0))])
+
+    def test_makes_line(self):
+        """Test 'makes_line' method"""
+        test_field = Field(5)
+        test_field.set_ball(1, 1, Ball(4))
+        test_field.set_ball(2, 2, Ball(4))
+        test_field.set_ball(0, 4, Ball(4))
+        self.assertEqual(test_field.makes_line(0, 4, 3, 3), True)
+        self.assertEqual(test_field.makes_line(0, 4, 3, 2), False)
+        self.assertEqual(test_field.makes_line(2, 2, 0, 0), False)
+
+    def test_runs(self):
+        """Test that runs of balls are kept up to date"""
+        random = Random(11)
+        test_field = Field(7)
+        for _ in range(500):
+            x, y = random.randint(0, 6), random.randint(0, 6)
+            if test_field.get_ball(x, y) is None:
+                test_field.set_ball(x, y, Ball(random.randint(1, 2)))
+            else:
+                test_field.delete_ball(x, y)
+            runs = [list(direction) for direction in test_field.runs]
+            test_field._build_runs()
+            self.assertEqual(runs, [list(direction) for direction in test_field.runs])
+
+    def test_line_length(self):
+        """Test 'line_length' method"""
+        test_field = Field(7)
+        for x in (0, 1, 3):
+            test_field.set_ball(x, 3, Ball(2))
+        test_field.set_ball(2, 2, Ball(2))
+        test_field.set_ball(4, 0, Ball(2))
+        self.assertEqual(test_field.line_length(2, 3, 2), 4)
+        self.assertEqual(test_field.line_length(2, 3, 5), 1)
+        self.assertEqual(test_field.line_length(2, 3, 2, (1, 3)), 2)
+        self.assertEqual(test_field.line_length(2, 3, 2, (3, 3)), 3)
+        self.assertEqual(test_field.line_length(2, 3, 2, (0, 3)), 3)
+        self.assertEqual(test_field.line_length(3, 1, 2), 4)
+
+    def test_scan_all_lines(self):
+        """Test 'scan_all_lines' method"""
+        test_field = Field(5)
+        self.assertEqual(test_field.scan_all_lines(), None)
+        for x in range(4):
+            test_field.set_ball(x, 2, Ball(2))
+        for y in range(2):
+            test_field.set_ball(3, y, Ball(2))
+        test_field.set_ball(4, 4, Ball(2))
+        test_field.set_ball(2, 3, Ball(1))
+        test_field.set_ball(1, 4, Ball(1))
+        test_field.set_ball(4, 1, Ball(1))
+        expected = [(0, 2), (1, 2), (2, 2), (3, 2), (3, 0), (3, 1)]
+        self.assertEqual(sorted(test_field.scan_all_lines()), sorted(expected))
+        self.assertEqual(sorted(test_field._scan_runs()), sorted(expected))
+        test_field.delete_full_lines(test_field.scan_all_lines())
+        self.assertEqual(test_field.scan_all_lines(), None)
+        self.assertEqual(test_field.score, 60)
+
+    def test_dump_and_load_cells(self):
+        """Test 'dump_cells' and 'load_cells' methods"""
+        test_field = Field(5, seed=1)
+        test_field.set_ball(1, 2, Ball(3))
+        test_field.set_ball(4, 4, Ball(1))
+        test_field.delete_ball(0, 0)
+        cells = test_field.dump_cells()
+        self.assertEqual(cells[2 * 5 + 1], 3)
+        self.assertEqual(len(cells), 25)
+        test_field_2 = Field(5, seed=1)
+        test_field_2.load_cells(cells, test_field.dump_free_order())
+        self.assertEqual(test_field_2.dump_cells(), cells)
+        self.assertEqual(test_field_2.free_cells.cells, test_field.free_cells.cells)
+        self.assertEqual(test_field_2.can_reach(1, 2, 0, 0), True)
+        self.assertEqual(test_field_2.line_length(2, 2, 3), 2)
+        test_field_2.load_cells(bytes(25))
+        self.assertEqual(len(test_field_2.free_cells), 25)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_full_lines_mask(self):
+        """Test 'full_lines_mask' function on a batch of fields"""
+        colors = numpy.zeros((2, 5, 5), dtype=numpy.int8)
+        for step in range(3):
+            colors[0, step, 4 - step] = 3
+            colors[1, 4, step + 2] = 1
+        mask = full_lines_mask(colors, 3)
+        self.assertEqual(mask.sum(), 6)
+        self.assertEqual(bool(mask[0, 1, 3]), True)
+        self.assertEqual(bool(mask[1, 4, 4]), True)
+        self.assertEqual(bool(mask[1, 4, 1]), False)
+
+
+class TestPushMove(unittest.TestCase):
+    """Test making and taking back moves for search"""
+
+    def get_state(self, field):
+        """Get everything pop_move restores"""
+        return (field.dump_cells(), field.dump_free_order(), field.score, list(field.next_balls),
+                sorted(field.legal_moves()), [field.line_length(x, y, 1) for x, y in field.free_cells])
+
+    def test_push_pop(self):
+        """Test 'push_move', 'push_spawn' and 'pop_move' methods"""
+        for engine in ENGINES:
+            test_field = create_field(7, engine=engine, seed=3)
+            test_field.set_next_balls()
+            play_turns(test_field, 8)
+            random = Random(2)
+            states = []
+            for _ in range(30):
+                states.append(self.get_state(test_field))
+                moves = test_field.legal_moves()
+                start, end = moves[random.randint(0, len(moves) - 1)]
+                test_field.push_move(start[0], start[1], end[0], end[1])
+                free_cells = sorted(test_field.free_cells)
+                if len(free_cells) > test_field.number_of_next_ball:
+                    states.append(self.get_state(test_field))
+                    cells = [free_cells[random.randint(0, len(free_cells) - 1)]]
+                    test_field.push_spawn(cells, [Ball(random.randint(1, 5))] * test_field.number_of_next_ball)
+            while states:
+                test_field.pop_move()
+                self.assertEqual(self.get_state(test_field), states.pop())
+            self.assertEqual(test_field.undo_stack, [])
+
+    def test_push_move_lines(self):
+        """Test that 'push_move' deletes and scores lines as the game does"""
+        for engine in ENGINES:
+            test_field = create_field(9, engine=engine)
+            for x in range(4):
+                test_field.set_ball(x, 0, Ball(2))
+                test_field.set_ball(4, x + 1, Ball(2))
+            test_field.set_ball(5, 0, Ball(3))
+            lines = test_field.push_move(5, 0, 4, 0)
+            self.assertEqual(lines, None)
+            test_field.pop_move()
+            test_field.set_ball(8, 8, Ball(2))
+            game_field = test_field.copy()
+            game_field.make_step(8, 8, 4, 0)
+            game_field.delete_full_lines(game_field.scan_all_lines())
+            lines = test_field.push_move(8, 8, 4, 0)
+            self.assertEqual(lines, [(0, 0), (1, 0), (2, 0), (3, 0), (4, 0), (4, 1), (4, 2), (4, 3), (4, 4)])
+            self.assertEqual(test_field.score, game_field.score)
+            self.assertEqual(test_field.dump_cells(), game_field.dump_cells())
+            test_field.pop_move()
+            self.assertEqual(test_field.score, 0)
+            self.assertEqual(test_field.get_color_of_ball(8, 8), 2)
+            self.assertEqual(test_field.get_ball(4, 0), None)
+            self.assertEqual(test_field.find_lines_through([(4, 1)]), None)
+
+
+class TestBitboardField(unittest.TestCase):
+    """Test the object BitboardField"""
+
+    def test_init_field(self):
+        """Test '__init__' method"""
+        test_field = BitboardField(9)
+        self.assertEqual(test_field.balls_in_line, 5)
+        self.assertEqual(test_field.number_of_next_ball, 3)
+        self.assertEqual(test_field.number_of_color, 7)
+        self.assertEqual(len(test_field.free_cells), 81)
+        self.assertEqual(test_field.field, [[None] * 9 for _ in range(9)])
+
+    def test_set_and_delete_ball(self):
+        """Test 'set_ball' and 'delete_ball' methods"""
+        test_field = BitboardField(5)
+        test_field.set_ball(4, 1, Ball(3))
+        self.assertEqual(test_field.get_ball(4, 1), Ball(3))
+        self.assertEqual(test_field.get_color_of_ball(4, 1), 3)
+        self.assertEqual((4, 1) in test_field.free_cells, False)
+        self.assertRaises(ValueError, test_field.set_ball, 4, 1, Ball(2))
+        self.assertEqual(test_field.get_color_of_ball(4, 1), 3)
+        test_field.delete_ball(4, 1)
+        self.assertEqual(test_field.get_ball(4, 1), None)
+        self.assertEqual((4, 1) in test_field.free_cells, True)
+
+    def test_try_move(self):
+        """Test 'try_move' method"""
+        test_field = BitboardField(5)
+        self.assertEqual(test_field.try_move(3, 4, 2, 1), False)
+        test_field.set_ball(1, 0, Ball(3))
+        test_field.set_ball(1, 1, Ball(3))
+        test_field.set_ball(0, 1, Ball(3))
+        test_field.set_ball(3, 4, Ball(3))
+        self.assertEqual(test_field.try_move(3, 4, 0, 0), False)
+        test_field.delete_ball(0, 1)
+        self.assertEqual(test_field.try_move(3, 4, 0, 0), True)
+        test_field.clear_field()
+        for y in range(5):
+            test_field.set_ball(4, y, Ball(1))
+        test_field.set_ball(0, 2, Ball(2))
+        self.assertEqual(test_field.try_move(4, 2, 0, 3), True)
+
+    def test_find_path(self):
+        """Test 'find_path' method"""
+        test_field = BitboardField(5)
+        test_field.set_ball(0, 0, Ball(1))
+        for y in range(4):
+            test_field.set_ball(2, y, Ball(2))
+        path = test_field.find_path(0, 0, 4, 0)
+        self.assertEqual(len(path), 13)
+        self.assertEqual(path[0], (0, 0))
+        self.assertEqual(path[-1], (4, 0))
+        for first, second in zip(path, path[1:]):
+            self.assertEqual(abs(first[0] - second[0]) + abs(first[1] - second[1]), 1)
+            self.assertEqual(test_field.get_ball(second[0], second[1]), None)
+        test_field.set_ball(2, 4, Ball(2))
+        self.assertEqual(test_field.find_path(0, 0, 4, 0), None)
+
+    def test_find_full_lines(self):
+        """Test 'find_full_lines' method"""
+        test_field = BitboardField(5)
+        for x in range(1, 4):
+            test_field.set_ball(x, 2, Ball(2))
+        self.assertEqual(sorted(test_field.find_full_lines(2, 2)), [(1, 2), (2, 2), (3, 2)])
+        test_field.delete_ball(3, 2)
+        test_field.set_ball(3, 2, Ball(4))
+        self.assertEqual(test_field.find_full_lines(1, 2), None)
+        test_field.clear_field()
+        test_field.set_ball(4, 0, Ball(5))
+        test_field.set_ball(3, 1, Ball(5))
+        test_field.set_ball(2, 2, Ball(5))
+        self.assertEqual(sorted(test_field.find_full_lines(3, 1)), [(2, 2), (3, 1), (4, 0)])
+        test_field.clear_field()
+        test_field.set_ball(4, 0, Ball(5))
+        test_field.set_ball(0, 1, Ball(5))
+        test_field.set_ball(1, 1, Ball(5))
+        self.assertEqual(test_field.find_full_lines(0, 1), None)
+
+    def test_set_next_balls(self):
+        """Test 'set_next_balls' method"""
+        test_field = BitboardField(5)
+        test_field.set_next_balls()
+        self.assertEqual(len(test_field.set_balls), 2)
+        self.assertEqual(len(test_field.free_cells), 23)
+        for coordinates in test_field.set_balls:
+            self.assertEqual(test_field.get_ball(coordinates[0], coordinates[1]) is not None, True)
+        for x in range(5):
+            for y in range(5):
+                if test_field.get_ball(x, y) is None and len(test_field.free_cells) > 2:
+                    test_field.set_ball(x, y, Ball(1))
+        self.assertRaises(FieldFullException, test_field.set_next_balls)
+
+    def test_seed(self):
+        """Test that the engines spawn equal balls with equal seeds"""
+        list_field = Field(9, seed=8)
+        bit_field = BitboardField(9, seed=8)
+        for _ in range(10):
+            list_field.set_next_balls()
+            bit_field.set_next_balls()
+            self.assertEqual(list_field.next_balls, bit_field.next_balls)
+            self.assertEqual(len(list_field.free_cells), len(bit_field.free_cells))
+
+    def test_same_as_field(self):
+        """Test that both engines play the same game"""
+        random = Random(5)
+        list_field = Field(7)
+        bit_field = BitboardField(7)
+        for _ in range(300):
+            x, y, color = random.randint(0, 6), random.randint(0, 6), random.randint(1, 3)
+            if list_field.get_ball(x, y) is None:
+                list_field.set_ball(x, y, Ball(color))
+                bit_field.set_ball(x, y, Ball(color))
+            else:
+                list_field.delete_ball(x, y)
+                bit_field.delete_ball(x, y)
+            end_x, end_y = random.randint(0, 6), random.randint(0, 6)
+            self.assertEqual(list_field.try_move(x, y, end_x, end_y), bit_field.try_move(x, y, end_x, end_y))
+            self.assertEqual(sorted(list_field.reachable_cells(x, y)), sorted(bit_field.reachable_cells(x, y)))
+            self.assertEqual(sorted(list_field.iter_legal_moves(True)), sorted(bit_field.iter_legal_moves(True)))
+            self.assertEqual(list_field.line_length(end_x, end_y, color), bit_field.line_length(end_x, end_y, color))
+            list_path = list_field.find_path(x, y, end_x, end_y)
+            bit_path = bit_field.find_path(x, y, end_x, end_y)
+            self.assertEqual(list_path is None, bit_path is None)
+            if list_path is not None:
+                self.assertEqual(len(list_path), len(bit_path))
+            list_lines = list_field.find_full_lines(x, y)
+            bit_lines = bit_field.find_full_lines(x, y)
+            self.assertEqual(list_lines is None, bit_lines is None)
+            if list_lines is not None:
+                self.assertEqual(sorted(list_lines), sorted(bit_lines))
+        self.assertEqual(list_field.field, bit_field.field)
+        self.assertEqual(sorted(list_field.legal_moves()), sorted(bit_field.legal_moves()))
+        if numpy is not None:
+            self.assertEqual(list_field.colors_array().tolist(), bit_field.colors_array().tolist())
+        self.assertEqual(sorted(list_field.scan_all_lines() or []), sorted(bit_field.scan_all_lines() or []))
+
+
+class TestSave(unittest.TestCase):
+    """Test saving and loading of games"""
+
+    def setUp(self):
+        """Make a directory for saves"""
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "game.lines")
+
+    def tearDown(self):
+        """Remove the directory for saves"""
+        self.directory.cleanup()
+
+    def test_save_and_load(self):
+        """Test 'save_in_file' and 'load_from_file' functions"""
+        for engine in ENGINES:
+            test_field = create_field(7, "Игрок", engine, seed=2)
+            test_field.refresh_field()
+            test_field.score = 70000
+            save_in_file(test_field, self.filename)
+            loaded_field = load_from_file(self.filename)
+            self.assertEqual(type(loaded_field), type(test_field))
+            self.assertEqual(loaded_field.player, "Игрок")
+            self.assertEqual(loaded_field.score, 70000)
+            self.assertEqual(loaded_field.dump_cells(), test_field.dump_cells())
+            self.assertEqual(loaded_field.next_balls, test_field.next_balls)
+            for _ in range(5):
+                test_field.set_next_balls()
+                loaded_field.set_next_balls()
+            self.assertEqual(loaded_field.dump_cells(), test_field.dump_cells())
+
+    def test_free_order(self):
+        """Test that the order of free cells is kept by the save when cell (0, 0) is not first"""
+        for engine in ENGINES:
+            test_field = create_field(7, engine=engine, seed=5)
+            test_field.set_ball(0, 0, Ball(1))
+            test_field.set_ball(1, 0, Ball(2))
+            test_field.delete_ball(0, 0)
+            order = test_field.dump_free_order()
+            loaded_field = unpack_field(pack_field(test_field))
+            self.assertEqual(loaded_field.dump_free_order(), order)
+            for _ in range(5):
+                test_field.set_next_balls()
+                loaded_field.set_next_balls()
+            self.assertEqual(loaded_field.dump_cells(), test_field.dump_cells())
+
+    def test_write_save(self):
+        """Test 'write_save' function"""
+        test_field = create_field(7, seed=2)
+        data = pack_field(test_field)
+        test_field.set_next_balls()
+        write_save(data, self.filename)
+        loaded_field = load_from_file(self.filename)
+        self.assertEqual(pack_field(loaded_field), data)
+        self.assertNotEqual(loaded_field.dump_cells(), test_field.dump_cells())
+
+    def test_broken_save(self):
+        """Test loading of broken saves"""
+        test_field = create_field(7, seed=2)
+        data = pack_field(test_field)
+        self.assertRaises(LoadError, unpack_field, data[:40])
+        self.assertRaises(LoadError, unpack_field, data[:4] + bytes([9]) + data[5:])
+        self.assertRaises(LoadError, unpack_field, data + b"\x00")
+        self.assertRaises(LoadError, unpack_field, data[:-1] + bytes([200]))
+        self.assertRaises(LoadError, unpack_field, data[:-1] + bytes([test_field.number_of_color + 1]))
+        next_colors = SAVE_HEADER.size + len(test_field.player) + 1
+        self.assertRaises(LoadError, unpack_field, data[:next_colors] + b"\x00" + data[next_colors + 1:])
+        self.assertRaises(LoadError, unpack_field, pack_field(create_field(4)))
+        self.assertRaises(LoadError, unpack_field, data[:6] + b"\x00\x00" + data[8:])
+        test_field.set_next_balls()
+        order = test_field.dump_free_order()
+        occupied = next(index for index, color in enumerate(test_field.dump_cells()) if color)
+        for broken_order in (order[:2], order[:2] + order[:-2], order[:-2] + array("H", [occupied]).tobytes()):
+            test_field.dump_free_order = lambda: broken_order
+            self.assertRaises(LoadError, unpack_field, pack_field(test_field))
+
+    def test_legacy_save(self):
+        """Test import of old pickle saves"""
+        test_field = Field(7, "Old")
+        test_field.refresh_field()
+        test_field.score = 30
+        with open(self.filename, "wb") as file:
+            pickle.dump(test_field, file)
+        loaded_field = load_from_file(self.filename)
+        self.assertEqual(loaded_field.dump_cells(), test_field.dump_cells())
+        self.assertEqual(loaded_field.score, 30)
+        with open(self.filename, "wb") as file:
+            pickle.dump(os.system, file)
+        self.assertRaises(LoadError, load_from_file, self.filename)
+
+
+def make_turn(field, start, end):
+    """Make the turn of the game with the move"""
+    field.make_step(start[0], start[1], end[0], end[1])
+    lines = field.scan_all_lines()
+    if lines is None:
+        field.set_next_balls()
+        lines = field.scan_all_lines()
+    field.delete_full_lines(lines)
+
+
+def play_turns(field, amount, seed_number=1):
+    """Play random turns on the field (new game when the field is full)"""
+    random = Random(seed_number)
+    for _ in range(amount):
+        moves = field.legal_moves()
+        start, end = moves[random.randint(0, len(moves) - 1)]
+        field.make_step(start[0], start[1], end[0], end[1])
+        lines = field.scan_all_lines()
+        if lines is None:
+            try:
+                field.set_next_balls()
+            except FieldFullException:
+                field.refresh_field()
+            lines = field.scan_all_lines()
+        field.delete_full_lines(lines)
+
+
+class TestRecords(unittest.TestCase):
+    """Test the table of records"""
+
+    def setUp(self):
+        """Make a directory for the database"""
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.directory.name, "records.db")
+
+    def tearDown(self):
+        """Remove the directory for the database"""
+        self.directory.cleanup()
+
+    def test_add_and_get_records(self):
+        """Test 'add_record', 'get_records' and 'get_player_best' functions"""
+        self.assertEqual(get_records(database=self.database), {})
+        for number in range(12):
+            add_record(f"Player {number}", number * 10, 9, self.database)
+        add_record("Player 3", 5, 9, self.database)
+        add_record("Player 3", 500, 5, self.database)
+        records = get_records(3, 9, self.database)
+        self.assertEqual(list(records.items()), [("Player 11", 110), ("Player 10", 100), ("Player 9", 90)])
+        self.assertEqual(len(get_records(size=9, database=self.database)), RECORDS_IN_TABLE)
+        self.assertEqual(list(get_records(1, database=self.database).items()), [("Player 3", 500)])
+        self.assertEqual(get_player_best("Player 3", 9, self.database), 30)
+        self.assertEqual(get_player_best("Player 3", database=self.database), 500)
+        self.assertEqual(get_player_best("Nobody", database=self.database), None)
+
+    def test_import_old_records(self):
+        """Test import of records.json"""
+        with open(os.path.join(self.directory.name, "records.json"), "w", encoding="utf-8") as file:
+            json.dump({"John": 210, "Andrey": 60}, file)
+        self.assertEqual(list(get_records(database=self.database).items()), [("John", 210), ("Andrey", 60)])
+        add_record("Andrey", 300, database=self.database)
+        self.assertEqual(list(get_records(size=9, database=self.database)), ["Andrey", "John"])
+
+
+class TestJournal(unittest.TestCase):
+    """Test autosave with the journal"""
+
+    def setUp(self):
+        """Make a directory for autosave"""
+        self.directory = tempfile.TemporaryDirectory()
+        self.snapshot = os.path.join(self.directory.name, "autosave.lines")
+        self.journal = os.path.join(self.directory.name, "autosave.journal")
+
+    def tearDown(self):
+        """Remove the directory for autosave"""
+        self.directory.cleanup()
+
+    def test_recover_game(self):
+        """Test 'recover_game' function"""
+        for engine in ENGINES:
+            test_field = create_field(7, engine=engine, seed=4)
+            test_field.refresh_field()
+            journal = Journal(self.snapshot, self.journal, compact_every=40)
+            journal.attach(test_field)
+            play_turns(test_field, 50)
+            recovered_field = recover_game(self.snapshot, self.journal)
+            journal.detach()
+            self.assertEqual(recovered_field.dump_cells(), test_field.dump_cells())
+            self.assertEqual(recovered_field.score, test_field.score)
+            self.assertEqual(recovered_field.next_balls, test_field.next_balls)
+            self.assertEqual(recovered_field.dump_free_order(), test_field.dump_free_order())
+            self.assertEqual([recovered_field.draw_random(50) for _ in range(300)],
+                             [test_field.draw_random(50) for _ in range(300)])
+
+    def test_recover_free_order(self):
+        """Test that the recovered game spawns the same balls when cell (0, 0) is free and not first"""
+        for engine in ENGINES:
+            test_field = create_field(7, engine=engine, seed=4)
+            test_field.set_ball(0, 0, Ball(1))
+            test_field.delete_ball(0, 0)
+            journal = Journal(self.snapshot, self.journal)
+            journal.attach(test_field)
+            test_field.set_next_balls()
+            recovered_field = recover_game(self.snapshot, self.journal)
+            journal.detach()
+            self.assertEqual(recovered_field.dump_free_order(), test_field.dump_free_order())
+            for _ in range(5):
+                test_field.set_next_balls()
+                recovered_field.set_next_balls()
+            self.assertEqual(recovered_field.dump_cells(), test_field.dump_cells())
+
+    def test_crash_after_snapshot(self):
+        """Test that a journal of the last run is not applied to the snapshot of a new run"""
+        test_field = create_field(7, seed=4)
+        test_field.refresh_field()
+        journal = Journal(self.snapshot, self.journal)
+        journal.attach(test_field)
+        play_turns(test_field, 5)
+        journal.detach()
+        test_field = create_field(7, seed=5)
+        test_field.refresh_field()
+        journal = Journal(self.snapshot, self.journal)
+        journal.generation += 1
+        with open(self.snapshot, "wb") as file:
+            file.write(SNAPSHOT_HEADER.pack(journal.generation))
+            file.write(pack_field(test_field))
+        recovered_field = recover_game(self.snapshot, self.journal)
+        self.assertEqual(recovered_field.dump_cells(), test_field.dump_cells())
+
+    def test_torn_and_old_journal(self):
+        """Test recovery with a torn last record and with a journal of an old snapshot"""
+        test_field = create_field(7, seed=5)
+        test_field.refresh_field()
+        journal = Journal(self.snapshot, self.journal)
+        journal.attach(test_field)
+        cells = test_field.dump_cells()
+        test_field.make_step(*test_field.legal_moves()[0][0], *test_field.legal_moves()[0][1])
+        journal.detach()
+        with open(self.journal, "ab") as file:
+            file.write(b"\x01\x02")
+        self.assertEqual(recover_game(self.snapshot, self.journal).dump_cells(), test_field.dump_cells())
+        with open(self.snapshot, "r+b") as file:
+            file.write(SNAPSHOT_HEADER.pack(100))
+        self.assertEqual(recover_game(self.snapshot, self.journal).dump_cells(), cells)
+        remove_autosave(self.snapshot, self.journal)
+        self.assertEqual(has_autosave(self.snapshot), False)
+        self.assertRaises(LoadError, recover_game, self.snapshot, self.journal)
+
+
+class TestHistory(unittest.TestCase):
+    """Test undo and redo of turns"""
+
+    def test_undo_redo(self):
+        """Test 'undo' and 'redo' methods"""
+        for engine in ENGINES:
+            test_field = create_field(7, engine=engine, seed=6)
+            test_field.set_next_balls()
+            history = History(keyframe_every=4)
+            history.attach(test_field)
+            states = [pack_field(test_field)]
+            for turn in range(10):
+                play_turns(test_field, 1, turn)
+                states.append(pack_field(test_field))
+            self.assertEqual(sorted(history.keyframes), [0, 4, 8])
+            for turn in range(9, -1, -1):
+                test_field = history.undo()
+                self.assertEqual(pack_field(test_field), states[turn])
+            self.assertEqual(history.undo(), None)
+            for turn in range(1, 11):
+                test_field = history.redo()
+                self.assertEqual(pack_field(test_field), states[turn])
+            self.assertEqual(history.redo(), None)
+            self.assertEqual(history.field, test_field)
+
+    def test_long_game(self):
+        """Test that turns made again after undo over many keyframes spawn the same balls"""
+        for engine in ENGINES:
+            for game in range(5):
+                test_field = create_field(9, engine=engine, seed=game)
+                test_field.set_ball(0, 0, Ball(1))
+                test_field.delete_ball(0, 0)
+                test_field.set_next_balls()
+                history = History(keyframe_every=3)
+                history.attach(test_field)
+                random = Random(game)
+                states = [pack_field(test_field)]
+                moves = []
+                for turn in range(20):
+                    moves.append(random.choice(sorted(test_field.legal_moves())))
+                    make_turn(test_field, *moves[-1])
+                    states.append(pack_field(test_field))
+                self.assertEqual(len(history.keyframes), 7)
+                for _ in range(16):
+                    test_field = history.undo()
+                self.assertEqual(pack_field(test_field), states[4])
+                for turn in range(4, 20):
+                    make_turn(test_field, *moves[turn])
+                    self.assertEqual(pack_field(test_field), states[turn + 1])
+
+    def test_new_turn_after_undo(self):
+        """Test that a turn after undo drops taken back turns and spawns the same balls"""
+        test_field = create_field(7, seed=7)
+        test_field.set_next_balls()
+        history = History()
+        history.attach(test_field)
+        for turn in range(3):
+            play_turns(test_field, 1, turn)
+        cells = test_field.dump_cells()
+        history.undo()
+        test_field = history.undo()
+        for turn in range(1, 3):
+            play_turns(test_field, 1, turn)
+        self.assertEqual(test_field.dump_cells(), cells)
+        self.assertEqual(history.position, 3)
+        play_turns(test_field, 1, 5)
+        self.assertEqual(history.can_redo(), False)
+        test_field = history.undo()
+        self.assertEqual(test_field.dump_cells(), cells)
+
+    def test_new_game(self):
+        """Test that undo does not go back over the new game"""
+        test_field = create_field(7, seed=8)
+        test_field.set_next_balls()
+        history = History()
+        history.attach(test_field)
+        play_turns(test_field, 2)
+        test_field.refresh_field()
+        cells = test_field.dump_cells()
+        self.assertEqual(history.can_undo(), False)
+        play_turns(test_field, 1)
+        self.assertEqual((history.position, len(history.turns)), (1, 1))
+        self.assertEqual(history.undo().dump_cells(), cells)
+
+
+class TestReplay(unittest.TestCase):
+    """Test replays of games"""
+
+    def setUp(self):
+        """Make a directory for replays"""
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "game.replay")
+
+    def tearDown(self):
+        """Remove the directory for replays"""
+        self.directory.cleanup()
+
+    def test_seek(self):
+        """Test 'seek' method with the index of keyframes and without it"""
+        test_field = create_field(7, seed=3)
+        test_field.refresh_field()
+        writer = ReplayWriter(self.filename, keyframe_every=10)
+        writer.attach(test_field)
+        states = [(test_field.dump_cells(), test_field.score)]
+        for turn in range(45):
+            play_turns(test_field, 1, turn)
+            states.append((test_field.dump_cells(), test_field.score))
+        writer.close()
+        reader = ReplayReader(self.filename)
+        self.assertEqual(reader.amount_moves, 45)
+        self.assertEqual([entry[0] for entry in reader.index], [0, 10, 20, 30, 40])
+        for move in (0, 9, 10, 11, 33, 45):
+            field = reader.seek(move)
+            self.assertEqual((field.dump_cells(), field.score), states[move])
+        self.assertRaises(IndexError, reader.seek, 46)
+        with open(self.filename, "r+b") as file:
+            file.truncate(reader.end)
+        reader = ReplayReader(self.filename)
+        self.assertEqual(reader.amount_moves, 45)
+        self.assertEqual(reader.seek(27).dump_cells(), states[27][0])
+
+    def test_follow(self):
+        """Test 'follow' method which keeps the replay written before"""
+        test_field = create_field(7, seed=3)
+        test_field.refresh_field()
+        writer = ReplayWriter(self.filename, keyframe_every=10)
+        writer.follow(test_field)
+        states = []
+        for turn in range(5):
+            states.append(test_field.dump_cells())
+            play_turns(test_field, 1, turn)
+        restored_field = unpack_field(pack_field(test_field))
+        restored_field.set_ball(*restored_field.free_cells[0], Ball(1))
+        writer.follow(restored_field)
+        self.assertEqual(test_field.observers, [])
+        states.append(restored_field.dump_cells())
+        for turn in range(3):
+            play_turns(restored_field, 1, turn)
+            states.append(restored_field.dump_cells())
+        writer.close()
+        reader = ReplayReader(self.filename)
+        self.assertEqual(reader.amount_moves, 8)
+        self.assertEqual([reader.seek(move).dump_cells() for move in range(9)], states)
+
+
+class TestPerformanceStats(unittest.TestCase):
+    """Test the object PerformanceStats"""
+
+    def test_add(self):
+        """Test 'add' method"""
+        stats = PerformanceStats()
+        for milliseconds in (0.5, 3, 3, 200):
+            stats.add("paint", milliseconds)
+        timing = stats.timings["paint"]
+        self.assertEqual(timing.count, 4)
+        self.assertEqual(timing.last, 200)
+        self.assertEqual(timing.longest, 200)
+        self.assertEqual(timing.mean, 51.625)
+        self.assertEqual(timing.buckets, [1, 0, 2, 0, 0, 0, 0, 0, 1])
+
+    def test_measure(self):
+        """Test 'measure' method"""
+        stats = PerformanceStats()
+        self.assertEqual(stats.measure("sum", sum, [1, 2, 3]), 6)
+        self.assertRaises(TypeError, stats.measure, "sum", sum, None)
+        self.assertEqual(stats.timings["sum"].count, 2)
+
+    def test_histogram(self):
+        """Test 'summary' and 'histogram' methods"""
+        stats = PerformanceStats()
+        self.assertEqual(stats.histogram(), [])
+        stats.add("paint", 3)
+        stats.add("paint", 500)
+        self.assertEqual(stats.summary(), ["paint: 500.00 ms (mean 251.50, max 500.00)"])
+        self.assertEqual(stats.histogram(), ["paint: 2 times, mean 251.50 ms, max 500.00 ms",
+                                             "     <= 4 ms: 1", "    > 133 ms: 1"])
+
+
+class TestConsoleRenderer(unittest.TestCase):
+    """Test the object ConsoleRenderer"""
+
+    def test_render(self):
+        """Test 'render' method"""
+        stream = io.StringIO()
+        renderer = ConsoleRenderer(stream)
+        test_field = Field(12, seed=3)
+        test_field.set_ball(0, 0, Ball(1))
+        renderer.render(test_field)
+        frame = stream.getvalue()
+        self.assertTrue(frame.startswith("\x1b[2J\x1b[H"))
+        self.assertIn("10 11", frame)
+        self.assertIn(" 11 | ", frame)
+        self.assertIn("Scores: 0", frame)
+        stream.seek(0)
+        stream.truncate()
+        test_field.make_step(0, 0, 11, 11)
+        renderer.render(test_field)
+        frame = stream.getvalue()
+        self.assertNotIn("\x1b[2J", frame)
+        self.assertNotIn("Scores", frame)
+        self.assertEqual(frame.count("H"), 3)
+        self.assertIn("\x1b[3;7H", frame)
+        self.assertIn("\x1b[14;40H", frame)
+
+    def test_invalidate(self):
+        """Test 'invalidate' method"""
+        stream = io.StringIO()
+        renderer = ConsoleRenderer(stream)
+        test_field = Field(5, seed=3)
+        renderer.render(test_field)
+        renderer.invalidate()
+        renderer.render(test_field)
+        self.assertEqual(stream.getvalue().count("\x1b[2J"), 2)
+
+    def test_print_message(self):
+        """Test that the board is drawn again after the text printed below it"""
+        stream = io.StringIO()
+        game = ConsoleMode(size=5, seed=1, batch=True)
+        game.batch = False
+        game.renderer = ConsoleRenderer(stream)
+        game.renderer.render(game.game)
+        with contextlib.redirect_stdout(stream):
+            game.print_message("Incorrect step")
+        game.renderer.render(game.game)
+        self.assertEqual(stream.getvalue().count("\x1b[2J"), 2)
+        self.assertIn("Incorrect step", stream.getvalue())
+
+
+class TestBatch(unittest.TestCase):
+    """Test the batch mode of the console version"""
+
+    def test_run_batch(self):
+        """Test 'run_batch' function"""
+        random = Random(4)
+        commands = ["# random steps", ""]
+        commands += ["make_step " + " ".join(str(random.randint(0, 8)) for _ in range(4)) for _ in range(3000)]
+        summaries = []
+        for engine in ENGINES:
+            game = ConsoleMode(engine, player="Bot", seed=7, batch=True)
+            summary = run_batch(game, commands)
+            self.assertEqual(summary["result"], "game over")
+            self.assertEqual(summary["score"], game.game.score)
+            self.assertGreater(summary["steps"], 0)
+            self.assertEqual(summary["steps"] + summary["incorrect_steps"], summary["commands"])
+            del summary["engine"], summary["seconds"], summary["commands_per_second"]
+            summaries.append(summary)
+        self.assertEqual(summaries[0], summaries[1])
+
+    def test_end(self):
+        """Test commands 'end' and incorrect commands in the batch mode"""
+        game = ConsoleMode(size=7, seed=1, batch=True)
+        summary = run_batch(game, ["help", "jump", "make_step 7 0 0 0", "make_step a b c d", "reset", "end", "help"])
+        self.assertEqual(summary["commands"], 6)
+        self.assertEqual(summary["incorrect_commands"], 1)
+        self.assertEqual(summary["incorrect_steps"], 2)
+        self.assertEqual(summary["result"], "ended")
+        self.assertEqual(summary["size"], 7)
+
+    def test_undo(self):
+        """Test commands 'undo' and 'redo' of the console version"""
+        game = ConsoleMode(size=7, seed=1, batch=True)
+        self.assertEqual(run_batch(game, ["undo", "redo"])["incorrect_commands"], 2)
+        game.history = History()
+        game.history.attach(game.game)
+        cells = game.game.dump_cells()
+        (start_x, start_y), (end_x, end_y) = game.game.legal_moves()[0]
+        run_batch(game, [f"make_step {start_x} {start_y} {end_x} {end_y}"])
+        moved_cells = game.game.dump_cells()
+        run_batch(game, ["undo", "undo"])
+        self.assertEqual(game.game.dump_cells(), cells)
+        run_batch(game, ["redo", "redo"])
+        self.assertEqual(game.game.dump_cells(), moved_cells)
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestBatchEnvironment(unittest.TestCase):
+    """Test the object BatchEnvironment"""
+
+    def setUp(self):
+        """Import the environment (numpy is required)"""
+        from environment import BatchEnvironment
+        self.environment_class = BatchEnvironment
+
+    def test_init(self):
+        """Test '__init__' method"""
+        for size in range(5, 16):
+            environment = self.environment_class(3, size, seed=1)
+            test_field = Field(size)
+            self.assertEqual(environment.boards.shape, (3, size, size))
+            self.assertEqual(environment.number_of_color, test_field.number_of_color)
+            self.assertEqual(environment.balls_in_line, test_field.balls_in_line)
+            self.assertEqual(environment.number_of_next_ball, test_field.number_of_next_ball)
+            self.assertEqual(list((environment.boards != 0).sum(axis=(1, 2))), [test_field.number_of_next_ball] * 3)
+            self.assertTrue(((environment.next_balls >= 1) & (environment.next_balls <= size // 2 + 3)).all())
+
+    def test_games_do_not_depend_on_batch(self):
+        """Test that a game depends only on the seed and its number"""
+        small = self.environment_class(2, 9, seed=5)
+        big = self.environment_class(6, 9, seed=5)
+        self.assertTrue((small.boards == big.boards[:2]).all())
+        self.assertFalse((big.boards[0] == big.boards[1]).all())
+        for _ in range(30):
+            starts = (small.cells != 0).argmax(axis=1)
+            ends = small.reachable_mask(starts).reshape(2, -1).argmax(axis=1)
+            small.step(starts, ends)
+            big.step(list(starts) + [0] * 4, list(ends) + [0] * 4)
+        self.assertTrue((small.boards == big.boards[:2]).all())
+        self.assertEqual(list(small.scores), list(big.scores[:2]))
+
+    def test_reachable_mask(self):
+        """Test 'reachable_mask' method"""
+        environment = self.environment_class(20, 9, seed=2)
+        random = Random(2)
+        for game in range(20):
+            environment.cells[game] = 0
+            for _ in range(35 + game):
+                environment.cells[game, random.randint(0, 80)] = random.randint(1, 7)
+        starts = (environment.cells != 0).argmax(axis=1)
+        reached = environment.reachable_mask(starts)
+        for game in range(20):
+            test_field = Field(9)
+            test_field.load_cells(environment.cells[game].tobytes())
+            rows, columns = reached[game].nonzero()
+            start_y, start_x = divmod(int(starts[game]), 9)
+            self.assertEqual(sorted(zip(columns.tolist(), rows.tolist())),
+                             sorted(test_field.reachable_cells(start_x, start_y)))
+
+    def test_step(self):
+        """Test 'step' method"""
+        environment = self.environment_class(2, 9, seed=1)
+        environment.boards[:] = 0
+        environment.boards[0, 0, 0:4] = 1
+        environment.boards[0, 2, 4] = 1
+        environment.boards[1, 5, 5] = 2
+        scores, moved = environment.step([2 * 9 + 4, 0], [4, 1])
+        self.assertEqual(list(moved), [True, False])
+        test_field = Field(9)
+        test_field.scoring(5)
+        self.assertEqual(list(scores), [test_field.score, 0])
+        self.assertEqual((environment.boards[0] != 0).sum(), 0)
+        self.assertEqual((environment.boards[1] != 0).sum(), 1)
+        scores, moved = environment.step([0, 5 * 9 + 5], [1, 0])
+        self.assertEqual(list(moved), [False, True])
+        self.assertEqual((environment.boards[1] != 0).sum(), 1 + environment.number_of_next_ball)
+
+    def test_finish_and_reset(self):
+        """Test the end of games and 'reset' method"""
+        environment = self.environment_class(2, 5, seed=1)
+        colors = [1, 2, 3, 4]
+        for game in range(2):
+            for index in range(25):
+                environment.cells[game, index] = colors[(index % 5 + index // 5 * 2) % 4]
+        environment.cells[:, 0] = 0
+        environment.cells[:, 24] = 0
+        scores, moved = environment.step([1, 1], [0, 0])
+        self.assertEqual(list(moved), [True, True])
+        self.assertEqual(list(environment.finished), [True, True])
+        environment.reset(numpy.array([True, False]))
+        self.assertEqual(list(environment.finished), [False, True])
+        self.assertEqual((environment.boards[0] != 0).sum(), environment.number_of_next_ball)
+
+    def test_observe(self):
+        """Test 'observe' method"""
+        environment = self.environment_class(2, 7)
+        boards, scores = environment.observe()
+        self.assertTrue(numpy.shares_memory(boards, environment.boards))
+        self.assertRaises(ValueError, boards.__setitem__, 0, 1)
+        environment.boards[:] = 3
+        self.assertTrue((boards == 3).all())
+
+
+class TestTournament(unittest.TestCase):
+    """Test the tournament of strategies"""
+
+    def test_strategies(self):
+        """Test that strategies make legal moves"""
+        for name in STRATEGIES:
+            test_field = Field(7, seed=3)
+            test_field.set_next_balls()
+            play_turns(test_field, 5)
+            start, end = get_strategy(name)(test_field, Random(1))
+            self.assertTrue(test_field.try_move(start[0], start[1], end[0], end[1]))
+
+    def test_greedy_line_strategy(self):
+        """Test 'greedy_line_strategy' function"""
+        test_field = Field(9)
+        for x in range(4):
+            test_field.set_ball(x, 0, Ball(2))
+        test_field.set_ball(4, 3, Ball(2))
+        test_field.set_ball(8, 8, Ball(3))
+        self.assertEqual(greedy_line_strategy(test_field, Random(1)), ((4, 3), (4, 0)))
+        test_field = Field(9)
+        for y in range(4):
+            test_field.set_ball(0, y, Ball(2))
+        self.assertEqual(greedy_line_strategy(test_field, Random(1)), ((0, 0), (0, 4)))
+
+    def test_get_strategy(self):
+        """Test 'get_strategy' function"""
+        self.assertIs(get_strategy("greedy"), greedy_line_strategy)
+        self.assertIs(get_strategy("tournament:random_strategy"), random_strategy)
+        self.assertRaises(UnknownStrategyError, get_strategy, "unknown")
+        self.assertRaises(UnknownStrategyError, get_strategy, "tournament:unknown")
+
+    def test_play_game(self):
+        """Test 'play_game' function"""
+        for engine in ENGINES:
+            result = play_game(random_strategy, 5, seed=8, engine=engine)
+            self.assertEqual(result, play_game(random_strategy, 5, seed=8, engine=engine))
+            self.assertEqual(result["result"], "game over")
+            self.assertGreater(result["moves"], 0)
+        self.assertEqual(play_game(greedy_line_strategy, 9, seed=1, max_moves=3)["result"], "move limit")
+
+    def test_run_tournament(self):
+        """Test 'run_tournament' function"""
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.jsonl")
+            summary = run_tournament(["random", "greedy"], [5, 6], 3, seed=2, processes=2, output=output, shard_size=2)
+            with open(output) as file:
+                self.assertEqual(len(file.readlines()), 12)
+        self.assertEqual(summary["games"], 12)
+        self.assertEqual([(group["strategy"], group["size"], group["games"]) for group in summary["groups"]],
+                         [("greedy", 5, 3), ("greedy", 6, 3), ("random", 5, 3), ("random", 6, 3)])
+        self.assertIn("moves/s", format_summary(summary))
+        summary = summarize([{"strategy": "random", "size": 5, "score": 0, "moves": 0, "seconds": 0}], 0)
+        self.assertIn("random", format_summary(summary))
+        self.assertNotEqual(get_strategy_seed(4), 4)
+
+
+class TestAdvisor(unittest.TestCase):
+    """Test the advisor of moves"""
+
+    def test_copy(self):
+        """Test 'copy' method of fields"""
+        for engine in ENGINES:
+            test_field = create_field(7, "Test", engine, seed=4)
+            test_field.set_next_balls()
+            play_turns(test_field, 6)
+            test_copy = test_field.copy()
+            self.assertEqual(test_copy.dump_cells(), test_field.dump_cells())
+            self.assertEqual(test_copy.score, test_field.score)
+            self.assertEqual(sorted(test_copy.legal_moves()), sorted(test_field.legal_moves()))
+            start, end = test_copy.legal_moves()[0]
+            test_copy.make_step(start[0], start[1], end[0], end[1])
+            test_copy.set_next_balls()
+            self.assertNotEqual(test_copy.dump_cells(), test_field.dump_cells())
+            test_field.make_step(start[0], start[1], end[0], end[1])
+            test_field.set_next_balls()
+            self.assertEqual(test_copy.dump_cells(), test_field.dump_cells())
+
+    def test_advise(self):
+        """Test 'advise' method"""
+        test_field = Field(9, seed=5)
+        test_field.set_next_balls()
+        play_turns(test_field, 10)
+        cells = test_field.dump_cells()
+        started = perf_counter()
+        move, value = Advisor(time_budget=0.1).advise(test_field)
+        self.assertLess(perf_counter() - started, 1)
+        self.assertEqual(test_field.dump_cells(), cells)
+        self.assertTrue(test_field.try_move(move[0][0], move[0][1], move[1][0], move[1][1]))
+        self.assertIn(Advisor(time_budget=0.01).advise(test_field)[0], test_field.legal_moves())
+        self.assertEqual(Advisor().advise(Field(5))[0], None)
+
+    def test_advise_line(self):
+        """Test that the advisor finishes the line"""
+        test_field = Field(9)
+        for x in range(4):
+            test_field.set_ball(x, 0, Ball(2))
+        test_field.set_ball(4, 3, Ball(2))
+        test_field.set_ball(8, 8, Ball(3))
+        test_field.next_balls = [Ball(1), Ball(1), Ball(1)]
+        self.assertEqual(Advisor().advise(test_field)[0], ((4, 3), (4, 0)))
+
+    def test_table_size(self):
+        """Test that the transposition table is bounded"""
+        test_field = Field(9, seed=2)
+        test_field.set_next_balls()
+        advisor = Advisor(time_budget=0.05, table_size=20)
+        advisor.advise(test_field)
+        self.assertLessEqual(len(advisor.table), 20)
+        self.assertGreaterEqual(advisor.depth, 1)
+
 
 if __name__ == '__main__':
     unittest.main()
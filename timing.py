@@ -0,0 +1,82 @@
+"""This file implement measuring of durations for the performance HUD"""
+from bisect import bisect_left
+from time import perf_counter
+
+# upper bounds of buckets of the histogram in milliseconds, the last bucket has no bound
+HISTOGRAM_BOUNDS = (1, 2, 4, 8, 16, 33, 66, 133)
+
+
+class Timing:
+    """Durations of one measured part of the program"""
+
+    def __init__(self):
+        """Initialize empty timing"""
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.longest = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def add(self, milliseconds):
+        """Add the duration"""
+        self.count += 1
+        self.total += milliseconds
+        self.last = milliseconds
+        self.longest = max(self.longest, milliseconds)
+        self.buckets[bisect_left(HISTOGRAM_BOUNDS, milliseconds)] += 1
+
+    @property
+    def mean(self):
+        """Mean duration"""
+        return self.total / self.count if self.count else 0.0
+
+
+class PerformanceStats:
+    """Timings of named parts of the program in milliseconds
+
+    Only counters and buckets of the histogram are kept, so the memory does
+    not grow with the length of the game.
+    """
+
+    def __init__(self):
+        """Initialize stats without timings"""
+        self.timings = {}
+
+    def add(self, name, milliseconds):
+        """Add the duration of the part"""
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = Timing()
+        timing.add(milliseconds)
+
+    def start(self):
+        """Get the moment to pass to stop"""
+        return perf_counter()
+
+    def stop(self, name, started):
+        """Add the duration from the moment got from start"""
+        self.add(name, (perf_counter() - started) * 1000)
+
+    def measure(self, name, function, *arguments):
+        """Call the function and add the duration of the call"""
+        started = perf_counter()
+        try:
+            return function(*arguments)
+        finally:
+            self.stop(name, started)
+
+    def summary(self):
+        """Get lines with the last, mean and longest durations"""
+        return [f"{name}: {timing.last:.2f} ms (mean {timing.mean:.2f}, max {timing.longest:.2f})"
+                for name, timing in self.timings.items()]
+
+    def histogram(self):
+        """Get lines of histograms of all parts"""
+        lines = []
+        labels = [f"<= {bound} ms" for bound in HISTOGRAM_BOUNDS] + [f"> {HISTOGRAM_BOUNDS[-1]} ms"]
+        for name, timing in self.timings.items():
+            lines.append(f"{name}: {timing.count} times, mean {timing.mean:.2f} ms, max {timing.longest:.2f} ms")
+            for label, amount in zip(labels, timing.buckets):
+                if amount:
+                    lines.append(f"  {label:>10}: {amount}")
+        return lines
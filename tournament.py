@@ -0,0 +1,219 @@
+"""This file implement the tournament of playing strategies run by many processes"""
+import sys
+import json
+import argparse
+import importlib
+from multiprocessing import Pool
+from random import Random
+from statistics import mean, median
+from time import perf_counter
+from core import *
+from driver import *
+
+
+def random_strategy(field, random):
+    """Move a random ball to a random cell it can reach"""
+    balls = [(x, y) for y in range(field.height) for x in range(field.width) if field.get_ball(x, y) is not None]
+    random.shuffle(balls)
+    for x, y in balls:
+        cells = field.reachable_cells(x, y)
+        if cells:
+            return (x, y), random.choice(cells)
+
+
+def greedy_line_strategy(field, random):
+    """Make the longest line of the color of the moved ball (a random move of the best ones)
+
+    The length for a free cell and a color is counted once per move. It is
+    counted again with the start cell left free only when the start lies in
+    line with the end close enough to be part of that line.
+    """
+    lengths = {}
+    best_moves = []
+    best_length = 0
+    for start, end in field.iter_legal_moves():
+        color = field.get_color_of_ball(start[0], start[1])
+        key = (end, color)
+        length = lengths.get(key)
+        if length is None:
+            length = lengths[key] = field.line_length(end[0], end[1], color)
+        offset_x, offset_y = abs(end[0] - start[0]), abs(end[1] - start[1])
+        if max(offset_x, offset_y) < field.balls_in_line and (not offset_x or not offset_y or offset_x == offset_y):
+            length = field.line_length(end[0], end[1], color, start)
+        if length > best_length:
+            best_moves = []
+            best_length = length
+        if length == best_length:
+            best_moves.append((start, end))
+    if best_moves:
+        return random.choice(best_moves)
+
+
+STRATEGIES = {"random": random_strategy, "greedy": greedy_line_strategy}
+
+
+def get_strategy(name):
+    """Get the strategy by name or by "module:function" of a plugged strategy
+
+    A strategy is a function of the field and of a random.Random, it returns
+    the move as ((start x, start y), (end x, end y)) or None without moves.
+    """
+    if name in STRATEGIES:
+        return STRATEGIES[name]
+    module_name, _, function_name = name.partition(":")
+    if not function_name:
+        raise UnknownStrategyError(f"Unknown strategy {name}")
+    try:
+        return getattr(importlib.import_module(module_name), function_name)
+    except (ImportError, AttributeError) as exception:
+        raise UnknownStrategyError(exception)
+
+
+def get_game_seed(seed, size, number):
+    """Get the seed of the game, every strategy plays the same games"""
+    return (seed << 32) | (size << 24) | number
+
+
+def get_strategy_seed(seed):
+    """Get the seed of the random choices of the strategy, it differs from the seed of spawns of the game"""
+    return None if seed is None else (seed << 1) | 1
+
+
+def play_game(strategy, size=9, seed=None, engine="list", max_moves=None):
+    """Play the game by the strategy and get the score and the amount of moves"""
+    field = create_field(size, "Bot", engine, seed)
+    field.set_next_balls()
+    random = Random(get_strategy_seed(seed))
+    moves = 0
+    result = "game over"
+    while max_moves is None or moves < max_moves:
+        move = strategy(field, random)
+        if move is None:
+            result = "no moves"
+            break
+        (start_x, start_y), (end_x, end_y) = move
+        if not field.try_move(start_x, start_y, end_x, end_y):
+            result = "illegal move"
+            break
+        field.make_step(start_x, start_y, end_x, end_y)
+        moves += 1
+        lines = field.scan_all_lines()
+        if lines is None:
+            try:
+                field.set_next_balls()
+            except FieldFullException:
+                break
+            lines = field.scan_all_lines()
+        field.delete_full_lines(lines)
+    else:
+        result = "move limit"
+    return {"score": field.score, "moves": moves, "result": result}
+
+
+def play_shard(task):
+    """Play games of the shard in a process of the pool"""
+    strategy_name, size, first, amount, seed, engine, max_moves = task
+    strategy = get_strategy(strategy_name)
+    results = []
+    for number in range(first, first + amount):
+        game_seed = get_game_seed(seed, size, number)
+        started = perf_counter()
+        result = play_game(strategy, size, game_seed, engine, max_moves)
+        result.update(strategy=strategy_name, size=size, game=number, seed=game_seed,
+                      seconds=round(perf_counter() - started, 6))
+        results.append(result)
+    return results
+
+
+def summarize(results, seconds):
+    """Aggregate results of games by strategies and sizes"""
+    groups = {}
+    for result in results:
+        groups.setdefault((result["strategy"], result["size"]), []).append(result)
+    summary = []
+    for (strategy, size), games in sorted(groups.items()):
+        scores = sorted(game["score"] for game in games)
+        moves = [game["moves"] for game in games]
+        playing = sum(game["seconds"] for game in games)
+        summary.append({"strategy": strategy, "size": size, "games": len(games),
+                        "score_mean": round(mean(scores), 2), "score_median": median(scores),
+                        "score_min": scores[0], "score_max": scores[-1],
+                        "score_quartiles": [scores[len(scores) // 4], scores[3 * len(scores) // 4]],
+                        "moves_mean": round(mean(moves), 2),
+                        "moves_per_second": round(sum(moves) / playing, 1) if playing else None})
+    total_moves = sum(result["moves"] for result in results)
+    return {"groups": summary, "games": len(results), "moves": total_moves, "seconds": round(seconds, 3),
+            "moves_per_second": round(total_moves / seconds, 1) if seconds else None}
+
+
+def run_tournament(strategies, sizes, games, seed=0, processes=None, output=None, shard_size=10,
+                   engine="list", max_moves=None):
+    """Play games of every strategy on every size in the pool of processes and get the summary
+
+    Games are split into shards of shard_size games, results of a shard are
+    written to the output file as lines of JSON when the shard is played.
+    """
+    for name in strategies:
+        get_strategy(name)
+    tasks = [(name, size, first, min(shard_size, games - first), seed, engine, max_moves)
+             for name in strategies for size in sizes for first in range(0, games, shard_size)]
+    results = []
+    started = perf_counter()
+    with Pool(processes) as pool:
+        file = open(output, "w") if output else None
+        try:
+            for shard in pool.imap_unordered(play_shard, tasks):
+                results.extend(shard)
+                if file is not None:
+                    file.write("".join(json.dumps(result) + "\n" for result in shard))
+                    file.flush()
+        finally:
+            if file is not None:
+                file.close()
+    return summarize(results, perf_counter() - started)
+
+
+def format_summary(summary):
+    """Get the summary as a text table"""
+    lines = [f"{'strategy':<12}{'size':>5}{'games':>7}{'mean':>10}{'median':>9}{'min':>7}{'max':>8}"
+             f"{'moves':>9}{'moves/s':>10}"]
+    for group in summary["groups"]:
+        moves_per_second = "-" if group["moves_per_second"] is None else group["moves_per_second"]
+        lines.append(f"{group['strategy']:<12}{group['size']:>5}{group['games']:>7}{group['score_mean']:>10}"
+                     f"{group['score_median']:>9}{group['score_min']:>7}{group['score_max']:>8}"
+                     f"{group['moves_mean']:>9}{moves_per_second:>10}")
+    lines.append(f"{summary['games']} games, {summary['moves']} moves in {summary['seconds']} s: "
+                 f"{summary['moves_per_second']} moves/s")
+    return "\n".join(lines)
+
+
+class UnknownStrategyError(Exception):
+    """There is no strategy with the name"""
+    pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tournament of strategies of game \"Lines\"")
+    parser.add_argument("--strategies", nargs="+", default=sorted(STRATEGIES),
+                        help="names of strategies (random, greedy) or module:function of plugged ones")
+    parser.add_argument("--sizes", nargs="+", type=int, choices=range(5, 16), default=[9], metavar="5..15",
+                        help="sizes of the field")
+    parser.add_argument("--games", type=int, default=100, help="amount of games of every strategy on every size")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the games")
+    parser.add_argument("--processes", type=int, help="amount of processes (all cores by default)")
+    parser.add_argument("--shard", type=int, default=10, help="amount of games in a task of a process")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="list", help="engine of the game field")
+    parser.add_argument("--max-moves", type=int, help="stop a game after the amount of moves")
+    parser.add_argument("--output", metavar="FILE", help="write results of games to the file as lines of JSON")
+    parser.add_argument("--summary", metavar="FILE", help="write the summary to the file as JSON")
+    arguments = parser.parse_args()
+    try:
+        tournament = run_tournament(arguments.strategies, arguments.sizes, arguments.games, arguments.seed,
+                                    arguments.processes, arguments.output, arguments.shard, arguments.engine,
+                                    arguments.max_moves)
+    except UnknownStrategyError as error:
+        sys.exit(f"Unknown strategy: {error}")
+    print(format_summary(tournament))
+    if arguments.summary:
+        with open(arguments.summary, "w") as summary_file:
+            json.dump(tournament, summary_file, indent=2)